@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # PRAGMA для SQLite на каждом новом соединении, см. core/db.py
+        from .db import apply_pragmas
+        connection_created.connect(apply_pragmas)
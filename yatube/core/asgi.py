@@ -0,0 +1,236 @@
+"""
+ASGI-приложение поверх WSGIHandler Django (см. yatube/asgi.py).
+
+Django 2.2 не умеет асинхронные вьюхи, поэтому вьюхи по-прежнему
+выполняются синхронно - в пуле из ASGI_THREADS потоков. Асинхронно,
+в цикле событий, идёт то, что под WSGI держит поток целиком: чтение тела
+запроса от медленного клиента и отправка готового ответа. Поток занят
+только пока работает Django, и процесс держит гораздо больше соединений,
+чем у него потоков.
+
+Исключение - большие тела с известной длиной (картинки постов): их
+Django читает прямо из соединения через BodyStream, и поток ждёт клиента.
+Иначе загрузка копировалась бы дважды - во временный файл здесь и в
+MEDIA_ROOT обработчиком posts/uploads.py. Тело больше body_limit()
+получает 413 до вызова Django.
+
+Потоковые ответы (выгрузки) генерируются в потоке пула по кускам
+и ждут, пока клиент примет каждый кусок.
+"""
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+
+class ASGIHandler:
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.ASGI_THREADS, thread_name_prefix='asgi'
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Неподдерживаемый тип соединения: '
+                             f'{scope["type"]}')
+        loop = asyncio.get_running_loop()
+        try:
+            body = await self.request_body(loop, scope, receive)
+        except BodyTooLarge:
+            await self.too_large(send)
+            return
+        if body is None:
+            # Клиент ушёл, не дослав запрос
+            return
+        response = await loop.run_in_executor(
+            self.executor, self.handle, loop, wsgi_environ(scope, body),
+            send
+        )
+        if response is not None:
+            # Готовый ответ клиент забирает без участия потока
+            started, content = response
+            await send({'type': 'http.response.start', **started})
+            await send({'type': 'http.response.body', 'body': content})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def request_body(self, loop, scope, receive):
+        """wsgi.input запроса; None, если клиент ушёл."""
+        length = content_length(scope)
+        limit = body_limit()
+        if length is not None and limit is not None and length > limit:
+            raise BodyTooLarge()
+        if (length is not None
+                and length > settings.FILE_UPLOAD_MAX_MEMORY_SIZE):
+            return BodyStream(loop, receive)
+        return await self.read_body(receive, limit)
+
+    async def too_large(self, send):
+        await send({
+            'type': 'http.response.start', 'status': 413,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+        })
+        await send({'type': 'http.response.body',
+                    'body': 'Слишком большой запрос.'.encode()})
+
+    async def read_body(self, receive, limit):
+        """
+        Тело запроса целиком; None, если клиент ушёл. Тела без длины
+        (chunked) большие, как и у Django, уходят во временный файл.
+        """
+        body = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if limit is not None and body.tell() > limit:
+                body.close()
+                raise BodyTooLarge()
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body
+
+    def handle(self, loop, environ, send):
+        """
+        Выполняется в потоке пула. Возвращает начало и тело ответа;
+        потоковый ответ отправляет сам и возвращает None.
+        """
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        response = self.wsgi_application(environ, start_response)
+        try:
+            if getattr(response, 'streaming', False):
+                send_message({'type': 'http.response.start', **started})
+                for chunk in response:
+                    send_message({'type': 'http.response.body',
+                                  'body': chunk, 'more_body': True})
+                send_message({'type': 'http.response.body'})
+                return None
+            return started, b''.join(response)
+        finally:
+            # request_finished закрывает соединения с базой этого потока
+            if hasattr(response, 'close'):
+                response.close()
+            environ['wsgi.input'].close()
+
+
+class BodyTooLarge(Exception):
+    """Тело запроса больше body_limit()."""
+
+
+class BodyStream:
+    """
+    wsgi.input, который читает тело прямо из соединения: поток пула
+    просит у цикла событий следующее сообщение, когда Django нужны данные.
+    """
+
+    def __init__(self, loop, receive):
+        self.loop = loop
+        self.receive = receive
+        self.buffer = b''
+        self.more_body = True
+
+    def read(self, size=-1):
+        while self.more_body and (size < 0 or len(self.buffer) < size):
+            message = asyncio.run_coroutine_threadsafe(
+                self.receive(), self.loop
+            ).result()
+            if message['type'] == 'http.disconnect':
+                # Django ответит на это UnreadablePostError
+                raise OSError('Клиент ушёл, не дослав запрос')
+            self.buffer += message.get('body', b'')
+            self.more_body = message.get('more_body', False)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        self.buffer = b''
+
+
+def content_length(scope):
+    """Заявленная длина тела или None."""
+    for name, value in scope['headers']:
+        if name.lower() == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def body_limit():
+    """
+    Больше этого тело не примет ни одна вьюха: поля формы до
+    DATA_UPLOAD_MAX_MEMORY_SIZE и картинка до IMAGE_UPLOAD_MAX_BYTES.
+    """
+    if settings.DATA_UPLOAD_MAX_MEMORY_SIZE is None:
+        return None
+    return (settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+            + settings.IMAGE_UPLOAD_MAX_BYTES)
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ для ASGI-запроса scope с телом body."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    result = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        # WSGI хранит путь байтами в строке latin-1
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        if name in result:
+            value = f'{result[name]},{value}'
+        result[name] = value
+    if not isinstance(body, BodyStream):
+        # У chunked-запроса длины нет, а без неё Django прочтёт пустое тело
+        result['CONTENT_LENGTH'] = str(body.seek(0, 2))
+        body.seek(0)
+    return result
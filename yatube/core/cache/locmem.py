@@ -0,0 +1,14 @@
+from django.core.cache.backends import locmem
+
+from core.metrics import record_cache
+
+_MISSING = object()
+
+
+class LocMemCache(locmem.LocMemCache):
+    """LocMemCache, который сообщает о попаданиях в core.metrics."""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _MISSING, version)
+        record_cache(hit=value is not _MISSING)
+        return default if value is _MISSING else value
@@ -0,0 +1,261 @@
+"""
+Двухуровневый кеш: L1 - LRU в памяти процесса, L2 - общий кеш.
+
+L2 - любой другой кеш из settings.CACHES (OPTIONS['SHARED']),
+например core.cache.sqlite.SQLiteCache. Каждая запись публикует в L2
+сообщение со списком изменённых ключей, а процессы перед чтением
+(и в начале каждого запроса) выбрасывают эти ключи из своего L1.
+"""
+import os
+import pickle
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.signals import request_started
+
+from core.metrics import record_cache
+
+# Сколько живут сообщения об изменениях в L2
+MESSAGE_TIMEOUT = 300
+# Если пропущено больше сообщений, проще очистить L1 целиком
+MAX_MESSAGES_PER_SYNC = 500
+CLEAR_ALL = '*'
+_MISSING = object()
+
+# Хранилища L1 общие для всех потоков процесса, как у LocMemCache
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class LocalStore:
+    """LRU-словарь процесса с номером последнего применённого сообщения."""
+
+    def __init__(self, name, channel, shared_alias, max_entries,
+                 sync_interval):
+        self.name = name
+        self.channel = channel
+        self.shared_alias = shared_alias
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.reset()
+        request_started.connect(
+            self.on_request_started, dispatch_uid=f'tiered-cache-{name}'
+        )
+
+    def reset(self):
+        self.data = OrderedDict()
+        self.stats = Counter()
+        self.seq = None
+        self.synced_at = 0
+        self.pid = os.getpid()
+        self.origin = f'{socket.gethostname()}:{self.pid}:{id(self)}'
+
+    @property
+    def seq_key(self):
+        return f'{self.channel}:seq'
+
+    def message_key(self, seq):
+        return f'{self.channel}:message:{seq}'
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return _MISSING
+            pickled, expires = entry
+            if expires is not None and expires <= time.time():
+                del self.data[key]
+                return _MISSING
+            self.data.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def put(self, key, value, expires):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.data[key] = (pickled, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+
+    def drop(self, keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def publish(self, shared, keys):
+        """Сообщает остальным процессам, что ключи keys изменились."""
+        try:
+            seq = shared.incr(self.seq_key)
+        except ValueError:
+            shared.add(self.seq_key, 0, None)
+            seq = shared.incr(self.seq_key)
+        shared.set(
+            self.message_key(seq), (self.origin, list(keys)), MESSAGE_TIMEOUT
+        )
+
+    def sync(self, shared):
+        """Применяет к L1 сообщения других процессов."""
+        if self.pid != os.getpid():
+            # Процесс появился через fork: копия L1 от родителя не годится
+            self.reset()
+        self.synced_at = time.monotonic()
+        current = shared.get(self.seq_key)
+        if current == self.seq:
+            return
+        if (current is None or self.seq is None or current < self.seq
+                or current - self.seq > MAX_MESSAGES_PER_SYNC):
+            # L2 очищен, сообщения потеряны или мы только запустились
+            self.clear()
+            self.seq = current
+            return
+        messages = shared.get_many(
+            [self.message_key(seq) for seq in range(self.seq + 1, current + 1)]
+        )
+        if len(messages) < current - self.seq:
+            self.clear()
+        for origin, keys in messages.values():
+            if CLEAR_ALL in keys:
+                self.clear()
+            elif origin != self.origin:
+                self.drop(keys)
+        self.seq = current
+
+    def maybe_sync(self, shared):
+        if time.monotonic() - self.synced_at >= self.sync_interval:
+            self.sync(shared)
+
+    def on_request_started(self, **kwargs):
+        self.sync(caches[self.shared_alias])
+
+
+class TieredCache(BaseCache):
+    """
+    Кеш L1 + L2 со статистикой попаданий.
+
+    OPTIONS:
+    SHARED - алиас общего кеша L2 в settings.CACHES;
+    CHANNEL - префикс ключей L2 для сообщений об изменениях;
+    MAX_ENTRIES - размер L1 в записях;
+    L1_TIMEOUT - сколько запись может жить в L1, секунд;
+    SYNC_INTERVAL - как часто вне запросов проверять сообщения, секунд.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options['SHARED']
+        self._l1_timeout = options.get('L1_TIMEOUT', 300)
+        name = location or 'default'
+        with _stores_lock:
+            if name not in _stores:
+                _stores[name] = LocalStore(
+                    name,
+                    options.get('CHANNEL', 'tiered-cache'),
+                    self._shared_alias,
+                    self._max_entries,
+                    options.get('SYNC_INTERVAL', 1),
+                )
+            self._store = _stores[name]
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _l1_expires(self, timeout=DEFAULT_TIMEOUT):
+        limit = time.time() + self._l1_timeout
+        expires = self.get_backend_timeout(timeout)
+        return limit if expires is None else min(expires, limit)
+
+    def stats(self):
+        """Попадания в L1 и L2, промахи и размер L1 в этом процессе."""
+        stats = dict(self._store.stats)
+        stats['l1_size'] = len(self._store.data)
+        return stats
+
+    def get(self, key, default=None, version=None):
+        made_key = self._key(key, version)
+        self._store.maybe_sync(self.shared)
+        value = self._store.get(made_key)
+        if value is not _MISSING:
+            self._store.stats['l1_hits'] += 1
+            record_cache(hit=True)
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._store.stats['misses'] += 1
+            record_cache(hit=False)
+            return default
+        self._store.stats['l2_hits'] += 1
+        record_cache(hit=True)
+        self._store.put(made_key, value, self._l1_expires())
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self._key(key, version)
+        self.shared.set(key, value, timeout, version=version)
+        self._store.put(made_key, value, self._l1_expires(timeout))
+        self._store.publish(self.shared, [made_key])
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self._key(key, version)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self._store.put(made_key, value, self._l1_expires(timeout))
+            self._store.publish(self.shared, [made_key])
+        return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        made_keys = []
+        for key, value in data.items():
+            made_key = self._key(key, version)
+            made_keys.append(made_key)
+            if key in failed:
+                self._store.drop([made_key])
+            else:
+                self._store.put(made_key, value, self._l1_expires(timeout))
+        self._store.publish(self.shared, made_keys)
+        return failed
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store.drop([self._key(key, version)])
+        return self.shared.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        made_key = self._key(key, version)
+        deleted = self.shared.delete(key, version=version)
+        self._store.drop([made_key])
+        self._store.publish(self.shared, [made_key])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        made_keys = [self._key(key, version) for key in keys]
+        self.shared.delete_many(keys, version=version)
+        self._store.drop(made_keys)
+        self._store.publish(self.shared, made_keys)
+
+    def incr(self, key, delta=1, version=None):
+        made_key = self._key(key, version)
+        value = self.shared.incr(key, delta, version=version)
+        self._store.put(made_key, value, self._l1_expires())
+        self._store.publish(self.shared, [made_key])
+        return value
+
+    def clear(self):
+        self.shared.clear()
+        self._store.clear()
+        self._store.publish(self.shared, [CLEAR_ALL])
@@ -0,0 +1,108 @@
+"""
+Настройка SQLite для работы под нагрузкой.
+
+apply_pragmas выставляет на каждом новом соединении PRAGMA из
+SQLITE_PRAGMAS: WAL, чтобы читатели не ждали писателя, synchronous=NORMAL,
+mmap, размер кеша страниц и busy_timeout.
+
+WriteQueue - очередь записи процесса. SQLite допускает одного писателя,
+и потоки, которые пишут одновременно, ждут друг друга в busy_timeout
+или получают "database is locked". Через очередь частые записи
+(комментарии, подписки) выполняет один поток, причём несколько
+накопившихся записей коммитятся одной транзакцией.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, transaction
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """Обработчик connection_created, подключается в CoreConfig.ready."""
+    if connection.vendor != 'sqlite':
+        return
+    in_memory = connection.is_in_memory_db()
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            # У базы в памяти нет файла: ни журнала на диске, ни mmap
+            if in_memory and name in ('journal_mode', 'mmap_size'):
+                continue
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+class WriteQueue:
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def enabled(self):
+        if not settings.SQLITE_WRITE_QUEUE or connection.vendor != 'sqlite':
+            return False
+        # Общую базу в памяти (так устроены тесты) поток-писатель
+        # заблокировал бы целиком; внутри чужой транзакции запись
+        # в другом потоке нарушила бы её атомарность
+        return not (connection.is_in_memory_db()
+                    or connection.in_atomic_block)
+
+    def run(self, func, *args, **kwargs):
+        """Выполняет func в транзакции и возвращает результат после коммита."""
+        if not self.enabled():
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        future = Future()
+        self.jobs.put((future, func, args, kwargs))
+        self._ensure_thread()
+        return future.result()
+
+    def _ensure_thread(self):
+        with self.lock:
+            # После fork поток родителя в дочернем процессе не работает
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(
+                    target=self._work, name='sqlite-writer', daemon=True
+                )
+                self.thread.start()
+
+    def _take(self):
+        batch = [self.jobs.get()]
+        while len(batch) < settings.SQLITE_WRITE_BATCH:
+            try:
+                batch.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        """Пары (future, результат или исключение) для пачки записей."""
+        try:
+            with transaction.atomic():
+                return [(future, func(*args, **kwargs), None)
+                        for future, func, args, kwargs in batch]
+        except Exception as error:
+            if len(batch) == 1:
+                return [(batch[0][0], None, error)]
+        # Пачка откатилась целиком: повторяем записи по одной, чтобы
+        # ошибка одной не отменила остальные
+        return [result for job in batch for result in self._commit([job])]
+
+    def _work(self):
+        while True:
+            batch = self._take()
+            try:
+                results = self._commit(batch)
+            finally:
+                connection.close_if_unusable_or_obsolete()
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+
+write_queue = WriteQueue()
@@ -0,0 +1,226 @@
+"""
+Метрики запросов: время, SQL, шаблоны, кеш и размер ответа по вьюхам.
+
+RequestMetricsMiddleware замеряет каждый запрос: это пара вызовов
+perf_counter на запрос и на SQL. Доля METRICS_SAMPLE_RATE из них
+складывается в гистограммы времени ответа по имени вьюхи. Гистограммы
+живут в памяти процесса, отдаёт их вьюха core.views.metrics (только
+для персонала). Запросы медленнее METRICS_SLOW_REQUEST_MS пишутся в лог
+все, вне зависимости от выборки, вместе с самыми долгими SQL.
+
+Время рендера считает бэкенд шаблонов TimedDjangoTemplates, попадания
+в кеш - бэкенды из core/cache, через record_cache().
+"""
+import heapq
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.django import Template as DjangoTemplate
+from django.template.backends.django import reraise
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы времени ответа, мс
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# Сколько самых долгих SQL запомнить для лога медленных запросов
+SLOW_QUERIES = 5
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Куча пар (время, SQL): самые долгие запросы
+        self.slowest = []
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+        item = (duration, sql)
+        if len(self.slowest) < SLOW_QUERIES:
+            heapq.heappush(self.slowest, item)
+        elif item > self.slowest[0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка connection.execute_wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, time.perf_counter() - start)
+
+
+def record_cache(hit):
+    metrics = _current.get()
+    if metrics is None:
+        return
+    if hit:
+        metrics.cache_hits += 1
+    else:
+        metrics.cache_misses += 1
+
+
+class ViewStats:
+    """Сводка по одной вьюхе."""
+
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.totals = dict.fromkeys((
+            'time_ms', 'queries', 'sql_ms', 'template_ms',
+            'cache_hits', 'cache_misses', 'bytes',
+        ), 0)
+        self.max_time_ms = 0
+        self.max_queries = 0
+
+    def add(self, sample):
+        self.count += 1
+        index = next(
+            (i for i, bound in enumerate(BUCKETS)
+             if sample['time_ms'] <= bound),
+            len(BUCKETS)
+        )
+        self.buckets[index] += 1
+        for name in self.totals:
+            self.totals[name] += sample[name]
+        self.max_time_ms = max(self.max_time_ms, sample['time_ms'])
+        self.max_queries = max(self.max_queries, sample['queries'])
+
+    def as_dict(self):
+        bounds = [f'<={bound}' for bound in BUCKETS] + [f'>{BUCKETS[-1]}']
+        return {
+            'count': self.count,
+            'histogram_ms': dict(zip(bounds, self.buckets)),
+            'mean': {
+                name: round(total / self.count, 3)
+                for name, total in self.totals.items()
+            },
+            'max_time_ms': round(self.max_time_ms, 3),
+            'max_queries': self.max_queries,
+        }
+
+
+class Registry:
+    """Гистограммы всех вьюх процесса."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def add(self, view, sample):
+        with self.lock:
+            self.views.setdefault(view, ViewStats()).add(sample)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                view: stats.as_dict()
+                for view, stats in sorted(self.views.items())
+            }
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+
+registry = Registry()
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name
+
+
+class RequestMetricsMiddleware:
+    """Замеряет запросы; ставится первой в MIDDLEWARE."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - start
+        self.record(request, response, metrics, elapsed)
+        return response
+
+    def record(self, request, response, metrics, elapsed):
+        sample = {
+            'time_ms': elapsed * 1000,
+            'queries': metrics.queries,
+            'sql_ms': metrics.sql_time * 1000,
+            'template_ms': metrics.template_time * 1000,
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+            # Размер потокового ответа заранее не известен
+            'bytes': 0 if response.streaming else len(response.content),
+        }
+        view = view_name(request)
+        # Выборка - только для гистограмм, медленный запрос виден всегда
+        if random.random() < settings.METRICS_SAMPLE_RATE:
+            registry.add(view, sample)
+        if sample['time_ms'] >= settings.METRICS_SLOW_REQUEST_MS:
+            queries = '\n'.join(
+                f'  {duration * 1000:.1f} ms: {sql}'
+                for duration, sql in sorted(metrics.slowest, reverse=True)
+            )
+            logger.warning(
+                'Медленный запрос %s %s (%s): %.1f ms, SQL: %d за %.1f ms, '
+                'шаблоны: %.1f ms\n%s',
+                request.method, request.path, view, sample['time_ms'],
+                sample['queries'], sample['sql_ms'], sample['template_ms'],
+                queries
+            )
+
+
+class TimedTemplate(DjangoTemplate):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблоны Django с замером времени рендера для RequestMetrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(
+                self.engine.get_template(template_name), self
+            )
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
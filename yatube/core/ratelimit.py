@@ -0,0 +1,102 @@
+"""
+Ограничение частоты записи: корзина токенов на пользователя и на IP.
+
+Лимиты задаются в RATELIMITS по имени, например
+{'user': (10, 60), 'ip': (30, 60)} - корзина на 10 запросов, которая
+наполняется за 60 секунд, и такая же на 30 запросов для IP. Декоратор
+ratelimit(имя) включает их на вьюхе.
+
+Корзина хранится в кеше RATELIMIT_CACHE одним числом: временем, когда
+она снова станет полной, в миллисекундах (GCRA - та же корзина
+токенов, записанная через время). Запрос сдвигает его атомарным incr,
+поэтому одновременные запросы из разных процессов токены не теряют.
+
+Отклонённый запрос не трогает базу: декоратор ставится снаружи
+login_required, сначала проверяет IP, потом берёт id пользователя
+из сессии, не загружая request.user, и отвечает 429 без шаблона.
+Сессии хранятся в кеше (SESSION_ENGINE cached_db), база читается
+только при промахе. Корзина привязана к id, а не к ключу сессии: вход
+выдаёт новый ключ, и с ним обнулялась бы корзина. Сам вход ограничен
+по IP.
+"""
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+def take(key, count, period):
+    """
+    Берёт токен из корзины key на count запросов за period секунд.
+    Возвращает 0 или через сколько секунд появится следующий токен.
+    """
+    cache = caches[settings.RATELIMIT_CACHE]
+    interval = period * 1000 // count
+    now = int(time.time() * 1000)
+    cache.add(key, now, period)
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        # Ключ истёк между add и incr: корзина полна
+        full_at = now - 1
+    if full_at - interval < now:
+        # Корзина простаивала и полна, отсчёт идёт от текущего момента.
+        # Одновременный запрос здесь может получить лишний токен - только
+        # пока корзина полна
+        cache.set(key, now + interval, period)
+        return 0
+    wait = full_at - period * 1000 - now
+    if wait > 0:
+        # Отказ токен не тратит
+        cache.decr(key, interval)
+        return math.ceil(wait / 1000)
+    # Запись должна жить, пока корзина не наполнится
+    cache.touch(key, math.ceil((full_at - now) / 1000))
+    return 0
+
+
+def client_key(request, scope):
+    """Кого ограничивает лимит scope: id пользователя или IP."""
+    if scope == 'ip':
+        return request.META.get('REMOTE_ADDR')
+    session = getattr(request, 'session', None)
+    return session and session.get(SESSION_KEY)
+
+
+def check(request, name):
+    """0 или через сколько секунд повторить запрос к вьюхе name."""
+    limits = settings.RATELIMITS.get(name, {})
+    # Сначала IP: отказ по нему не читает даже сессию
+    for scope in sorted(limits, key=lambda scope: scope != 'ip'):
+        client = client_key(request, scope)
+        # Анонимам хватает лимита по IP
+        if client:
+            count, period = limits[scope]
+            wait = take(f'ratelimit:{name}:{scope}:{client}', count, period)
+            if wait:
+                return wait
+    return 0
+
+
+def ratelimit(name, methods=('POST',)):
+    """Лимиты RATELIMITS[name] для запросов с методами methods."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                wait = check(request, name)
+                if wait:
+                    response = HttpResponse(
+                        'Слишком много запросов, повторите позже.',
+                        content_type='text/plain; charset=utf-8',
+                        status=429,
+                    )
+                    response['Retry-After'] = str(wait)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,104 @@
+"""
+Чтение лент с реплик базы.
+
+ReplicaMiddleware выбирает на запрос одну реплику из DATABASE_REPLICAS,
+если вьюха есть в REPLICA_VIEWS, и ReplicaRouter отправляет на неё
+чтение моделей из REPLICA_APPS. Запись, сессии, пользователи и все
+прочие вьюхи работают с default.
+
+Реплика отстаёт от основной базы на время до REPLICA_LAG секунд,
+поэтому:
+- вьюха, которая записала данные, вызывает mark_write(request), и
+  посетитель получает cookie REPLICA_COOKIE на REPLICA_LAG секунд:
+  пока она есть, он читает основную базу и видит свою запись;
+- кеш лент (posts/feed_cache.py) строит страницы ленты, в которую
+  писали позже REPLICA_LAG секунд назад, по основной базе (lagging,
+  use_primary) - иначе отставшая страница попала бы в кеш нового
+  поколения.
+
+Локально реплики - копии db.sqlite3, их обновляет команда sync_replicas.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_replica = ContextVar('replica', default=None)
+
+
+def mark_write(request):
+    """Следующие REPLICA_LAG секунд посетитель читает основную базу."""
+    request.replica_write = True
+
+
+def lagging(generation):
+    """
+    Может ли реплика запроса ещё не знать о записи с поколением
+    generation (время записи в наносекундах, см. feed_cache).
+    """
+    if _replica.get() is None:
+        return False
+    return time.time_ns() - generation < settings.REPLICA_LAG * 10 ** 9
+
+
+@contextmanager
+def use_primary():
+    """Чтение внутри блока идёт в основную базу."""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in settings.REPLICA_APPS:
+            return _replica.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии default, объекты из них можно связывать
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Схему реплики получают вместе с копией основной базы
+        return db == 'default'
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            if hasattr(request, 'replica_token'):
+                _replica.reset(request.replica_token)
+        if getattr(request, 'replica_write', False):
+            response.set_cookie(
+                settings.REPLICA_COOKIE, '1', max_age=settings.REPLICA_LAG,
+                httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = settings.DATABASE_REPLICAS
+        if (not replicas
+                or request.method not in ('GET', 'HEAD')
+                or settings.REPLICA_COOKIE in request.COOKIES
+                or request.resolver_match.view_name
+                not in settings.REPLICA_VIEWS):
+            return None
+        # Одна реплика на весь запрос: все чтения видят один снимок
+        request.replica_token = _replica.set(random.choice(replicas))
+        return None
@@ -0,0 +1,43 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище, где имя файла - SHA-256 его содержимого.
+
+    Одинаковые загрузки ложатся в один файл, каталог из upload_to
+    и расширение сохраняются: posts/ab/ab12...ef.jpg. Файлы, на которые
+    больше никто не ссылается, удаляет команда gc_media.
+    """
+
+    @staticmethod
+    def hashed_name(name, digest):
+        directory, filename = posixpath.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + ext)
+
+    @staticmethod
+    def content_hash(content):
+        # Обработчик загрузки (posts/uploads.py) считает хеш на лету
+        digest = getattr(content, 'sha256', None)
+        if digest:
+            return digest
+        sha256 = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        return sha256.hexdigest()
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, self.content_hash(content))
+        if self.exists(name):
+            # Свежий mtime не даст gc_media удалить файл, пока запись,
+            # которая на него сошлётся, ещё не закоммичена
+            os.utime(self.path(name))
+            return name
+        return super()._save(name, content)
@@ -1,7 +1,29 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future
+from unittest import mock
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.test import Client, TestCase
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import IntegrityError, connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from posts import feed_cache
+from posts.models import Comment, Post
+from posts.tests.utils import bump_feeds_immediately
+
+from . import replicas
+from .asgi import ASGIHandler
+from .ratelimit import take
+from .cache.sqlite import SQLiteCache
+from .cache.tiered import TieredCache
+from .db import WriteQueue
+from .metrics import registry
 
 User = get_user_model()
 
@@ -28,3 +50,406 @@ class URLTests(TestCase):
                 with self.subTest(url=url):
                     response = URLTests.authorized_client.get(url)
                     self.assertTemplateUsed(response, template)
+
+
+# Общий файл кеша, который видят все "процессы" в тестах
+TEMP_CACHE_DIR = tempfile.mkdtemp()
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'test-shared': {
+        'BACKEND': 'core.cache.sqlite.SQLiteCache',
+        'LOCATION': os.path.join(TEMP_CACHE_DIR, 'cache.sqlite3'),
+    },
+})
+class TieredCacheTests(SimpleTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_CACHE_DIR, ignore_errors=True)
+
+    def make_cache(self, name):
+        # У каждого экземпляра свой L1, как у отдельного процесса
+        return TieredCache(f'{self.id()}-{name}', {'OPTIONS': {
+            'SHARED': 'test-shared',
+            'CHANNEL': self.id(),
+            'SYNC_INTERVAL': 0,
+        }})
+
+    def test_write_in_one_process_invalidates_another(self):
+        first, second = self.make_cache('first'), self.make_cache('second')
+        first.set('key', 'старое')
+        self.assertEqual(second.get('key'), 'старое')
+        self.assertEqual(second.get('key'), 'старое')
+        first.set('key', 'новое')
+        self.assertEqual(second.get('key'), 'новое')
+        first.delete('key')
+        self.assertIsNone(second.get('key'))
+        self.assertEqual(
+            second.stats(),
+            {'l1_hits': 1, 'l2_hits': 2, 'misses': 1, 'l1_size': 0}
+        )
+
+    def test_incr_and_clear_are_shared(self):
+        first, second = self.make_cache('first'), self.make_cache('second')
+        self.assertTrue(first.add('counter', 1))
+        self.assertFalse(second.add('counter', 5))
+        self.assertEqual(second.incr('counter'), 2)
+        self.assertEqual(first.get('counter'), 2)
+        second.clear()
+        self.assertIsNone(first.get('counter'))
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SQLiteCache(
+            os.path.join(self.directory, 'cache.sqlite3'), {}
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_expired_keys_are_missing_and_replaceable(self):
+        self.cache.set('key', 'значение', timeout=0)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'новое'))
+        self.assertEqual(self.cache.get('key'), 'новое')
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+
+@override_settings(METRICS_SAMPLE_RATE=1)
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.staff_client = Client()
+        self.staff_client.force_login(RequestMetricsTests.staff)
+
+    def test_view_metrics_are_aggregated(self):
+        url = reverse('posts:index')
+        self.client.get(url)
+        self.client.get(url)
+        stats = registry.snapshot()['posts:index']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(sum(stats['histogram_ms'].values()), 2)
+        self.assertGreater(stats['max_queries'], 0)
+        self.assertGreater(stats['mean']['template_ms'], 0)
+        self.assertGreater(stats['mean']['bytes'], 0)
+        self.assertGreater(stats['mean']['cache_hits'], 0)
+        self.assertGreater(stats['mean']['cache_misses'], 0)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        url = reverse('metrics')
+        self.client.get(reverse('posts:index'))
+        self.assertEqual(self.client.get(url).status_code, 302)
+        data = self.staff_client.get(url).json()
+        self.assertIn('posts:index', data['views'])
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_queries(self):
+        with self.assertLogs('core.metrics', 'WARNING') as logs:
+            self.client.get(reverse('posts:index'))
+        self.assertIn('posts:index', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_skip_histograms(self):
+        self.client.get(reverse('posts:index'))
+        self.assertEqual(registry.snapshot(), {})
+
+    @override_settings(METRICS_SAMPLE_RATE=0, METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_outside_sample(self):
+        with self.assertLogs('core.metrics', 'WARNING') as logs:
+            self.client.get(reverse('posts:index'))
+        self.assertIn('SELECT', logs.output[0])
+        self.assertEqual(registry.snapshot(), {})
+
+
+class SQLiteTuningTests(TestCase):
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(
+                cursor.fetchone()[0],
+                settings.SQLITE_PRAGMAS['busy_timeout']
+            )
+
+    def test_queue_runs_inline_in_memory_db(self):
+        write_queue = WriteQueue()
+        user = write_queue.run(User.objects.create_user, username='inline')
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+        self.assertIsNone(write_queue.thread)
+
+    def test_failed_write_does_not_roll_back_batch(self):
+        batch = [
+            (Future(), User.objects.create_user, (), {'username': 'first'}),
+            (Future(), User.objects.create_user, (), {'username': 'first'}),
+            (Future(), User.objects.create_user, (), {'username': 'second'}),
+        ]
+        results = WriteQueue()._commit(batch)
+        errors = [error for _, _, error in results]
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], IntegrityError)
+        self.assertIsNone(errors[2])
+        self.assertEqual(
+            User.objects.filter(username__in=['first', 'second']).count(), 2
+        )
+
+
+@override_settings(DATABASE_REPLICAS=['default'])
+@bump_feeds_immediately
+class ReplicaRoutingTests(TestCase):
+    # Реплика в тестах - сама тестовая база; выбор реплики
+    # перехватывается, чтобы проверить, куда ушёл запрос
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(ReplicaRoutingTests.user)
+        patcher = mock.patch.object(
+            replicas.random, 'choice', return_value='default'
+        )
+        self.choice = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_read_views_use_replica(self):
+        self.client.get(reverse('posts:index'))
+        self.choice.assert_called_once_with(['default'])
+
+    def test_other_views_use_primary(self):
+        self.client.get(reverse('posts:search'), {'q': 'Пост'})
+        self.client.get(reverse('posts:post_create'))
+        self.choice.assert_not_called()
+
+    def test_read_after_write_uses_primary(self):
+        response = self.client.post(
+            reverse('posts:add_comment', args=[self.post.pk]),
+            {'text': 'Комментарий'}
+        )
+        cookie = response.cookies[settings.REPLICA_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_LAG)
+        self.client.get(reverse('posts:post_detail', args=[self.post.pk]))
+        self.choice.assert_not_called()
+
+    def test_router_sends_only_posts_models_to_replica(self):
+        router = replicas.ReplicaRouter()
+        token = replicas._replica.set('replica-1')
+        try:
+            self.assertEqual(router.db_for_read(Post), 'replica-1')
+            self.assertIsNone(router.db_for_read(User))
+            self.assertEqual(router.db_for_write(Post), 'default')
+        finally:
+            replicas._replica.reset(token)
+
+    def test_fresh_feed_is_built_on_primary(self):
+        def build(post_id):
+            used.append(replicas._replica.get())
+            return {'post': self.post}
+
+        used = []
+        token = replicas._replica.set('default')
+        try:
+            feed_cache.bump(f'post:{self.post.pk}')
+            feed_cache.cached_post(self.post.pk, build)
+            with override_settings(REPLICA_LAG=0):
+                feed_cache.bump(f'post:{self.post.pk}')
+                feed_cache.cached_post(self.post.pk, build)
+        finally:
+            replicas._replica.reset(token)
+        self.assertEqual(used, [None, 'default'])
+
+
+class ASGIHandlerTests(SimpleTestCase):
+    def call(self, application, scope, messages):
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/',
+            'query_string': b'', 'headers': [], **scope,
+        }
+        asyncio.run(application(scope, receive, send))
+        return sent
+
+    def test_request_is_translated_to_wsgi(self):
+        def application(environ, start_response):
+            start_response('201 Created', [('X-Path', environ['PATH_INFO'])])
+            return [
+                environ['QUERY_STRING'].encode(),
+                environ['HTTP_X_TAG'].encode(),
+                environ['CONTENT_TYPE'].encode(),
+                environ['CONTENT_LENGTH'].encode(),
+                environ['wsgi.input'].read(),
+            ]
+
+        sent = self.call(ASGIHandler(application), {
+            'method': 'POST', 'path': '/a b/', 'query_string': b'q=1',
+            'headers': [(b'x-tag', b'one'), (b'x-tag', b'two'),
+                        (b'content-type', b'text/plain')],
+        }, [
+            {'type': 'http.request', 'body': b'he', 'more_body': True},
+            {'type': 'http.request', 'body': b'llo'},
+        ])
+        self.assertEqual(sent[0]['status'], 201)
+        self.assertIn((b'x-path', b'/a b/'), sent[0]['headers'])
+        # Длина chunked-тела берётся из прочитанного
+        self.assertEqual(sent[1]['body'], b'q=1one,twotext/plain5hello')
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=3,
+                       IMAGE_UPLOAD_MAX_BYTES=2)
+    def test_too_large_body_gets_413(self):
+        def application(environ, start_response):
+            raise AssertionError('Вьюха не должна вызываться')
+
+        declared = self.call(ASGIHandler(application), {
+            'method': 'POST', 'headers': [(b'content-length', b'6')],
+        }, [])
+        chunked = self.call(ASGIHandler(application), {'method': 'POST'}, [
+            {'type': 'http.request', 'body': b'abc', 'more_body': True},
+            {'type': 'http.request', 'body': b'def', 'more_body': True},
+        ])
+        self.assertEqual(declared[0]['status'], 413)
+        self.assertEqual(chunked[0]['status'], 413)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=2)
+    def test_large_body_is_streamed_to_view(self):
+        messages = [
+            {'type': 'http.request', 'body': b'he', 'more_body': True},
+            {'type': 'http.request', 'body': b'llo'},
+        ]
+
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            # Django читает тело сам, по мере надобности
+            first = environ['wsgi.input'].read(1)
+            waiting = len(messages)
+            return [first, environ['wsgi.input'].read(), str(waiting).encode()]
+
+        sent = self.call(ASGIHandler(application), {
+            'method': 'POST', 'headers': [(b'content-length', b'5')],
+        }, messages)
+        self.assertEqual(sent[1]['body'], b'hello1')
+
+    def test_django_view_is_served(self):
+        application = ASGIHandler(WSGIHandler())
+        sent = self.call(application, {'path': reverse('about:author')},
+                         [{'type': 'http.request'}])
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn('text/html', dict(sent[0]['headers'])[b'content-type']
+                      .decode())
+        self.assertTrue(sent[1]['body'])
+
+    def test_disconnect_before_body_skips_view(self):
+        def application(environ, start_response):
+            raise AssertionError('Вьюха не должна вызываться')
+
+        sent = self.call(ASGIHandler(application), {'method': 'POST'},
+                         [{'type': 'http.disconnect'}])
+        self.assertEqual(sent, [])
+
+    def test_lifespan(self):
+        sent = self.call(ASGIHandler(None), {'type': 'lifespan'}, [
+            {'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'},
+        ])
+        self.assertEqual([message['type'] for message in sent], [
+            'lifespan.startup.complete', 'lifespan.shutdown.complete',
+        ])
+
+
+@override_settings(RATELIMITS={
+    'comment': {'user': (2, 60), 'ip': (3, 60)},
+    'signup': {'ip': (1, 3600)},
+    'login': {'ip': (1, 60)},
+})
+class RateLimitTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='writer')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('posts:add_comment', args=[self.post.pk])
+
+    def client_for(self, user):
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def test_bucket_refills_over_time(self):
+        with mock.patch('core.ratelimit.time.time', return_value=1000.0):
+            self.assertEqual(take('bucket', 2, 60), 0)
+            self.assertEqual(take('bucket', 2, 60), 0)
+            self.assertEqual(take('bucket', 2, 60), 30)
+            # Отказ токен не тратит
+            self.assertEqual(take('bucket', 2, 60), 30)
+        with mock.patch('core.ratelimit.time.time', return_value=1030.0):
+            self.assertEqual(take('bucket', 2, 60), 0)
+            self.assertEqual(take('bucket', 2, 60), 30)
+
+    def test_user_limit_rejects_without_queries(self):
+        client = self.client_for(self.user)
+        client.post(self.url, {'text': 'Раз'})
+        client.post(self.url, {'text': 'Два'})
+        with self.assertNumQueries(0):
+            response = client.post(self.url, {'text': 'Три'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_ip_limit_spans_users(self):
+        other = User.objects.create_user(username='other')
+        self.client_for(self.user).post(self.url, {'text': 'Раз'})
+        self.client_for(self.user).post(self.url, {'text': 'Два'})
+        self.client_for(other).post(self.url, {'text': 'Три'})
+        response = self.client_for(other).post(self.url, {'text': 'Четыре'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_reads_are_not_limited(self):
+        client = self.client_for(self.user)
+        for _ in range(3):
+            client.post(self.url, {'text': 'Коммент'})
+        response = client.get(reverse('posts:post_detail',
+                                      args=[self.post.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_limit_survives_new_login(self):
+        self.client_for(self.user).post(self.url, {'text': 'Раз'})
+        self.client_for(self.user).post(
+            self.url, {'text': 'Два'}, REMOTE_ADDR='10.0.0.2'
+        )
+        # Новая сессия и другой IP, но пользователь тот же
+        response = self.client_for(self.user).post(
+            self.url, {'text': 'Три'}, REMOTE_ADDR='10.0.0.3'
+        )
+        self.assertEqual(response.status_code, 429)
+
+    def test_login_is_limited_by_ip(self):
+        url = reverse('users:login')
+        self.client.post(url, {'username': 'writer', 'password': 'x'})
+        response = self.client.post(url, {'username': 'writer',
+                                          'password': 'x'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_signup_is_limited_by_ip(self):
+        url = reverse('users:signup')
+        self.client.post(url, {})
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.post(url, {}).status_code, 429)
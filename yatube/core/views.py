@@ -1,5 +1,10 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render
 
+from .metrics import registry
+
 
 def page_not_found(request, exception):
     """Вывод кастомной страны ошибки 404."""
@@ -21,3 +26,12 @@ def internal_server_error(request):
     template = 'core/500.html'
     context = {'path': request.path}
     return render(request, template, context, status=500)
+
+
+@staff_member_required
+def metrics(request):
+    """Метрики запросов этого процесса в JSON, см. core/metrics.py."""
+    return JsonResponse({
+        'sample_rate': settings.METRICS_SAMPLE_RATE,
+        'views': registry.snapshot(),
+    }, json_dumps_params={'ensure_ascii': False})
@@ -1,10 +1,25 @@
 from django.contrib import admin
 
+from . import search
 # Из модуля models импортируем модель Post
 from .models import Comment, Follow, Group, Post
 
 
-class PostAdmin(admin.ModelAdmin):
+class IndexedSearchMixin:
+    """Поиск в админке по полнотекстовому индексу, а не LIKE '%...%'."""
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search.query_terms(search_term):
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        ids = search.matching_ids(search_term, self.search_kind)
+        return queryset.filter(pk__in=ids), False
+
+
+class PostAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = search.POST
     # Перечисляем поля, которые должны отображаться в админке
     list_display = ('pk', 'text', 'pub_date', 'author', 'group',)
     # Добавляем интерфейс для поиска по тексту постов
@@ -15,7 +30,8 @@ class PostAdmin(admin.ModelAdmin):
     list_editable = ('group',)
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = search.COMMENT
     list_display = ('pk', 'text', 'created', 'author', 'post',)
     search_fields = ('text',)
     list_filter = ('created',)
@@ -0,0 +1,194 @@
+"""
+JSON API для чтения лент, постов и комментариев.
+
+Страницы листаются по тем же курсорам, что и HTML-ленты (?after=,
+?before=), ?fields=id,text оставляет в ответе только нужные поля.
+
+ETag считается по поколениям лент из posts/feed_cache.py
+без запросов к базе: пока в ленту ничего не записали, повторный запрос
+с If-None-Match получает 304 и до выборки постов не доходит.
+"""
+import hashlib
+from functools import wraps
+
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_safe
+
+from . import feed_cache
+from .models import Group, Post, User
+from .paginators import KeysetPaginator
+from .templatetags.post_images import post_picture
+from .timeline import follow_paginator
+from .views import COUNT_POST, comment_page, post_detail_data
+
+POST_FIELDS = ('id', 'text', 'pub_date', 'author', 'group', 'image',
+               'picture')
+COMMENT_FIELDS = ('id', 'author', 'text', 'created')
+
+
+def serialize_post(post):
+    return {
+        'id': post.pk,
+        'text': post.text,
+        'pub_date': post.pub_date.isoformat(),
+        'author': post.author.username,
+        'group': post.group.slug if post.group else None,
+        'image': post.image.url if post.image else None,
+        # Варианты для srcset, None - ещё строятся
+        'picture': post_picture(post),
+    }
+
+
+def serialize_comment(comment):
+    return {
+        'id': comment.pk,
+        'author': comment.author.username,
+        'text': comment.text,
+        'created': comment.created.isoformat(),
+    }
+
+
+def requested_fields(request, allowed):
+    """Поля из ?fields=, None - все. Неизвестные поля - ValueError."""
+    fields = request.GET.get('fields')
+    if not fields:
+        return None
+    fields = fields.split(',')
+    unknown = set(fields) - set(allowed)
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    return fields
+
+
+def sparse(request, data):
+    """Оставляет поля, которые запросили в ?fields=."""
+    if request.api_fields is None:
+        return data
+    return {field: data[field] for field in request.api_fields}
+
+
+def with_fields(view, allowed):
+    """
+    Проверяет ?fields= до вьюхи: ответ на неверный запрос не зависит
+    от того, есть ли что-то в ленте.
+    """
+    @wraps(view)
+    def wrapper(request, **kwargs):
+        try:
+            request.api_fields = requested_fields(request, allowed)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        return view(request, **kwargs)
+    return wrapper
+
+
+def page_response(request, page, serialize):
+    return JsonResponse({
+        'results': [sparse(request, serialize(row)) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+def conditional(feeds, fields=POST_FIELDS):
+    """
+    Условный GET по поколениям лент feeds(request, **kwargs). Сильный
+    ETag - хеш поколений и адреса запроса вместе с параметрами.
+    Last-Modified не отдаётся: у него точность в секунду, и запись в ту же
+    секунду, что и прошлый ответ, получила бы устаревший 304.
+    Допустимые поля ?fields= - fields.
+    """
+    def etag(request, **kwargs):
+        parts = [request.get_full_path(), str(request.user.pk)]
+        parts += (
+            str(feed_cache.generation(feed))
+            for feed in feeds(request, **kwargs)
+        )
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+    def decorator(view):
+        conditional_view = with_fields(condition(etag)(view), fields)
+
+        @require_safe
+        @wraps(view)
+        def wrapper(request, **kwargs):
+            try:
+                return conditional_view(request, **kwargs)
+            except Http404:
+                return JsonResponse({'error': 'Не найдено'}, status=404)
+        return wrapper
+    return decorator
+
+
+def feed_page(request, feed, post_list, paginator=None):
+    if paginator is None:
+        paginator = KeysetPaginator(post_list, COUNT_POST)
+    page = feed_cache.cached_page(
+        feed, paginator, request.GET.get('after'), request.GET.get('before')
+    )
+    return page_response(request, page, serialize_post)
+
+
+def group_id(slug):
+    # Ключ ленты группы - её id, по slug его находит запрос по индексу
+    return get_object_or_404(Group.objects.only('pk'), slug=slug).pk
+
+
+def author_id(username):
+    return get_object_or_404(User.objects.only('pk'), username=username).pk
+
+
+@conditional(lambda request: ['index'])
+def index(request):
+    return feed_page(request, 'index', Post.objects.for_feed())
+
+
+@conditional(lambda request, slug: [f'group:{group_id(slug)}'])
+def group_posts(request, slug):
+    pk = group_id(slug)
+    return feed_page(
+        request, f'group:{pk}', Post.objects.filter(group_id=pk).for_feed()
+    )
+
+
+@conditional(lambda request, username: [f'profile:{author_id(username)}'])
+def profile(request, username):
+    pk = author_id(username)
+    return feed_page(
+        request, f'profile:{pk}',
+        Post.objects.filter(author_id=pk).for_feed()
+    )
+
+
+def login_required_json(view):
+    @wraps(view)
+    def wrapper(request, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Нужно войти'}, status=401)
+        return view(request, **kwargs)
+    return wrapper
+
+
+@login_required_json
+@conditional(lambda request: [f'follow:{request.user.pk}'])
+def follow_index(request):
+    return feed_page(
+        request, f'follow:{request.user.pk}', None,
+        follow_paginator(request.user, COUNT_POST)
+    )
+
+
+@conditional(lambda request, post_id: [f'post:{post_id}'])
+def post_detail(request, post_id):
+    post = feed_cache.cached_post(post_id, post_detail_data)['post']
+    return JsonResponse(sparse(request, serialize_post(post)),
+                        json_dumps_params={'ensure_ascii': False})
+
+
+@conditional(lambda request, post_id: [f'post:{post_id}'], COMMENT_FIELDS)
+def comments(request, post_id):
+    get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    return page_response(
+        request, comment_page(request, post_id), serialize_comment
+    )
@@ -0,0 +1,161 @@
+"""Общие помощники для команд-бенчмарков (manage.py benchmark_*)."""
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings
+from faker import Faker
+
+from . import timeline
+from .counters import recount_authors, recount_groups
+from .models import Comment, Follow, Group, Post, User
+
+# Сколько строк вставлять одним bulk_create
+BATCH_SIZE = 10000
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    index = max(0, round(percent / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def measure(func, repeat, setup=None):
+    """
+    Время выполнения func в миллисекундах: p50, p95 и среднее.
+    setup, если задан, вызывается перед каждым замером вне его.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+    }
+
+
+def peak_memory(func):
+    """Результат func и пик памяти, выделенной Python за её вызов, в МБ."""
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, round(peak / 2 ** 20, 1)
+
+
+@contextmanager
+def temporary_database():
+    """
+    Временная база со схемой проекта и свои кеши на время бенчмарка.
+    Рабочая база не блокируется на запись, а её кеш - поколения лент
+    и корзины лимитов - не сбрасывается. Реплики не используются.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        old_name = connection.settings_dict['NAME']
+        connection.settings_dict['TEST'] = {
+            'NAME': os.path.join(directory, 'benchmark.sqlite3')
+        }
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(CACHES=_temporary_caches(directory),
+                                   DATABASE_REPLICAS=[]):
+                yield
+        finally:
+            connection.close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def _temporary_caches(directory):
+    """Те же бэкенды кеша, но в своей памяти и своих файлах."""
+    result = {}
+    for alias, config in settings.CACHES.items():
+        location = f'benchmark-{alias}'
+        if config['BACKEND'] == 'core.cache.sqlite.SQLiteCache':
+            location = os.path.join(directory, f'{location}.sqlite3')
+        result[alias] = {**config, 'LOCATION': location}
+    return result
+
+
+def _insert(model, rows, count):
+    """Вставляет count строк пачками и возвращает их id."""
+    rows = iter(rows)
+    batch = list(itertools.islice(rows, BATCH_SIZE))
+    while batch:
+        model.objects.bulk_create(batch)
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+    # bulk_create в SQLite не возвращает id, берём последние вставленные
+    return list(model.objects.order_by('-pk').values_list(
+        'pk', flat=True
+    )[:count])[::-1]
+
+
+def populate(users, posts, groups, follows_per_user=20, comments=200,
+             skew=1.1, seed=0, prefix='bench'):
+    """
+    Заполняет базу синтетическими данными пачками bulk_create.
+
+    Популярность авторов распределена по Ципфу с показателем skew:
+    у первых авторов больше всего и постов, и подписчиков. Сигналы
+    при bulk_create не срабатывают, поэтому счётчики и материализованные
+    ленты пересчитываются в конце. Возвращает id созданных пользователей,
+    групп и постов в порядке создания.
+    """
+    rng = random.Random(seed)
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed)
+    texts = [fake.paragraph(nb_sentences=3) for _ in range(500)]
+    user_ids = _insert(User, (
+        User(username=f'{prefix}{i}', password='!') for i in range(users)
+    ), users)
+    group_ids = _insert(Group, (
+        Group(title=f'Группа {i}', slug=f'{prefix}-{i}', description='')
+        for i in range(groups)
+    ), groups)
+    weights = list(itertools.accumulate(
+        1 / (rank + 1) ** skew for rank in range(users)
+    ))
+
+    def authors(count):
+        return rng.choices(user_ids, cum_weights=weights, k=count)
+
+    _insert(Follow, (
+        Follow(user_id=user_id, author_id=author_id)
+        for user_id in user_ids
+        for author_id in set(authors(follows_per_user)) - {user_id}
+    ), 0)
+    post_ids = _insert(Post, (
+        Post(author_id=author_id, text=rng.choice(texts),
+             group_id=rng.choice(group_ids) if group_ids else None)
+        for author_id in authors(posts)
+    ), posts)
+    if post_ids:
+        # Длинное обсуждение у самого свежего поста самого популярного
+        # автора - его и показывает бенчмарк post_detail
+        post = (Post.objects.filter(author_id=user_ids[0]).first()
+                or Post.objects.first())
+        _insert(Comment, (
+            Comment(post=post, author_id=author_id, text=rng.choice(texts))
+            for author_id in authors(comments)
+        ), 0)
+    recount_authors(batch_size=BATCH_SIZE)
+    recount_groups(batch_size=BATCH_SIZE)
+    if settings.FOLLOW_FEED_MODE != 'join':
+        timeline.rebuild()
+    return user_ids, group_ids, post_ids
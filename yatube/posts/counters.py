@@ -0,0 +1,75 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+def bump_author(user_id, **deltas):
+    """Сдвигает счётчики автора одним UPDATE: bump_author(1, post_count=1)."""
+    AuthorStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+
+def bump_group(group_id, delta):
+    if group_id is not None:
+        Group.objects.filter(pk=group_id).update(
+            post_count=F('post_count') + delta
+        )
+
+
+def _count(model, field):
+    # Подзапрос COUNT(*) по внешнему ключу field для каждой строки
+    rows = model.objects.filter(**{field: OuterRef('pk')}).order_by()
+    return Coalesce(
+        Subquery(
+            rows.values(field).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+AUTHOR_COUNTERS = {
+    'post_count': (Post, 'author'),
+    'follower_count': (Follow, 'author'),
+    'following_count': (Follow, 'user'),
+    'comment_count': (Comment, 'author'),
+}
+
+
+def recount_authors(batch_size=1000):
+    """Пересчитывает счётчики авторов и возвращает число исправленных."""
+    fields = list(AUTHOR_COUNTERS)
+    actual = User.objects.annotate(**{
+        field: _count(model, key)
+        for field, (model, key) in AUTHOR_COUNTERS.items()
+    }).values_list('pk', *fields)
+    stored = AuthorStats.objects.in_bulk()
+    to_create, to_update = [], []
+    for pk, *values in actual.iterator(chunk_size=batch_size):
+        counters = dict(zip(fields, values))
+        stats = stored.get(pk)
+        if stats is None:
+            to_create.append(AuthorStats(user_id=pk, **counters))
+        elif any(getattr(stats, f) != v for f, v in counters.items()):
+            for field, value in counters.items():
+                setattr(stats, field, value)
+            to_update.append(stats)
+    # Размер пачки для INSERT Django подбирает сам под лимиты SQLite
+    AuthorStats.objects.bulk_create(to_create)
+    AuthorStats.objects.bulk_update(to_update, fields, batch_size=batch_size)
+    return len(to_create) + len(to_update)
+
+
+def recount_groups(batch_size=1000):
+    """Пересчитывает число постов в группах, возвращает число исправленных."""
+    drifted = Group.objects.annotate(
+        actual=_count(Post, 'group')
+    ).exclude(post_count=F('actual'))
+    to_update = []
+    for group in drifted.only('pk', 'post_count'):
+        group.post_count = group.actual
+        to_update.append(group)
+    Group.objects.bulk_update(to_update, ['post_count'], batch_size=batch_size)
+    return len(to_update)
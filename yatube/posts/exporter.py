@@ -0,0 +1,100 @@
+"""
+Потоковая выгрузка постов, комментариев, групп и подписок.
+
+Строки читаются пачками по ключу id > последнего выгруженного, без
+OFFSET, и сразу превращаются в текст, поэтому память не растёт с числом
+строк. Форматы:
+- jsonl   - объект на строку; выгрузку постов понимает import_posts;
+- csv     - заголовок и строки;
+- columns - по JSON-объекту на пачку, в нём столбцы-массивы, как
+  record batch в Arrow/Parquet.
+
+Используется командой export_data и вьюхой posts:export.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from .models import Comment, Follow, Group, Post
+
+# Имя столбца выгрузки и поле для values_list
+DATASETS = {
+    'posts': (Post, (
+        ('id', 'pk'), ('text', 'text'), ('author', 'author__username'),
+        ('group', 'group__slug'), ('pub_date', 'pub_date'),
+        ('image', 'image'),
+    )),
+    'comments': (Comment, (
+        ('id', 'pk'), ('post', 'post_id'), ('author', 'author__username'),
+        ('text', 'text'), ('created', 'created'),
+    )),
+    'groups': (Group, (
+        ('id', 'pk'), ('title', 'title'), ('slug', 'slug'),
+        ('description', 'description'),
+    )),
+    'follows': (Follow, (
+        ('id', 'pk'), ('user', 'user__username'),
+        ('author', 'author__username'),
+    )),
+}
+FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'columns': 'application/x-ndjson',
+}
+CHUNK_SIZE = 2000
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def chunks(dataset, chunk_size=CHUNK_SIZE):
+    """Строки выгрузки пачками по chunk_size, по возрастанию id."""
+    model, columns = DATASETS[dataset]
+    fields = [field for _, field in columns]
+    last_pk = 0
+    while True:
+        rows = model.objects.filter(pk__gt=last_pk).order_by('pk')
+        chunk = [
+            [_value(value) for value in row]
+            for row in rows.values_list(*fields)[:chunk_size].iterator(
+                chunk_size=chunk_size
+            )
+        ]
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1][0]
+
+
+def _csv_line(writer, buffer, row):
+    writer.writerow(row)
+    line = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return line
+
+
+def export(dataset, file_format, chunk_size=CHUNK_SIZE):
+    """Текст выгрузки по кускам - по одному на пачку строк."""
+    names = [name for name, _ in DATASETS[dataset][1]]
+    if file_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        yield _csv_line(writer, buffer, names)
+    for chunk in chunks(dataset, chunk_size):
+        if file_format == 'csv':
+            yield ''.join(_csv_line(writer, buffer, row) for row in chunk)
+        elif file_format == 'columns':
+            yield json.dumps(
+                dict(zip(names, zip(*chunk))), ensure_ascii=False
+            ) + '\n'
+        else:
+            yield ''.join(
+                json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n'
+                for row in chunk
+            )
@@ -0,0 +1,169 @@
+"""
+Версионный кеш лент.
+
+У каждой ленты есть поколение - значение в кеше, которое меняется
+при записи постов, комментариев и подписок (см. posts/signals.py).
+Поколение входит в ключ закешированной страницы, поэтому после записи
+старые страницы просто перестают читаться, а TTL не нужен.
+
+Имена лент: 'index', 'group:<id>', 'profile:<id>', 'follow:<id>'
+и 'post:<id>' для страницы поста (см. cached_post). По тому же принципу
+кешируется множество подписок пользователя - 'following:<id>'
+(см. following_ids).
+
+Поколение ленты подписок 'follow:<id>' не хранится, а выводится из
+поколений 'following:<id>' и профилей авторов, на которых подписан
+пользователь: пост автора сбрасывает один ключ профиля, а не ключ
+у каждого подписчика.
+
+Имена авторов и названия групп видны в любой ленте, поэтому их смена
+сбрасывает все ленты разом: общее поколение CARDS входит в поколение
+каждой ленты и в ключ кеша карточек постов в шаблонах.
+"""
+import time
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.transaction import on_commit
+
+from core import replicas
+
+from .models import Follow
+from .paginators import decode_cursor
+
+
+# Поколение имён авторов и групп, см. generation
+CARDS = 'cards'
+
+
+def _generation_key(feed):
+    return f'feed-gen:{feed}'
+
+
+def _new_generation():
+    # Время в наносекундах вместо счётчика: если ключ вытеснят из кеша,
+    # новое поколение не совпадёт ни с одним из прежних
+    return time.time_ns()
+
+
+def _stored_generations(feeds):
+    keys = [_generation_key(feed) for feed in feeds]
+    values = cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    for key in missing:
+        cache.add(key, _new_generation(), None)
+    if missing:
+        values.update(cache.get_many(missing))
+    return [values[key] for key in keys]
+
+
+def generation(feed):
+    """Текущее поколение ленты."""
+    feeds = [CARDS, feed]
+    if feed.startswith('follow:'):
+        user_id = int(feed.split(':', 1)[1])
+        feeds = [CARDS, f'following:{user_id}']
+        feeds += [f'profile:{pk}' for pk in following_ids(user_id)]
+    # Поколения - время записи: запись в любую из этих лент
+    # поднимает максимум
+    return max(_stored_generations(feeds))
+
+
+# Поля поста, которые видны в лентах; сохранение только других полей
+# (например, updated в variants.build) ленты не сбрасывает
+FEED_FIELDS = {
+    'text', 'pub_date', 'image', 'author', 'author_id', 'group', 'group_id',
+}
+
+
+def post_feeds(post):
+    """Ленты, в которых показан пост (и прежняя группа при её смене)."""
+    feeds = {'index', f'profile:{post.author_id}', f'post:{post.pk}'}
+    for group_id in (post.group_id, getattr(post, '_old_group_id', None)):
+        if group_id is not None:
+            feeds.add(f'group:{group_id}')
+    return feeds
+
+
+def bump(*feeds):
+    """
+    Сбрасывает кеш лент, выдавая им новое поколение, после коммита
+    текущей транзакции. Иначе читатель успел бы построить страницу по
+    данным до коммита и положить её в кеш нового поколения.
+    """
+    def set_generations():
+        new_generation = _new_generation()
+        cache.set_many(
+            {_generation_key(feed): new_generation
+             for feed in feeds if feed},
+            None
+        )
+    on_commit(set_generations)
+
+
+def _reading(*generations):
+    # Реплика могла ещё не получить последнюю запись в ленту, а страница
+    # ляжет в кеш нового поколения - строим её по основной базе
+    if any(replicas.lagging(value) for value in generations):
+        return replicas.use_primary()
+    return nullcontext()
+
+
+def cached_page(feed, paginator, after=None, before=None):
+    """Страница ленты по курсору из кеша текущего поколения."""
+    # Битый курсор означает первую страницу и не должен попасть в ключ
+    after = after if decode_cursor(after) else None
+    before = before if decode_cursor(before) else None
+    current = generation(feed)
+    key = f'feed:{feed}:{current}:{after or ""}:{before or ""}'
+    cached = cache.get(key)
+    if cached is not None:
+        return paginator.build_page(*cached)
+    with _reading(current):
+        page = paginator.get_cursor_page(after=after, before=before)
+    cache.set(
+        key,
+        (page.object_list, page.has_next(), page.has_previous()),
+        settings.FEED_CACHE_TIMEOUT
+    )
+    return page
+
+
+def cached_post(post_id, build):
+    """
+    Общая для всех посетителей часть страницы поста из кеша поколения
+    'post:<id>'; build(post_id) строит её заново - словарь с post
+    и author_posts. Число постов автора меняется вместе с поколением
+    его профиля, с которым кеш и сверяется.
+    """
+    current = generation(f'post:{post_id}')
+    key = f'post:{post_id}:{current}'
+    data = cache.get(key)
+    generations = [current]
+    if data is not None:
+        profile_generation = generation(f'profile:{data["post"].author_id}')
+        if data['profile_generation'] == profile_generation:
+            return data
+        generations.append(profile_generation)
+    with _reading(*generations):
+        data = build(post_id)
+    data['profile_generation'] = generation(
+        f'profile:{data["post"].author_id}'
+    )
+    cache.set(key, data, settings.FEED_CACHE_TIMEOUT)
+    return data
+
+
+def following_ids(user_id):
+    """Множество id авторов, на которых подписан user_id."""
+    current = generation(f'following:{user_id}')
+    key = f'following:{user_id}:{current}'
+    ids = cache.get(key)
+    if ids is None:
+        with _reading(current):
+            ids = frozenset(Follow.objects.filter(
+                user_id=user_id
+            ).values_list('author_id', flat=True))
+        cache.set(key, ids, settings.FEED_CACHE_TIMEOUT)
+    return ids
@@ -31,6 +31,16 @@ class PostForm(forms.ModelForm):
         # даже если не изменил их
         return data
 
+    def clean(self):
+        cleaned_data = super().clean()
+        # Картинку мог отклонить потоковый обработчик (posts/uploads.py),
+        # тогда вместо общей ошибки поля показываем его причину
+        upload_error = getattr(self.files.get('image'), 'upload_error', None)
+        if upload_error:
+            self.errors.pop('image', None)
+            self.add_error('image', upload_error)
+        return cleaned_data
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,241 @@
+"""
+Массовый импорт постов из JSONL или CSV (manage.py import_posts).
+
+Записи читаются потоком и вставляются пачками bulk_create, каждая пачка -
+в своей транзакции. Авторы и группы ищутся по словарям в памяти,
+картинки проверяются и сохраняются пулом потоков. Номер последней
+записи пачки пишется в ImportState в той же транзакции, что и посты,
+поэтому прерванный импорт продолжается с того же места без дублей.
+
+Сигналы при bulk_create не срабатывают, поэтому счётчики, поисковый
+индекс, ленты подписок и кеш лент обновляются один раз в конце (finish).
+
+Поля записи: text, author (username), group (slug, необязательно),
+pub_date (ISO 8601, необязательно), image (путь к файлу относительно
+каталога картинок, необязательно).
+"""
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import feed_cache, search, timeline
+from .counters import recount_authors, recount_groups
+from .models import Follow, Group, Post, User
+from .uploads import FORMATS, HEADER_LIMIT, read_header
+
+FIELDS = ('text', 'author', 'group', 'pub_date', 'image')
+
+
+class InvalidRecord(ValueError):
+    """Запись, которую нельзя импортировать."""
+
+
+def read_records(path, file_format=None):
+    """Записи файла по одной: JSONL или CSV по расширению."""
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.')
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            yield from csv.DictReader(file)
+            return
+        for line in file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+
+
+def parse_pub_date(value):
+    if not value:
+        return timezone.now()
+    date = parse_datetime(value)
+    if date is None:
+        raise InvalidRecord(f'непонятная дата {value!r}')
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+class PostImporter:
+    """Импорт записей; state - ImportState этого файла."""
+
+    def __init__(self, state, batch_size=5000, create_authors=False,
+                 create_groups=False, image_root=None, image_workers=4,
+                 log=None, progress=None):
+        self.state = state
+        self.batch_size = batch_size
+        self.create_authors = create_authors
+        self.create_groups = create_groups
+        self.image_root = image_root
+        self.image_workers = image_workers
+        self.log = log or (lambda message: None)
+        # Вызывается с состоянием после каждой пачки
+        self.progress = progress or (lambda state: None)
+        self.authors = dict(User.objects.values_list('username', 'pk'))
+        self.groups = dict(Group.objects.values_list('slug', 'pk'))
+
+    def run(self, records):
+        """Импортирует записи, пропуская уже обработанные в прошлый раз."""
+        if self.state.start_pk is None:
+            self.state.start_pk = Post.objects.aggregate(
+                last=Max('pk')
+            )['last'] or 0
+            self.state.save()
+        skip = self.state.records
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.image_workers) as pool:
+            self.pool = pool
+            for number, record in enumerate(records):
+                if number < skip:
+                    continue
+                batch.append((number, record))
+                if len(batch) == self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+
+    def import_batch(self, batch):
+        rows = []
+        for number, record in batch:
+            try:
+                rows.append(self.clean(record))
+            except InvalidRecord as error:
+                self.log(f'Запись {number + 1}: {error}')
+                self.state.skipped += 1
+        self.resolve(rows)
+        images = self.pool.map(self.save_image, [row['image'] for row in rows])
+        posts = []
+        for row, image in zip(rows, images):
+            if row['image'] and image is None:
+                self.state.skipped += 1
+                continue
+            posts.append(Post(
+                text=row['text'], pub_date=row['pub_date'],
+                author_id=self.authors[row['author']],
+                group_id=self.groups.get(row['group']), image=image or '',
+            ))
+        self.state.imported += len(posts)
+        self.state.records = batch[-1][0] + 1
+        with transaction.atomic():
+            self.insert(posts)
+            self.state.save()
+        self.progress(self.state)
+
+    def insert(self, posts):
+        """Вставляет посты с pub_date из файла."""
+        dates = [post.pub_date for post in posts]
+        Post.objects.bulk_create(posts)
+        # auto_now_add заменило даты временем импорта. Транзакция держит
+        # запись в базу, так что последние id - id этих постов;
+        # bulk_create в SQLite их не возвращает
+        pks = list(Post.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        )[:len(posts)])[::-1]
+        for post, pk, date in zip(posts, pks, dates):
+            post.pk = pk
+            post.pub_date = date
+        Post.objects.bulk_update(posts, ['pub_date'])
+
+    def clean(self, record):
+        if not isinstance(record, dict):
+            raise InvalidRecord('не разобрать запись')
+        row = {field: (record.get(field) or '').strip() for field in FIELDS}
+        if not row['text']:
+            raise InvalidRecord('пустой текст')
+        if not row['author']:
+            raise InvalidRecord('не указан автор')
+        row['pub_date'] = parse_pub_date(row['pub_date'])
+        return row
+
+    def resolve(self, rows):
+        """Находит id авторов и групп, при необходимости создаёт их."""
+        authors = {row['author'] for row in rows} - set(self.authors)
+        if authors and self.create_authors:
+            User.objects.bulk_create(
+                User(username=name, password='!') for name in authors
+            )
+            self.authors.update(User.objects.filter(
+                username__in=authors
+            ).values_list('username', 'pk'))
+        groups = {row['group'] for row in rows if row['group']}
+        groups -= set(self.groups)
+        if groups and self.create_groups:
+            Group.objects.bulk_create(
+                Group(title=slug, slug=slug, description='')
+                for slug in groups
+            )
+            self.groups.update(Group.objects.filter(
+                slug__in=groups
+            ).values_list('slug', 'pk'))
+        known = []
+        for row in rows:
+            if row['author'] not in self.authors:
+                self.log(f'Нет автора {row["author"]!r}')
+            elif row['group'] and row['group'] not in self.groups:
+                self.log(f'Нет группы {row["group"]!r}')
+            else:
+                known.append(row)
+        self.state.skipped += len(rows) - len(known)
+        rows[:] = known
+
+    def save_image(self, path):
+        """Проверяет картинку и кладёт её в хранилище; None - отказ."""
+        if not path:
+            return None
+        if self.image_root is None:
+            self.log(f'Картинка {path}: не задан каталог картинок')
+            return None
+        full_path = os.path.join(self.image_root, path)
+        try:
+            with open(full_path, 'rb') as file:
+                header = read_header(file.read(HEADER_LIMIT))
+                if header is None or header[0] not in FORMATS:
+                    self.log(f'Картинка {path}: неизвестный формат')
+                    return None
+                width, height = header[1]
+                if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+                    self.log(f'Картинка {path}: слишком большая')
+                    return None
+                file.seek(0)
+                return default_storage.save(
+                    Post._meta.get_field('image').upload_to
+                    + os.path.basename(path),
+                    File(file)
+                )
+        except OSError as error:
+            self.log(f'Картинка {path}: {error}')
+            return None
+
+    def finish(self):
+        """Обновляет всё, что обычно поддерживают сигналы, разом."""
+        imported = Post.objects.filter(pk__gt=self.state.start_pk)
+        recount_authors(batch_size=self.batch_size)
+        recount_groups(batch_size=self.batch_size)
+        search.index_posts(imported, batch_size=self.batch_size)
+        if timeline.fanout_enabled():
+            # Подзапросами, а не списками id: их могут быть сотни тысяч
+            timeline.rebuild(Follow.objects.filter(
+                author_id__in=imported.values('author_id')
+            ).values_list('user_id', flat=True).distinct())
+        authors = imported.order_by().values_list(
+            'author_id', flat=True
+        ).distinct()
+        groups = imported.exclude(group=None).order_by().values_list(
+            'group_id', flat=True
+        ).distinct()
+        # Ленты подписчиков следуют за поколениями профилей авторов
+        feed_cache.bump(
+            'index',
+            *(f'profile:{pk}' for pk in authors),
+            *(f'group:{pk}' for pk in groups),
+        )
@@ -0,0 +1,158 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.benchmarks import measure, populate, temporary_database
+from posts.models import Comment, Follow, Group, Post, User
+
+# Наборы данных: пользователи, посты, группы
+SCALES = {
+    '10k': {'users': 1000, 'posts': 10_000, 'groups': 100},
+    '100k': {'users': 10_000, 'posts': 100_000, 'groups': 1000},
+    '1m': {'users': 100_000, 'posts': 1_000_000, 'groups': 10_000},
+}
+VIEWS = ('index', 'group_posts', 'profile', 'post_detail', 'follow_index')
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет p50/p95 и число запросов лент на синтетических данных '
+        'разного объёма. Данные создаются во временной базе, '
+        'результат можно сохранить в JSON и сравнить с прошлым коммитом.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', default='10k',
+            help=f'Наборы данных через запятую: {", ".join(SCALES)}'
+        )
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Показатель Ципфа для популярности авторов')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--output',
+                            help='Файл, куда сохранить результат в JSON')
+        parser.add_argument('--compare',
+                            help='JSON прошлого прогона для сравнения p95')
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        names = options['scales'].split(',')
+        unknown = set(names) - set(SCALES)
+        if unknown:
+            raise CommandError(f'Неизвестные наборы: {", ".join(unknown)}')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+        report = {
+            'commit': self.commit(),
+            'created': datetime.now(timezone.utc).isoformat(),
+            'follow_feed_mode': settings.FOLLOW_FEED_MODE,
+            'cache': settings.CACHES['default']['BACKEND'],
+            'results': [],
+        }
+        for name in names:
+            with temporary_database():
+                populate(
+                    **SCALES[name],
+                    follows_per_user=options['follows_per_user'],
+                    skew=options['skew'],
+                )
+                report['results'].append({
+                    'scale': name,
+                    **SCALES[name],
+                    'follows': Follow.objects.count(),
+                    'views': self.measure_views(options['repeat']),
+                })
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2, ensure_ascii=False)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.print_report(report, baseline)
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True,
+                cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def urls(self):
+        """Самые тяжёлые страницы каждого вида в созданных данных."""
+        group = Group.objects.order_by('-post_count').first()
+        author = User.objects.order_by('-stats__post_count').first()
+        post = Comment.objects.values('post').annotate(
+            total=Count('pk')
+        ).order_by('-total').first()
+        follower = Follow.objects.values('user').annotate(
+            total=Count('pk')
+        ).order_by('-total').first()
+        post_id = post['post'] if post else Post.objects.first().pk
+        return follower['user'], {
+            'index': reverse('posts:index'),
+            'group_posts': reverse('posts:group_posts', args=(group.slug,)),
+            'profile': reverse('posts:profile', args=(author.username,)),
+            'post_detail': reverse('posts:post_detail', args=(post_id,)),
+            'follow_index': reverse('posts:follow_index'),
+        }
+
+    def measure_views(self, repeat):
+        follower_id, urls = self.urls()
+        client = Client()
+        client.force_login(User.objects.get(pk=follower_id))
+        results = {}
+        for view in VIEWS:
+            url = urls[view]
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                client.get(url)
+            results[view] = {
+                'queries': len(queries),
+                # Без кеша: каждый раз страница строится заново
+                'cold': measure(
+                    lambda: client.get(url), repeat, setup=cache.clear
+                ),
+                'warm': measure(lambda: client.get(url), repeat),
+            }
+        return results
+
+    def print_report(self, report, baseline):
+        previous = {}
+        for row in (baseline or {}).get('results', []):
+            for view, stats in row['views'].items():
+                previous[row['scale'], view] = stats
+        self.stdout.write(f"Коммит {report['commit']}")
+        for row in report['results']:
+            self.stdout.write(
+                f"{row['scale']}: {row['users']} пользователей, "
+                f"{row['posts']} постов, {row['follows']} подписок"
+            )
+            for view, stats in row['views'].items():
+                line = (
+                    f"  {view:>13}: {stats['queries']:>2} запросов, "
+                    f"без кеша p50 {stats['cold']['p50_ms']} мс, "
+                    f"p95 {stats['cold']['p95_ms']} мс; "
+                    f"с кешем p95 {stats['warm']['p95_ms']} мс"
+                )
+                old = previous.get((row['scale'], view))
+                if old:
+                    change = (stats['cold']['p95_ms'] / old['cold']['p95_ms']
+                              - 1) * 100
+                    line += f" ({change:+.0f}% к прошлому)"
+                self.stdout.write(line)
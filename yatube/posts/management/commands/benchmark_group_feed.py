@@ -0,0 +1,96 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.benchmarks import measure, temporary_database
+from posts.models import Group, Post
+from posts.paginators import KeysetPaginator, encode_cursor
+from posts.views import COUNT_POST
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время страницы ленты группы при росте числа групп '
+        'и постов. Данные создаются во временной базе.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', default='1000,10000,100000',
+            help='Число постов на каждом шаге, через запятую'
+        )
+        parser.add_argument(
+            '--posts-per-group', type=int, default=100,
+            help='Сколько постов приходится на одну группу'
+        )
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        scales = [int(scale) for scale in options['scales'].split(',')]
+        per_group = options['posts_per_group']
+        results = []
+        with temporary_database():
+            author = User.objects.create_user(username='benchmark-author')
+            self.groups = 0
+            created = 0
+            for scale in sorted(scales):
+                created += self.grow(author, scale - created, per_group)
+                group = Group.objects.get(slug='benchmark-0')
+                results.append({
+                    'posts': created,
+                    'groups': self.groups,
+                    **self.measure_group(group, options['repeat']),
+                })
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for row in results:
+            self.stdout.write(
+                f"{row['posts']:>9} постов {row['groups']:>6} групп: "
+                f"первая страница p50 {row['first_page']['p50_ms']} мс, "
+                f"p95 {row['first_page']['p95_ms']} мс; "
+                f"глубокая p50 {row['deep_page']['p50_ms']} мс, "
+                f"p95 {row['deep_page']['p95_ms']} мс"
+            )
+
+    def grow(self, author, count, per_group):
+        """Добавляет count постов, заводя новую группу на каждые per_group."""
+        if count <= 0:
+            return 0
+        new_groups = max(1, count // per_group)
+        Group.objects.bulk_create([
+            Group(title=f'Группа {i}', slug=f'benchmark-{i}',
+                  description='Бенчмарк')
+            for i in range(self.groups, self.groups + new_groups)
+        ])
+        self.groups += new_groups
+        # bulk_create в SQLite не возвращает id, перечитываем группы
+        groups = list(Group.objects.filter(
+            slug__startswith='benchmark-'
+        ).order_by('-pk').values_list('pk', flat=True)[:new_groups])
+        Post.objects.bulk_create((
+            Post(author=author, group_id=groups[i % len(groups)],
+                 text=f'Пост {i}')
+            for i in range(count)
+        ))
+        return count
+
+    def measure_group(self, group, repeat):
+        paginator = KeysetPaginator(group.posts.for_feed(), COUNT_POST)
+        middle = group.posts.order_by('-pub_date', '-pk')[
+            group.posts.count() // 2
+        ]
+        cursor = encode_cursor(middle)
+        return {
+            'first_page': measure(
+                lambda: list(paginator.get_cursor_page()), repeat
+            ),
+            'deep_page': measure(
+                lambda: list(paginator.get_cursor_page(after=cursor)), repeat
+            ),
+        }
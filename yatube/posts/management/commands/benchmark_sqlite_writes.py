@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from core.db import write_queue
+from posts.benchmarks import percentile, temporary_database
+from posts.models import Comment, Follow, Post
+from posts.views import comment_page
+
+User = get_user_model()
+
+# Прежняя настройка: журнал отката, без очереди записи
+ROLLBACK_JOURNAL = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'busy_timeout': 5000,
+}
+MODES = ('journal', 'wal', 'wal+queue')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность записи в SQLite при '
+        'одновременном чтении: журнал отката, WAL и WAL с очередью записи '
+        '(core/db.py). Писатели чередуют комментарии с подпиской и '
+        'отпиской, как add_comment и profile_follow. Работает на '
+        'временной базе со схемой проекта.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writes', type=int, default=200,
+                            help='Сколько записей делает каждый поток')
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        results = []
+        with temporary_database():
+            author = User.objects.create_user(username='benchmark')
+            post = Post.objects.create(author=author, text='Бенчмарк')
+            for mode in MODES:
+                pragmas = (ROLLBACK_JOURNAL if mode == 'journal'
+                           else settings.SQLITE_PRAGMAS)
+                with override_settings(
+                    SQLITE_PRAGMAS=pragmas,
+                    SQLITE_WRITE_QUEUE=mode == 'wal+queue',
+                ):
+                    # Новые соединения получат PRAGMA этого режима
+                    connection.close()
+                    results.append({
+                        'mode': mode,
+                        **self.measure(post, options),
+                    })
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:>9}: {row['writes_per_second']} записей/с, "
+                f"ошибок {row['errors']}, чтение p95 "
+                f"{row['read_p95_ms']} мс"
+            )
+
+    def write(self, post, user, options, errors):
+        try:
+            for i in range(options['writes']):
+                try:
+                    write_queue.run(self.write_job(i, post, user))
+                except OperationalError:
+                    # "database is locked": транзакция, начавшаяся
+                    # с чтения, не смогла стать пишущей
+                    errors.append(i)
+        finally:
+            connection.close()
+
+    def read(self, post, done, reads, errors):
+        try:
+            while not done.is_set():
+                started = time.perf_counter()
+                try:
+                    list(comment_page(_Request(), post.pk))
+                except OperationalError:
+                    errors.append(None)
+                reads.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+
+    def measure(self, post, options):
+        done = threading.Event()
+        errors = []
+        reads = []
+        users = [
+            User.objects.get_or_create(username=f'benchmark-{i}')[0]
+            for i in range(options['writers'])
+        ]
+        writers = [
+            threading.Thread(target=self.write,
+                             args=(post, user, options, errors))
+            for user in users
+        ]
+        readers = [
+            threading.Thread(target=self.read,
+                             args=(post, done, reads, errors))
+            for _ in range(options['readers'])
+        ]
+        started = time.perf_counter()
+        for thread in writers + readers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        for thread in readers:
+            thread.join()
+        written = options['writers'] * options['writes'] - len(
+            [error for error in errors if error is not None]
+        )
+        return {
+            'writes': written,
+            'seconds': round(elapsed, 3),
+            'writes_per_second': round(written / elapsed),
+            'errors': len(errors),
+            'read_p95_ms': round(percentile(reads, 95), 3) if reads else None,
+        }
+
+    def write_job(self, i, post, user):
+        """Запись для write_queue.run: комментарий, подписка или отписка."""
+        if i % 3 == 0:
+            return Comment(post=post, author=user, text=str(i)).save
+        if i % 3 == 1:
+            return partial(
+                Follow.objects.get_or_create, user=user, author=post.author
+            )
+        return Follow.objects.filter(user=user, author=post.author).delete
+
+
+class _Request:
+    # comment_page читает из запроса только GET
+    GET = {}
@@ -0,0 +1,113 @@
+import io
+import json
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import override_settings
+from PIL import Image
+
+from posts.benchmarks import peak_memory
+from posts.forms import PostForm
+from posts.uploads import ImageUploadHandler
+
+MODES = ('default', 'streaming')
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет память и время приёма одновременных загрузок больших '
+        'картинок: стандартные обработчики Django против потокового '
+        '(posts/uploads.py). Файлы пишутся во временный MEDIA_ROOT.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=20,
+                            help='Размер каждой картинки, МБ')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Сколько загрузок идёт одновременно')
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        body = encode_multipart(BOUNDARY, {
+            'text': 'Бенчмарк',
+            'image': SimpleUploadedFile(
+                'benchmark.png', self.make_image(options['size_mb'])
+            ),
+        })
+        concurrency = options['concurrency']
+        results = []
+        for mode in MODES:
+            with tempfile.TemporaryDirectory() as media_root:
+                with override_settings(MEDIA_ROOT=media_root):
+                    results.append({
+                        'mode': mode,
+                        'size_mb': options['size_mb'],
+                        'concurrency': concurrency,
+                        **self.measure(mode, body, concurrency),
+                    })
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:>9}: {row['concurrency']} x "
+                f"{row['size_mb']} МБ за {row['seconds']} с, "
+                f"пик памяти {row['peak_mb']} МБ, "
+                f"принято {row['accepted']}"
+            )
+
+    def make_image(self, size_mb):
+        """PNG из шума без сжатия: вес файла почти равен size_mb."""
+        side = int(math.sqrt(size_mb * 2 ** 20 / 3))
+        image = Image.frombytes(
+            'RGB', (side, side), os.urandom(side * side * 3)
+        )
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG', compress_level=0)
+        return buffer.getvalue()
+
+    def measure(self, mode, body, concurrency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            accepted, peak = peak_memory(lambda: sum(pool.map(
+                lambda _: self.upload(mode, body), range(concurrency)
+            )))
+        return {
+            'seconds': round(time.perf_counter() - started, 3),
+            'peak_mb': peak,
+            'accepted': accepted,
+        }
+
+    def upload(self, mode, body):
+        # Тело запроса общее для всех потоков, BytesIO его не копирует
+        request = WSGIRequest({
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '/create/',
+            'CONTENT_TYPE': MULTIPART_CONTENT,
+            'CONTENT_LENGTH': str(len(body)),
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+        })
+        if mode == 'streaming':
+            request.upload_handlers.insert(0, ImageUploadHandler(request))
+        try:
+            form = PostForm(request.POST, request.FILES)
+            if not form.is_valid():
+                return False
+            # Сохранение в хранилище, как при form.save()
+            image = form.cleaned_data['image']
+            default_storage.save(f'posts/{image.name}', image)
+            return True
+        finally:
+            request.close()
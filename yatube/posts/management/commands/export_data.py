@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts.exporter import CHUNK_SIZE, DATASETS, FORMATS, export
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает посты, комментарии, группы или подписки потоком '
+        'в JSONL, CSV или столбцами по пачкам (columns).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=DATASETS)
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--output',
+                            help='Файл выгрузки; по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Сколько строк читать одним запросом')
+
+    def handle(self, *args, **options):
+        parts = export(
+            options['dataset'], options['format'], options['chunk_size']
+        )
+        if not options['output']:
+            for part in parts:
+                self.stdout.write(part, ending='')
+            return
+        with open(options['output'], 'w', newline='',
+                  encoding='utf-8') as file:
+            for part in parts:
+                file.write(part)
@@ -0,0 +1,86 @@
+import os
+import posixpath
+import shutil
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from posts.models import ImageVariant, Post
+from posts.uploads import STAGING_DIR
+
+# Каталоги MEDIA_ROOT, которыми владеют посты
+ROOTS = ('posts', STAGING_DIR)
+# Миниатюры sorl-thumbnail: ленты показывают варианты из ImageVariant,
+# и каталог целиком никому не нужен
+LEGACY_ROOTS = ('cache',)
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT картинки постов и их варианты, '
+        'на которые больше никто не ссылается, и старые миниатюры sorl'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе стольких секунд: на них может '
+                 'сослаться ещё не закоммиченная запись'
+        )
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено')
+
+    def handle(self, *args, **options):
+        referenced = set(Post.objects.exclude(image='').values_list(
+            'image', flat=True
+        ).iterator())
+        referenced.update(ImageVariant.objects.values_list(
+            'file', flat=True
+        ).iterator())
+        deadline = time.time() - options['min_age']
+        removed = freed = 0
+        for root in ROOTS:
+            for name in self.walk(root):
+                if name in referenced:
+                    continue
+                try:
+                    stat = os.stat(default_storage.path(name))
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime > deadline:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    default_storage.delete(name)
+                removed += 1
+                freed += stat.st_size
+        for root in LEGACY_ROOTS:
+            legacy_removed, legacy_freed = self.remove_tree(
+                root, options['dry_run']
+            )
+            removed += legacy_removed
+            freed += legacy_freed
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} файлов: {removed}, {filesizeformat(freed)}'
+        ))
+
+    def remove_tree(self, root, dry_run):
+        sizes = [default_storage.size(name) for name in self.walk(root)]
+        if sizes and dry_run:
+            self.stdout.write(f'{root}/ (файлов: {len(sizes)})')
+        elif default_storage.exists(root):
+            shutil.rmtree(default_storage.path(root))
+        return len(sizes), sum(sizes)
+
+    def walk(self, directory):
+        if not default_storage.exists(directory):
+            return
+        directories, files = default_storage.listdir(directory)
+        for name in files:
+            yield posixpath.join(directory, name)
+        for name in directories:
+            yield from self.walk(posixpath.join(directory, name))
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Строит варианты для уже загруженных картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Сколько картинок обрабатывать параллельно'
+        )
+        parser.add_argument(
+            '--after-pk', type=int, default=0,
+            help='Только посты с id больше этого, например после импорта'
+        )
+
+    def handle(self, *args, **options):
+        post_ids = Post.objects.filter(pk__gt=options['after_pk']).exclude(
+            image=''
+        ).values_list('pk', flat=True)
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for ok in pool.map(self.generate, post_ids.iterator()):
+                done += ok
+                failed += not ok
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок обработано: {done}, с ошибками: {failed}'
+        ))
+
+    def generate(self, post_id):
+        try:
+            thumbnails.generate(post_id)
+        except Exception as error:
+            self.stderr.write(f'Пост {post_id}: {error}')
+            return False
+        finally:
+            connection.close()
+        return True
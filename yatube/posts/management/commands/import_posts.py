@@ -0,0 +1,92 @@
+import os
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.importer import PostImporter, read_records
+from posts.models import ImportState
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует посты из JSONL или CSV пачками bulk_create. '
+        'Прерванный импорт продолжается с --resume, счётчики, поиск '
+        'и кеш лент обновляются в конце. Поля записи - в posts/importer.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .jsonl или .csv')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='Формат, если расширение файла другое')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Сколько постов вставлять в одной транзакции')
+        parser.add_argument('--create-authors', action='store_true',
+                            help='Заводить неизвестных авторов')
+        parser.add_argument('--create-groups', action='store_true',
+                            help='Заводить неизвестные группы')
+        parser.add_argument('--images',
+                            help='Каталог, относительно которого указаны '
+                                 'картинки')
+        parser.add_argument('--image-workers', type=int, default=4,
+                            help='Сколько картинок сохранять параллельно')
+        parser.add_argument('--skip-variants', action='store_true',
+                            help='Не строить варианты картинок после импорта')
+        parser.add_argument('--state',
+                            help='Имя состояния импорта; по умолчанию '
+                                 'полный путь к файлу')
+        parser.add_argument('--resume', action='store_true',
+                            help='Продолжить прерванный импорт')
+        parser.add_argument('--restart', action='store_true',
+                            help='Забыть прерванный импорт и начать заново')
+
+    def handle(self, *args, **options):
+        source = options['state'] or os.path.abspath(options['path'])
+        if options['restart']:
+            ImportState.objects.filter(source=source).delete()
+        state = ImportState.objects.filter(source=source).first()
+        if state is None:
+            state = ImportState(source=source)
+        elif not options['resume']:
+            raise CommandError(
+                f'Есть незавершённый импорт {source}: продолжите его '
+                f'с --resume или начните заново с --restart'
+            )
+        else:
+            self.stdout.write(
+                f'Продолжаем после записи {state.records}'
+            )
+        self.started = time.monotonic()
+        self.started_at = state.records
+        importer = PostImporter(
+            state,
+            batch_size=options['batch_size'],
+            create_authors=options['create_authors'],
+            create_groups=options['create_groups'],
+            image_root=options['images'],
+            image_workers=options['image_workers'],
+            log=self.stderr.write,
+            progress=self.progress,
+        )
+        importer.run(read_records(options['path'], options['format']))
+        self.stdout.write('Обновляем счётчики, поиск и ленты')
+        importer.finish()
+        if not options['skip_variants']:
+            call_command(
+                'generate_thumbnails', after_pk=state.start_pk,
+                workers=options['image_workers'], stdout=self.stdout,
+                stderr=self.stderr,
+            )
+        state.delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано постов: {state.imported}, пропущено записей: '
+            f'{state.skipped}'
+        ))
+
+    def progress(self, state):
+        elapsed = time.monotonic() - self.started
+        rate = (state.records - self.started_at) / elapsed if elapsed else 0
+        self.stdout.write(
+            f'Записей {state.records}: импортировано {state.imported}, '
+            f'пропущено {state.skipped}, {rate:.0f} записей/с'
+        )
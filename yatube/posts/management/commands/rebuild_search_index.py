@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Заново строит поисковый индекс постов и комментариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько документов записывать за один запрос'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = search.rebuild(batch_size=options['batch_size'])
+        backend = type(search.get_backend()).__name__
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано документов: {total} ({backend})'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.counters import recount_authors, recount_groups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики авторов и групп и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк обновлять за один запрос'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            authors = recount_authors(batch_size=batch_size)
+            groups = recount_groups(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков: авторов {authors}, групп {groups}'
+        ))
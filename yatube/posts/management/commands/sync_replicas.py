@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплики DATABASE_REPLICAS '
+        '(локальная замена репликации, см. core/replicas.py). С --interval '
+        'копирует по кругу, изображая отставание реплик.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            help='Повторять копирование раз в столько секунд'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('Реплик нет: задайте YATUBE_REPLICAS')
+        while True:
+            self.sync()
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def sync(self):
+        started = time.perf_counter()
+        source = sqlite3.connect(settings.DATABASES['default']['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                try:
+                    # Backup API пишет в файл реплики под её блокировкой:
+                    # читатели видят либо старую копию, либо новую
+                    source.backup(target)
+                finally:
+                    target.close()
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Реплик обновлено: {len(settings.DATABASE_REPLICAS)} за '
+            f'{time.perf_counter() - started:.2f} с'
+        ))
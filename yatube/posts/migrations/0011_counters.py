@@ -0,0 +1,59 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    Group = apps.get_model('posts', 'Group')
+    users = User.objects.annotate(
+        n_posts=Count('posts', distinct=True),
+        n_followers=Count('following', distinct=True),
+        n_following=Count('follower', distinct=True),
+        n_comments=Count('comments', distinct=True),
+    )
+    AuthorStats.objects.bulk_create([
+        AuthorStats(
+            user_id=user.pk,
+            post_count=user.n_posts,
+            follower_count=user.n_followers,
+            following_count=user.n_following,
+            comment_count=user.n_comments,
+        ) for user in users.iterator()
+    ])
+    for group in Group.objects.annotate(n_posts=Count('posts')):
+        Group.objects.filter(pk=group.pk).update(post_count=group.n_posts)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0010_auto_20220910_1048'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('post_count', models.IntegerField(default=0, verbose_name='Всего постов')),
+                ('follower_count', models.IntegerField(default=0, verbose_name='Подписчиков')),
+                ('following_count', models.IntegerField(default=0, verbose_name='Подписок')),
+                ('comment_count', models.IntegerField(default=0, verbose_name='Комментариев')),
+            ],
+            options={
+                'verbose_name': 'Статистика автора',
+                'verbose_name_plural': 'Статистика авторов',
+            },
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='post_count',
+            field=models.IntegerField(default=0, verbose_name='Всего постов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
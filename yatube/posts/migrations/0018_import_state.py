@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_post_image_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, unique=True, verbose_name='Источник')),
+                ('records', models.IntegerField(default=0, verbose_name='Обработано записей')),
+                ('imported', models.IntegerField(default=0, verbose_name='Импортировано постов')),
+                ('skipped', models.IntegerField(default=0, verbose_name='Пропущено записей')),
+                ('start_pk', models.IntegerField(null=True, verbose_name='Последний id до импорта')),
+            ],
+            options={
+                'verbose_name': 'Состояние импорта',
+                'verbose_name_plural': 'Состояния импорта',
+            },
+        ),
+    ]
@@ -1,6 +1,6 @@
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import F, Q
+from django.db.models import F, Prefetch, Q
 
 User = get_user_model()
 
@@ -9,14 +9,35 @@ class Group(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
+    # Поддерживается сигналами, см. posts/signals.py
+    post_count = models.IntegerField('Всего постов', default=0)
 
     def __str__(self) -> str:
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """
+        Посты для ленты: автор и группа одним JOIN, без лишних колонок,
+        варианты картинок одним запросом на страницу.
+        """
+        return self.select_related('author', 'group').defer(
+            'group__description',
+            'author__password',
+        ).prefetch_related(Prefetch(
+            'image_variants',
+            # Без ORDER BY: сортировка по ширине - в post_picture, иначе
+            # SQLite сортирует варианты страницы во временном B-дереве
+            queryset=ImageVariant.objects.order_by(),
+        ))
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
+    # Входит в ключ кеша карточки поста
+    updated = models.DateTimeField('Дата изменения', auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -38,15 +59,59 @@ class Post(models.Model):
         blank=True
     )
 
+    objects = PostQuerySet.as_manager()
+
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Индексы под запросы лент: сортировка по дате
+        # с фильтром по автору или группе
+        indexes = [
+            models.Index(fields=['pub_date'], name='post_pub_date_idx'),
+            models.Index(fields=['author', 'pub_date'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', 'pub_date'],
+                         name='post_group_pub_date_idx'),
+            # Поиск постов с той же картинкой, см. variants.reuse
+            models.Index(fields=['image'], name='post_image_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.text
 
 
+class ImageVariant(models.Model):
+    """Готовый вариант картинки поста одной ширины и формата."""
+    JPEG = 'jpeg'
+    WEBP = 'webp'
+    FORMAT_CHOICES = [(JPEG, 'JPEG'), (WEBP, 'WebP')]
+
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='image_variants'
+    )
+    file = models.FileField('Файл', upload_to='posts/variants/')
+    format = models.CharField('Формат', max_length=4, choices=FORMAT_CHOICES)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    size = models.PositiveIntegerField('Размер, байт')
+    sha256 = models.CharField('SHA-256', max_length=64)
+
+    class Meta:
+        ordering = ['width']
+        verbose_name = 'Вариант картинки'
+        verbose_name_plural = 'Варианты картинок'
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'format', 'width'],
+                                    name='unique_image_variant'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.file.name} {self.width}x{self.height}'
+
+
 class Comment(models.Model):
     post = models.ForeignKey(
         Post,
@@ -65,6 +130,10 @@ class Comment(models.Model):
         ordering = ['-created']
         verbose_name = 'Коммент'
         verbose_name_plural = 'Комменты'
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.text
@@ -85,9 +154,116 @@ class Follow(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        # unique_follow уже даёт индекс (user, author), а для поиска
+        # подписчиков автора нужен обратный
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='unique_follow'),
             models.CheckConstraint(check=~Q(user=F('author')),
                                    name='unique_follow_user')
         ]
+
+
+class AuthorStats(models.Model):
+    """Счётчики автора, которые обновляются при записи, а не при чтении."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    post_count = models.IntegerField('Всего постов', default=0)
+    follower_count = models.IntegerField('Подписчиков', default=0)
+    following_count = models.IntegerField('Подписок', default=0)
+    comment_count = models.IntegerField('Комментариев', default=0)
+
+    class Meta:
+        verbose_name = 'Статистика автора'
+        verbose_name_plural = 'Статистика авторов'
+
+    def __str__(self) -> str:
+        return f'Статистика {self.user_id}'
+
+    @classmethod
+    def for_user(cls, user):
+        """Счётчики пользователя; пустые, если строка ещё не создана."""
+        try:
+            return user.stats
+        except cls.DoesNotExist:
+            return cls(user=user)
+
+
+class SearchPosting(models.Model):
+    """
+    Вхождение основы слова в пост или комментарий: обратный индекс
+    для поиска, когда в SQLite нет FTS5, см. posts/search.py.
+    """
+    term = models.CharField('Основа слова', max_length=64)
+    # id * 2 + вид документа: 0 - пост, 1 - комментарий
+    document = models.BigIntegerField('Документ')
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    # Вклад вхождения в BM25 без множителя IDF
+    weight = models.FloatField('Вес')
+
+    class Meta:
+        verbose_name = 'Вхождение слова'
+        verbose_name_plural = 'Поисковый индекс'
+        indexes = [
+            models.Index(fields=['term', 'document'],
+                         name='search_term_document_idx'),
+            models.Index(fields=['document'], name='search_document_idx'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Пост в материализованной ленте подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+    # Копия даты поста: страница ленты читается по индексу
+    # timeline_user_pub_date_idx без JOIN-а и сортировки
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+
+
+class ImportState(models.Model):
+    """Докуда дошёл импорт постов из файла, см. posts/importer.py."""
+    source = models.CharField('Источник', max_length=255, unique=True)
+    records = models.IntegerField('Обработано записей', default=0)
+    imported = models.IntegerField('Импортировано постов', default=0)
+    skipped = models.IntegerField('Пропущено записей', default=0)
+    # Импортированные посты - с id больше этого
+    start_pk = models.IntegerField('Последний id до импорта', null=True)
+
+    class Meta:
+        verbose_name = 'Состояние импорта'
+        verbose_name_plural = 'Состояния импорта'
+
+    def __str__(self) -> str:
+        return self.source
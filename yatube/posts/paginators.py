@@ -0,0 +1,161 @@
+from datetime import datetime, timedelta, timezone
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+# Начало отсчёта для кодирования даты публикации в курсоре
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_cursor(post, field='pub_date'):
+    """Курсор записи: микросекунды даты field и id через подчёркивание."""
+    return f'{(getattr(post, field) - EPOCH) // MICROSECOND}_{post.pk}'
+
+
+def decode_cursor(cursor):
+    """Разбирает курсор в пару (дата, id) или возвращает None."""
+    try:
+        microseconds, pk = (int(part) for part in cursor.split('_'))
+        date = EPOCH + microseconds * MICROSECOND
+    except (AttributeError, ValueError, OverflowError):
+        return None
+    # id больше 64 бит SQLite не примет
+    if not 0 < pk < 2 ** 63:
+        return None
+    return date, pk
+
+
+class KeysetPaginator(Paginator):
+    """
+    Пагинация по ключу (дата, id) без COUNT(*) и OFFSET, поле даты -
+    date_field.
+
+    Страница "старше" курсора выбирается условием
+    (дата, id) < курсор, "новее" - обратным условием.
+    Стоимость запроса не зависит от глубины прокрутки.
+
+    Отдаёт обычный Page: номер страницы и num_pages подставляются так,
+    чтобы has_next()/has_previous() отвечали по соседним курсорам.
+    """
+    is_keyset = True
+    date_field = 'pub_date'
+    pk_field = 'pk'
+
+    def __init__(self, object_list, per_page):
+        super().__init__(
+            object_list.order_by(
+                f'-{self.date_field}', f'-{self.pk_field}'
+            ),
+            per_page
+        )
+        self.num_pages = 1
+
+    def _before(self, cursor):
+        date, pk = cursor
+        return (Q(**{f'{self.date_field}__lt': date})
+                | Q(**{self.date_field: date, f'{self.pk_field}__lt': pk}))
+
+    def _after(self, cursor):
+        date, pk = cursor
+        return (Q(**{f'{self.date_field}__gt': date})
+                | Q(**{self.date_field: date, f'{self.pk_field}__gt': pk}))
+
+    def _fetch(self, cursor=None, newer=False):
+        """
+        Записи старше курсора (newer - новее) в порядке листания,
+        на одну больше страницы, чтобы узнать, есть ли продолжение.
+        """
+        queryset = self.object_list
+        if cursor is not None:
+            queryset = queryset.filter(
+                self._after(cursor) if newer else self._before(cursor)
+            )
+        if newer:
+            queryset = queryset.reverse()
+        return list(queryset[:self.per_page + 1])
+
+    def _rows(self, rows):
+        return rows[:self.per_page], len(rows) > self.per_page
+
+    def first_page(self):
+        rows, has_more = self._rows(self._fetch())
+        return self.build_page(rows, has_older=has_more, has_newer=False)
+
+    def page_older(self, cursor):
+        rows, has_more = self._rows(self._fetch(cursor))
+        return self.build_page(rows, has_older=has_more, has_newer=True)
+
+    def page_newer(self, cursor):
+        rows, has_more = self._rows(self._fetch(cursor, newer=True))
+        if not has_more:
+            # Дошли до начала ленты - отдаём обычную первую страницу,
+            # чтобы она не была "обрезанной"
+            return self.first_page()
+        rows.reverse()
+        return self.build_page(rows, has_older=True, has_newer=True)
+
+    def get_cursor_page(self, after=None, before=None):
+        """Страница после курсора after или перед курсором before."""
+        if after and decode_cursor(after):
+            return self.page_older(decode_cursor(after))
+        if before and decode_cursor(before):
+            return self.page_newer(decode_cursor(before))
+        return self.first_page()
+
+    def cursor(self, row):
+        return encode_cursor(row, self.date_field)
+
+    def build_page(self, rows, has_older, has_newer):
+        has_older = bool(rows) and has_older
+        has_newer = bool(rows) and has_newer
+        number = 2 if has_newer else 1
+        self.num_pages = number + 1 if has_older else number
+        page = self._get_page(rows, number, self)
+        page.next_cursor = self.cursor(rows[-1]) if has_older else None
+        page.previous_cursor = self.cursor(rows[0]) if has_newer else None
+        return page
+
+
+class CommentPaginator(KeysetPaginator):
+    """
+    Комментарии поста по ключу (created, id), от новых к старым.
+    Запрос идёт по индексу comment_post_created_idx.
+    """
+    date_field = 'created'
+
+
+class TimelinePaginator(KeysetPaginator):
+    """
+    Лента подписок из TimelineEntry (см. timeline.timeline_posts): ключ
+    (дата, id поста) берётся из записи ленты, и страница читается по
+    индексу timeline_user_pub_date_idx без сортировки. Курсоры те же,
+    что у ленты постов.
+    """
+    date_field = 'timeline_date'
+    pk_field = 'timeline_post'
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """
+    Лента из нескольких лент постов с общим ключом (дата, id поста):
+    каждая часть читается своим запросом по своему индексу, страницы
+    сливаются в памяти. Пост из нескольких частей показывается один раз.
+    get_parts() возвращает пагинаторы частей; он вызывается только при
+    чтении из базы, страница из кеша базу не трогает.
+    """
+
+    def __init__(self, get_parts, per_page):
+        Paginator.__init__(self, [], per_page)
+        self.num_pages = 1
+        self.get_parts = get_parts
+
+    def _fetch(self, cursor=None, newer=False):
+        rows = {}
+        for part in self.get_parts():
+            for row in part._fetch(cursor, newer):
+                rows.setdefault(row.pk, row)
+        return sorted(
+            rows.values(), key=lambda row: (row.pub_date, row.pk),
+            reverse=not newer
+        )[:self.per_page + 1]
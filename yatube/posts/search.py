@@ -0,0 +1,322 @@
+"""
+Полнотекстовый поиск по постам и комментариям.
+
+Текст режется на слова, слова проходят русский стеммер (posts/stemmer.py),
+и в индекс попадают их основы. Слова запроса ищутся как префиксы основ,
+все слова должны встретиться в одном документе.
+
+Индекс - таблица SQLite FTS5 posts_search с ранжированием bm25 или,
+если FTS5 нет, обратный индекс в модели SearchPosting с тем же BM25
+(вес вхождения считается при записи). Выбор - SEARCH_BACKEND.
+Индекс обновляется сигналами, заполнить его заново можно командой
+rebuild_search_index.
+
+Документ - пост или комментарий - получает номер id * 2 + вид,
+в выдачу попадает пост с лучшим из своих документов.
+"""
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection
+
+from .models import Comment, Post, SearchPosting
+from .paginators import KeysetPaginator
+from .stemmer import stem
+
+POST, COMMENT = 0, 1
+# Совпадение в комментарии весит меньше, чем в самом посте
+KIND_WEIGHTS = {POST: 1.0, COMMENT: 0.5}
+WORD = re.compile(r'\w+')
+# Сколько слов запроса учитывать
+MAX_TERMS = 8
+# Сколько результатов отдавать в админку
+ADMIN_LIMIT = 1000
+# Параметры BM25 для обратного индекса
+K1 = 1.2
+B = 0.75
+AVERAGE_LENGTH = 40
+
+
+def terms(text):
+    """Основы слов текста."""
+    max_length = SearchPosting._meta.get_field('term').max_length
+    return [stem(word)[:max_length] for word in WORD.findall(text.lower())]
+
+
+def query_terms(query):
+    """Основы слов запроса без повторов."""
+    return list(dict.fromkeys(terms(query)))[:MAX_TERMS]
+
+
+def document(kind, pk):
+    return pk * 2 + kind
+
+
+class FTS5Backend:
+    table = 'posts_search'
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+    def delete(self, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s',
+                [(doc,) for doc in documents]
+            )
+
+    def add(self, rows):
+        """Добавляет документы: пары (номер, id поста, основы слов)."""
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, body, post_id) '
+                f'VALUES (%s, %s, %s)',
+                [(doc, ' '.join(words), post_id)
+                 for doc, post_id, words in rows]
+            )
+
+    def match(self, words):
+        """SQL с колонками doc, post_id, score и его параметры."""
+        # Основы - только буквы и цифры, кавычки внутри не встретятся
+        query = ' '.join(f'"{word}"*' for word in words)
+        # Скрытая колонка rank - это bm25(); в отличие от самой функции
+        # её можно читать в подзапросе, который группирует ranked_posts
+        sql = (
+            f'SELECT rowid AS doc, CAST(post_id AS INTEGER) AS post_id, '
+            f'-rank * CASE rowid & 1 '
+            f'WHEN {POST} THEN {KIND_WEIGHTS[POST]} '
+            f'ELSE {KIND_WEIGHTS[COMMENT]} END AS score '
+            f'FROM {self.table} WHERE {self.table} MATCH %s'
+        )
+        return sql, [query]
+
+
+class InvertedIndexBackend:
+    table = SearchPosting._meta.db_table
+
+    def clear(self):
+        SearchPosting.objects.all().delete()
+
+    def delete(self, documents):
+        SearchPosting.objects.filter(document__in=documents).delete()
+
+    def add(self, rows):
+        SearchPosting.objects.bulk_create(
+            SearchPosting(
+                term=term, document=doc, post_id=post_id,
+                weight=self.weight(count, len(words)) * KIND_WEIGHTS[doc & 1]
+            )
+            for doc, post_id, words in rows
+            for term, count in Counter(words).items()
+        )
+
+    @staticmethod
+    def weight(count, length):
+        norm = 1 - B + B * length / AVERAGE_LENGTH
+        return count * (K1 + 1) / (count + K1 * norm)
+
+    def idf(self, bounds, total):
+        found = SearchPosting.objects.filter(
+            term__gte=bounds[0], term__lt=bounds[1]
+        ).values('document').distinct().count()
+        return math.log(1 + (total - found + 0.5) / (found + 0.5))
+
+    def match(self, words):
+        # Префикс как диапазон строк, чтобы работал индекс по term
+        bounds = [(word, word + '\uffff') for word in words]
+        condition = 'term >= %s AND term < %s'
+        score = ' + '.join(
+            f'CASE WHEN {condition} THEN weight * %s ELSE 0 END'
+            for _ in bounds
+        )
+        found = ' AND '.join(
+            f'MAX(CASE WHEN {condition} THEN 1 ELSE 0 END) = 1'
+            for _ in bounds
+        )
+        where = ' OR '.join(f'({condition})' for _ in bounds)
+        # Число документов одно на весь запрос
+        total = Post.objects.count() + Comment.objects.count()
+        params = []
+        for pair in bounds:
+            params += [*pair, self.idf(pair, total)]
+        for pair in bounds:
+            params += pair
+        for pair in bounds:
+            params += pair
+        sql = (
+            f'SELECT document AS doc, post_id, SUM({score}) AS score '
+            f'FROM {self.table} WHERE {where} '
+            f'GROUP BY document HAVING {found}'
+        )
+        return sql, params
+
+
+BACKENDS = {
+    'fts5': FTS5Backend(),
+    'inverted': InvertedIndexBackend(),
+}
+_fts5_databases = {}
+
+
+def fts5_available():
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts5_databases:
+        _fts5_databases[name] = (
+            FTS5Backend.table in connection.introspection.table_names()
+        )
+    return _fts5_databases[name]
+
+
+def get_backend():
+    name = settings.SEARCH_BACKEND
+    if name == 'auto':
+        name = 'fts5' if fts5_available() else 'inverted'
+    return BACKENDS[name]
+
+
+def index_post(post):
+    backend = get_backend()
+    doc = document(POST, post.pk)
+    backend.delete([doc])
+    backend.add([(doc, post.pk, terms(post.text))])
+
+
+def index_comment(comment):
+    backend = get_backend()
+    doc = document(COMMENT, comment.pk)
+    backend.delete([doc])
+    backend.add([(doc, comment.post_id, terms(comment.text))])
+
+
+def unindex(kind, pk):
+    get_backend().delete([document(kind, pk)])
+
+
+def _add_documents(backend, kind, rows, batch_size, replace=False):
+    """
+    Добавляет документы из строк (id, id поста, текст) пачками;
+    replace - сначала удалить их прежние версии.
+    """
+    total = 0
+    batch = []
+    for pk, post_id, text in rows.iterator(chunk_size=batch_size):
+        batch.append((document(kind, pk), post_id, terms(text)))
+        if len(batch) == batch_size:
+            total += _flush(backend, batch, replace)
+            batch = []
+    return total + _flush(backend, batch, replace)
+
+
+def _flush(backend, batch, replace):
+    if replace:
+        backend.delete([doc for doc, _, _ in batch])
+    backend.add(batch)
+    return len(batch)
+
+
+def rebuild(batch_size=1000):
+    """Заполняет индекс заново, возвращает число документов."""
+    backend = get_backend()
+    backend.clear()
+    total = _add_documents(
+        backend, POST, Post.objects.values_list('pk', 'id', 'text'),
+        batch_size
+    )
+    return total + _add_documents(
+        backend, COMMENT,
+        Comment.objects.values_list('pk', 'post_id', 'text'), batch_size
+    )
+
+
+def index_posts(posts, batch_size=1000):
+    """
+    Индексирует посты пачками, например после bulk_create, и возвращает
+    их число.
+    """
+    return _add_documents(
+        get_backend(), POST, posts.values_list('pk', 'id', 'text'),
+        batch_size, replace=True
+    )
+
+
+def _fetch(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def ranked_posts(words, limit, after=None):
+    """
+    Пары (id поста, релевантность) по убыванию релевантности;
+    after - пара, с которой продолжить выдачу.
+    """
+    if not words:
+        return []
+    sql, params = get_backend().match(words)
+    sql = f'SELECT post_id, MAX(score) AS best FROM ({sql}) GROUP BY post_id'
+    if after is not None:
+        sql += ' HAVING best < %s OR (best = %s AND post_id < %s)'
+        params += [after[0], after[0], after[1]]
+    sql += ' ORDER BY best DESC, post_id DESC LIMIT %s'
+    return _fetch(sql, params + [limit])
+
+
+def matching_ids(query, kind, limit=ADMIN_LIMIT):
+    """id постов или комментариев, подходящих под запрос, для админки."""
+    words = query_terms(query)
+    if not words:
+        return []
+    sql, params = get_backend().match(words)
+    rows = _fetch(
+        f'SELECT doc FROM ({sql}) WHERE (doc & 1) = %s '
+        f'ORDER BY score DESC LIMIT %s',
+        params + [kind, limit]
+    )
+    return [row[0] >> 1 for row in rows]
+
+
+def encode_cursor(post):
+    return f'{post.search_score!r}_{post.pk}'
+
+
+def decode_cursor(cursor):
+    """Курсор выдачи в пару (релевантность, id) или None."""
+    try:
+        score, pk = cursor.split('_')
+        return float(score), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+class SearchPaginator(KeysetPaginator):
+    """Выдача поиска по ключу (релевантность, id поста), только вперёд."""
+
+    def __init__(self, query, per_page):
+        Paginator.__init__(self, [], per_page)
+        self.num_pages = 1
+        self.words = query_terms(query)
+
+    def get_cursor_page(self, after=None, before=None):
+        cursor = decode_cursor(after)
+        rows = ranked_posts(self.words, self.per_page + 1, cursor)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        posts = Post.objects.for_feed().in_bulk([pk for pk, _ in rows])
+        found = []
+        for pk, score in rows:
+            # Индекс мог пережить пост, если тот удалили в обход сигналов
+            if pk in posts:
+                posts[pk].search_score = score
+                found.append(posts[pk])
+        return self.build_page(
+            found, has_older=has_more, has_newer=cursor is not None
+        )
+
+    def cursor(self, post):
+        return encode_cursor(post)
@@ -0,0 +1,169 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import feed_cache, search, timeline
+from .counters import bump_author, bump_group
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+
+# Поля автора и группы, которые видны в карточках постов
+CARD_FIELDS = {'username', 'first_name', 'last_name', 'title', 'slug'}
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, raw=False, **kwargs):
+    # При редактировании пост может сменить группу:
+    # запоминаем старую, чтобы поправить счётчики обеих
+    instance._old_group_id = None
+    if instance.pk and not raw:
+        instance._old_group_id = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+def count_post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        bump_author(instance.author_id, post_count=1)
+        bump_group(instance.group_id, 1)
+    elif instance._old_group_id != instance.group_id:
+        bump_group(instance._old_group_id, -1)
+        bump_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_post_deleted(sender, instance, **kwargs):
+    bump_author(instance.author_id, post_count=-1)
+    bump_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        bump_author(instance.author_id, comment_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_comment_deleted(sender, instance, **kwargs):
+    bump_author(instance.author_id, comment_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        bump_author(instance.author_id, follower_count=1)
+        bump_author(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_follow_deleted(sender, instance, **kwargs):
+    bump_author(instance.author_id, follower_count=-1)
+    bump_author(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, raw=False, update_fields=None,
+                          **kwargs):
+    # Ленты подписчиков выводятся из поколения профиля автора,
+    # см. feed_cache.generation
+    if raw or (update_fields is not None
+               and not feed_cache.FEED_FIELDS & set(update_fields)):
+        return
+    feed_cache.bump(*feed_cache.post_feeds(instance))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_feeds(sender, instance, raw=False, **kwargs):
+    if not raw:
+        feed_cache.bump(f'post:{instance.post_id}')
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_feeds(sender, instance, raw=False, **kwargs):
+    if not raw:
+        feed_cache.bump(
+            f'profile:{instance.author_id}', f'following:{instance.user_id}'
+        )
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_feeds(sender, instance, created, raw=False, **kwargs):
+    # id удалённого пользователя может достаться новому (например,
+    # после сброса базы), и он не должен увидеть чужую закешированную ленту
+    if created and not raw:
+        feed_cache.bump(f'profile:{instance.pk}', f'following:{instance.pk}')
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group_feed(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feed_cache.bump(f'group:{instance.pk}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Group)
+def invalidate_cards(sender, instance, created, raw=False,
+                     update_fields=None, **kwargs):
+    # Новых имён ещё нет ни в одной ленте; вход (last_login) их не меняет
+    if created or raw or (update_fields is not None
+                          and not CARD_FIELDS & set(update_fields)):
+        return
+    feed_cache.bump(feed_cache.CARDS)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Group)
+def invalidate_cards_deleted(sender, instance, **kwargs):
+    # Посты удалённой группы остаются без группы через UPDATE,
+    # сигналы постов при этом не приходят
+    feed_cache.bump(feed_cache.CARDS)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Сохранение одной даты изменения (см. variants.py) текст не меняет
+    if not raw and (update_fields is None or 'text' in update_fields):
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex(search.POST, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.unindex(search.COMMENT, instance.pk)
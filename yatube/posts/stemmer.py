@@ -0,0 +1,82 @@
+"""
+Стеммер Портера для русского языка (алгоритм Snowball).
+
+Отрезает окончания и суффиксы, чтобы "постами", "постов" и "пост"
+искались как одно слово. Слова не на кириллице не меняются.
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = re.compile(
+    r'((?<=[ая])(в|вши|вшись)|(ив|ивши|ившись|ыв|ывши|ывшись))$'
+)
+REFLEXIVE = re.compile(r'(ся|сь)$')
+ADJECTIVE = re.compile(
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|'
+    r'ую|юю|ая|яя|ою|ею)$'
+)
+PARTICIPLE = re.compile(r'((?<=[ая])(ем|нн|вш|ющ|щ)|(ивш|ывш|ующ))$')
+VERB = re.compile(
+    r'((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)|'
+    r'(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|'
+    r'ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю))$'
+)
+NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|'
+    r'ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+DERIVATIONAL = re.compile(r'ость?$')
+SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+CYRILLIC = re.compile(r'^[а-я]+$')
+
+
+def _region(word, start):
+    """Начало области после первой согласной, идущей за гласной."""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _cut(pattern, word, start):
+    """Отрезает окончание pattern, если оно целиком лежит после start."""
+    # Поиск идёт по срезу: буква "а" или "я" перед окончанием
+    # тоже должна лежать в области
+    match = pattern.search(word[start:])
+    if match:
+        return word[:start + match.start()], True
+    return word, False
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC.match(word):
+        return word
+    rv = next(
+        (i + 1 for i, char in enumerate(word) if char in VOWELS), len(word)
+    )
+    r2 = _region(word, _region(word, 0))
+    # Шаг 1: деепричастие, иначе возвратность и одно из окончаний
+    word, found = _cut(PERFECTIVE_GERUND, word, rv)
+    if not found:
+        word, _ = _cut(REFLEXIVE, word, rv)
+        word, found = _cut(ADJECTIVE, word, rv)
+        if found:
+            word, _ = _cut(PARTICIPLE, word, rv)
+        else:
+            word, found = _cut(VERB, word, rv)
+            if not found:
+                word, _ = _cut(NOUN, word, rv)
+    # Шаг 2
+    if word.endswith('и') and len(word) > rv:
+        word = word[:-1]
+    # Шаг 3: словообразовательный суффикс только в R2
+    word, _ = _cut(DERIVATIONAL, word, r2)
+    # Шаг 4
+    if word.endswith('ь') and len(word) > rv:
+        return word[:-1]
+    word, _ = _cut(SUPERLATIVE, word, rv)
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    return word
@@ -0,0 +1,11 @@
+from django import template
+
+from posts import feed_cache
+
+register = template.Library()
+
+
+@register.simple_tag
+def cards_generation():
+    """Поколение имён авторов и групп для ключа кеша карточек постов."""
+    return feed_cache.generation(feed_cache.CARDS)
@@ -0,0 +1,18 @@
+from django import template
+
+from posts import feed_cache
+
+register = template.Library()
+
+
+@register.filter
+def follows(user, author):
+    """
+    {% if user|follows:author %} - подписан ли user на автора (объект
+    или id). Множество подписок читается из кеша один раз за запрос.
+    """
+    if not user.is_authenticated:
+        return False
+    if not hasattr(user, '_following_ids'):
+        user._following_ids = feed_cache.following_ids(user.pk)
+    return getattr(author, 'pk', author) in user._following_ids
@@ -0,0 +1,47 @@
+from django import template
+
+from posts.models import ImageVariant
+
+register = template.Library()
+
+MIME_TYPES = {
+    ImageVariant.JPEG: 'image/jpeg',
+    ImageVariant.WEBP: 'image/webp',
+}
+
+
+def _srcset(variants):
+    return ', '.join(
+        f'{variant.file.url} {variant.width}w' for variant in variants
+    )
+
+
+@register.simple_tag
+def post_picture(post):
+    """
+    Источники для <picture> по сохранённым вариантам картинки поста
+    или None, пока их строит воркер.
+    """
+    if not post.image:
+        return None
+    by_format = {}
+    # Ленты выбирают варианты без сортировки, см. PostQuerySet.for_feed
+    variants = sorted(
+        post.image_variants.all(), key=lambda variant: variant.width
+    )
+    for variant in variants:
+        by_format.setdefault(variant.format, []).append(variant)
+    fallback = by_format.pop(ImageVariant.JPEG, None)
+    if not fallback:
+        return None
+    largest = fallback[-1]
+    return {
+        'src': largest.file.url,
+        'width': largest.width,
+        'height': largest.height,
+        'srcset': _srcset(fallback),
+        'sources': [
+            {'type': MIME_TYPES[image_format], 'srcset': _srcset(variants)}
+            for image_format, variants in by_format.items()
+        ],
+    }
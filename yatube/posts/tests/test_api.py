@@ -0,0 +1,122 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils.http import http_date
+
+from ..models import Comment, Follow, Group, Post
+from .utils import bump_feeds_immediately
+
+User = get_user_model()
+
+
+@bump_feeds_immediately
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='slug', description=''
+        )
+        for i in range(12):
+            cls.post = Post.objects.create(
+                author=cls.user, text=f'Пост {i}', group=cls.group
+            )
+        Comment.objects.create(
+            post=cls.post, author=cls.reader, text='Коммент'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(ApiTest.reader)
+
+    def test_feeds_page_by_cursor(self):
+        urls = (
+            reverse('posts:api_index'),
+            reverse('posts:api_group_posts', args=('slug',)),
+            reverse('posts:api_profile', args=('auth',)),
+            reverse('posts:api_follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                data = self.reader_client.get(url).json()
+                self.assertEqual(len(data['results']), 10)
+                self.assertEqual(data['results'][0]['text'], 'Пост 11')
+                self.assertEqual(data['results'][0]['group'], 'slug')
+                self.assertIsNone(data['previous'])
+                rest = self.reader_client.get(
+                    url, {'after': data['next']}
+                ).json()
+                self.assertEqual(len(rest['results']), 2)
+                self.assertIsNone(rest['next'])
+
+    def test_post_detail_and_comments(self):
+        data = self.client.get(
+            reverse('posts:api_post_detail', args=(self.post.pk,))
+        ).json()
+        self.assertEqual(data['author'], 'auth')
+        self.assertIsNone(data['picture'])
+        comments = self.client.get(
+            reverse('posts:api_comments', args=(self.post.pk,))
+        ).json()
+        self.assertEqual(comments['results'][0]['text'], 'Коммент')
+        missing = self.client.get(
+            reverse('posts:api_post_detail', args=(self.post.pk + 1,))
+        )
+        self.assertEqual(missing.status_code, 404)
+
+    def test_sparse_fields(self):
+        url = reverse('posts:api_index')
+        data = self.client.get(url, {'fields': 'id,text'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'text'})
+        response = self.client.get(url, {'fields': 'id,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_fields_rejected_on_empty_page(self):
+        empty = Group.objects.create(title='Пустая', slug='empty')
+        urls = (
+            reverse('posts:api_group_posts', args=(empty.slug,)),
+            reverse('posts:api_comments', args=(self.post.pk - 1,)),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, {'fields': 'password'})
+                self.assertEqual(response.status_code, 400)
+
+    def test_repeat_poll_gets_304_without_queries(self):
+        url = reverse('posts:api_index')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        with self.assertNumQueries(0):
+            repeat = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repeat.status_code, 304)
+        # Новый пост меняет поколение ленты, а с ним и ETag
+        Post.objects.create(author=self.user, text='Свежий пост')
+        fresh = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertEqual(fresh.json()['results'][0]['text'], 'Свежий пост')
+        self.assertNotEqual(fresh['ETag'], etag)
+
+    def test_write_in_same_second_is_not_304(self):
+        url = reverse('posts:api_index')
+        self.client.get(url)
+        Post.objects.create(author=self.user, text='Свежий пост')
+        # Клиент с If-Modified-Since на конец текущей секунды
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 1)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(
+            response.json()['results'][0]['text'], 'Свежий пост'
+        )
+
+    def test_follow_feed_needs_login(self):
+        response = self.client.get(reverse('posts:api_follow_index'))
+        self.assertEqual(response.status_code, 401)
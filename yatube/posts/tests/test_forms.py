@@ -1,14 +1,31 @@
+import hashlib
+import io
+import os
 import shutil
 import tempfile
+from unittest import mock, skipUnless
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.core.management import call_command
+from django.template.defaultfilters import filesizeformat
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
 from django.urls import reverse
+from PIL import Image, PngImagePlugin, features
 
+from core.storage import ContentAddressedStorage
+
+from .. import thumbnails, variants
 from ..forms import PostForm
 from ..models import Group, Post
+from ..uploads import (ImageUploadHandler, JpegMetadataFilter,
+                       PngMetadataFilter, WebpMetadataFilter)
 
 User = get_user_model()
 
@@ -53,6 +70,9 @@ class PostFormTest(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        # Корзины лимитов записи привязаны к id пользователя,
+        # а id от теста к тесту повторяются
+        cache.clear()
         # Создаем авторизованый клиент
         self.authorized_client = Client()
         self.authorized_client.force_login(PostFormTest.user)
@@ -102,7 +122,9 @@ class PostFormTest(TestCase):
                 author=PostFormTest.user,
                 text=form_data['text'],
                 group=PostFormTest.group,
-                image='posts/small.gif'
+                image=ContentAddressedStorage.hashed_name(
+                    'posts/small.gif', hashlib.sha256(small_gif).hexdigest()
+                )
             ).exists()
         )
         latest_post = Post.objects.latest('pub_date')
@@ -140,3 +162,266 @@ class PostFormTest(TestCase):
                 group=PostFormTest.group,
             ).exists()
         )
+
+
+def make_image(image_format, size=(40, 20), exif=None, **options):
+    buffer = io.BytesIO()
+    image = Image.new('RGB', size, (200, 30, 30))
+    if exif is not None:
+        options['exif'] = exif.tobytes()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def riff_chunk(fourcc, data):
+    return fourcc + len(data).to_bytes(4, 'little') + data + bytes(
+        len(data) % 2
+    )
+
+
+def make_webp(*chunks):
+    """WebP из готовых чанков: Pillow может быть собран без libwebp."""
+    body = b'WEBP' + b''.join(chunks)
+    return b'RIFF' + len(body).to_bytes(4, 'little') + body
+
+
+# VP8X с флагами EXIF и XMP, картинка-заглушка и чанки метаданных
+WEBP_IMAGE = riff_chunk(b'VP8L', b'\x2f' + bytes(8))
+WEBP_WITH_METADATA = make_webp(
+    riff_chunk(b'VP8X', b'\x0c' + bytes(9)),
+    WEBP_IMAGE,
+    riff_chunk(b'EXIF', b'GPS 55.45'),
+    riff_chunk(b'XMP ', b'<x:xmpmeta/>'),
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadTest(TestCase):
+    """Потоковый приём картинок в post_create."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(ImageUploadTest.user)
+
+    def upload(self, name, content):
+        return self.client.post(reverse('posts:post_create'), {
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile(name, content),
+        })
+
+    def test_exif_is_stripped_except_orientation(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Камера'
+        exif[0x8825] = {2: (55.0, 45.0, 0.0)}
+        self.upload('photo.jpg', make_image('JPEG', exif=exif))
+        post = Post.objects.get(author=ImageUploadTest.user)
+        with Image.open(post.image.path) as image:
+            self.assertEqual(dict(image.getexif()), {0x0112: 6})
+            self.assertEqual(image.size, (40, 20))
+        self.assertEqual(
+            os.stat(post.image.path).st_mode & 0o777,
+            settings.FILE_UPLOAD_PERMISSIONS
+        )
+        # Временный файл не копируется, а переносится на место
+        self.assertEqual(
+            os.listdir(os.path.join(TEMP_MEDIA_ROOT, 'uploads')), []
+        )
+
+    def test_png_text_chunks_are_stripped(self):
+        info = PngImagePlugin.PngInfo()
+        info.add_text('Author', 'Секрет')
+        self.upload('image.png', make_image('PNG', pnginfo=info))
+        post = Post.objects.get(author=ImageUploadTest.user)
+        with Image.open(post.image.path) as image:
+            image.load()
+            self.assertNotIn('Author', image.info)
+
+    def test_webp_metadata_chunks_are_stripped(self):
+        handler = ImageUploadHandler(RequestFactory().post('/'))
+        with mock.patch('posts.uploads.read_header',
+                        return_value=('WEBP', (1, 1), None)):
+            with self.assertRaises(StopFutureHandlers):
+                handler.new_file('image', 'photo.webp', 'image/webp', None)
+            for start in range(0, len(WEBP_WITH_METADATA), 7):
+                handler.receive_data_chunk(
+                    WEBP_WITH_METADATA[start:start + 7], start
+                )
+            file = handler.file_complete(len(WEBP_WITH_METADATA))
+        with file:
+            content = file.read()
+        # Флаги метаданных сняты, размер RIFF исправлен, хеш пересчитан
+        self.assertEqual(content, make_webp(
+            riff_chunk(b'VP8X', bytes(10)), WEBP_IMAGE
+        ))
+        self.assertEqual(file.sha256, hashlib.sha256(content).hexdigest())
+
+    @skipUnless(features.check('webp'), 'Pillow собран без WebP')
+    def test_webp_exif_is_stripped(self):
+        exif = Image.Exif()
+        exif[0x8825] = {2: (55.0, 45.0, 0.0)}
+        self.upload('photo.webp', make_image('WEBP', exif=exif))
+        post = Post.objects.get(author=ImageUploadTest.user)
+        with Image.open(post.image.path) as image:
+            image.load()
+            self.assertNotIn('exif', image.info)
+            self.assertEqual(image.size, (40, 20))
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=100)
+    def test_pixel_limit(self):
+        response = self.upload('big.png', make_image('PNG'))
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка больше 100 пикселей'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=50)
+    def test_byte_limit(self):
+        response = self.upload('big.png', make_image('PNG'))
+        self.assertFormError(
+            response, 'form', 'image', f'Картинка больше {filesizeformat(50)}'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    def test_not_an_image(self):
+        response = self.upload('fake.png', b'not an image')
+        self.assertFormError(
+            response, 'form', 'image',
+            'Загрузите картинку в формате JPEG, PNG, GIF или WebP'
+        )
+
+    def test_csrf_is_still_checked(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(ImageUploadTest.user)
+        response = client.post(
+            reverse('posts:post_create'), {'text': 'Без токена'}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_filters_do_not_depend_on_chunk_size(self):
+        exif = Image.Exif()
+        exif[0x0112] = 3
+        for content, metadata_filter in (
+            (make_image('JPEG', exif=exif), lambda: JpegMetadataFilter(3)),
+            (make_image('PNG'), PngMetadataFilter),
+            (WEBP_WITH_METADATA, WebpMetadataFilter),
+        ):
+            whole = metadata_filter()
+            expected = whole.feed(content) + whole.flush()
+            by_byte = metadata_filter()
+            result = b''.join(
+                by_byte.feed(content[i:i + 1]) for i in range(len(content))
+            ) + by_byte.flush()
+            self.assertEqual(result, expected)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ContentAddressedMediaTest(TestCase):
+    """Одинаковые картинки хранятся один раз, мусор убирает gc_media."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='dedup')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(ContentAddressedMediaTest.user)
+
+    def create_post(self, name, content):
+        self.client.post(reverse('posts:post_create'), {
+            'text': name,
+            'image': SimpleUploadedFile(name, content),
+        })
+        return Post.objects.get(text=name)
+
+    def test_same_bytes_stored_once(self):
+        content = make_image('PNG')
+        first = self.create_post('first.png', content)
+        second = self.create_post('second.png', content)
+        self.assertEqual(first.image.name, second.image.name)
+        directory = os.path.dirname(first.image.path)
+        self.assertEqual(os.listdir(directory), [
+            os.path.basename(first.image.name)
+        ])
+        # Варианты второй копии берутся у первой, а не строятся заново
+        thumbnails.generate(first.pk)
+        with mock.patch.object(variants, 'render_all') as render_all:
+            thumbnails.generate(second.pk)
+        render_all.assert_not_called()
+        self.assertEqual(
+            sorted(second.image_variants.values_list('file', flat=True)),
+            sorted(first.image_variants.values_list('file', flat=True)),
+        )
+
+    def test_gc_removes_only_unreferenced_files(self):
+        post = self.create_post('kept.png', make_image('PNG'))
+        thumbnails.generate(post.pk)
+        orphan = self.create_post('orphan.png', make_image('PNG', (8, 8)))
+        orphan_name = orphan.image.name
+        orphan.delete()
+        # Свежие файлы команда по умолчанию не трогает
+        call_command('gc_media', stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(orphan_name))
+        call_command('gc_media', min_age=0, stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(orphan_name))
+        self.assertTrue(default_storage.exists(post.image.name))
+        for variant in post.image_variants.all():
+            self.assertTrue(default_storage.exists(variant.file.name))
+
+    def test_gc_removes_legacy_sorl_cache(self):
+        name = default_storage.save(
+            'cache/ab/cd/abcd.jpg', ContentFile(make_image('JPEG'))
+        )
+        call_command('gc_media', dry_run=True, stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(name))
+        call_command('gc_media', stdout=io.StringIO())
+        self.assertFalse(default_storage.exists('cache'))
+
+
+class ThumbnailScheduleTest(SimpleTestCase):
+    def test_edit_during_build_rebuilds_once_more(self):
+        queued = []
+        builds = []
+
+        def generate(post_id):
+            builds.append(post_id)
+            if len(builds) == 1:
+                # Картинку поменяли, пока строились варианты прежней
+                thumbnails.schedule(post_id)
+                thumbnails.schedule(post_id)
+
+        executor = mock.Mock()
+        executor.submit.side_effect = lambda func, *args: queued.append(
+            (func, args)
+        )
+        with mock.patch.object(thumbnails, '_inline', return_value=False), \
+                mock.patch.object(thumbnails, '_get_executor',
+                                  return_value=executor), \
+                mock.patch.object(thumbnails, 'generate', generate):
+            thumbnails.schedule(1)
+            # Ещё не начатая задача повторно в очередь не ставится
+            thumbnails.schedule(1)
+            self.assertEqual(len(queued), 1)
+            func, args = queued.pop()
+            func(*args)
+        self.assertEqual(builds, [1, 1])
+        self.assertEqual(queued, [])
+        self.assertFalse(thumbnails._running or thumbnails._dirty)
@@ -0,0 +1,169 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from .. import search
+from ..models import AuthorStats, Group, ImportState, Post
+from .utils import bump_feeds_immediately
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@bump_feeds_immediately
+class ImportPostsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа', slug='slug', description=''
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def jsonl(self, records):
+        return self.write('posts.jsonl', ''.join(
+            json.dumps(record, ensure_ascii=False) + '\n'
+            for record in records
+        ))
+
+    def run_import(self, path, *args):
+        output = io.StringIO()
+        call_command(
+            'import_posts', path, '--skip-variants', *args,
+            stdout=output, stderr=io.StringIO()
+        )
+        return output.getvalue()
+
+    def test_jsonl_import_updates_counters_search_and_feeds(self):
+        # Лента закеширована до импорта и должна обновиться после
+        self.client.get(reverse('posts:index'))
+        path = self.jsonl([
+            {'text': 'Импортированный пост', 'author': 'auth',
+             'group': 'slug', 'pub_date': '2015-03-01T10:00:00'},
+            {'text': 'Пост нового автора', 'author': 'newcomer'},
+            {'text': '', 'author': 'auth'},
+            {'text': 'Пост без автора'},
+        ])
+        output = self.run_import(path, '--create-authors')
+        self.assertIn('Импортировано постов: 2, пропущено записей: 2', output)
+        post = Post.objects.get(text='Импортированный пост')
+        self.assertEqual(post.group, self.group)
+        self.assertEqual(post.pub_date.year, 2015)
+        newcomer = User.objects.get(username='newcomer')
+        self.assertEqual(AuthorStats.for_user(newcomer).post_count, 1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.post_count, 1)
+        self.assertEqual(
+            [p.pk for p in search.SearchPaginator(
+                'импортированный', 10
+            ).get_cursor_page()],
+            [post.pk]
+        )
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'Пост нового автора')
+        self.assertFalse(ImportState.objects.exists())
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+
+    def test_unknown_authors_and_groups_are_skipped(self):
+        path = self.jsonl([
+            {'text': 'Чужой автор', 'author': 'stranger'},
+            {'text': 'Чужая группа', 'author': 'auth', 'group': 'other'},
+        ])
+        self.run_import(path)
+        self.assertFalse(Post.objects.exists())
+        self.run_import(path, '--create-authors', '--create-groups')
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_csv_import(self):
+        path = self.write(
+            'posts.csv',
+            'text,author,group\nИз CSV,auth,slug\nЕщё из CSV,auth,\n'
+        )
+        self.run_import(path)
+        self.assertEqual(
+            set(Post.objects.values_list('text', 'group')),
+            {('Из CSV', self.group.pk), ('Ещё из CSV', None)}
+        )
+
+    def test_interrupted_import_resumes(self):
+        path = self.jsonl([
+            {'text': f'Пост {i}', 'author': 'auth'} for i in range(5)
+        ])
+        # Первые две записи уже вставил прерванный запуск
+        ImportState.objects.create(
+            source=os.path.abspath(path), records=2, imported=2, start_pk=0
+        )
+        with self.assertRaises(CommandError):
+            self.run_import(path)
+        self.run_import(path, '--resume', '--batch-size', '2')
+        self.assertEqual(
+            sorted(Post.objects.values_list('text', flat=True)),
+            ['Пост 2', 'Пост 3', 'Пост 4']
+        )
+
+    def test_batch_and_checkpoint_commit_together(self):
+        path = self.jsonl([
+            {'text': f'Пост {i}', 'author': 'auth'} for i in range(4)
+        ])
+        save = ImportState.save
+
+        def crash_on_second_batch(state, *args, **kwargs):
+            if state.records == 4:
+                raise KeyboardInterrupt
+            save(state, *args, **kwargs)
+
+        with mock.patch.object(ImportState, 'save', crash_on_second_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                self.run_import(path, '--batch-size', '2')
+        # Вторая пачка откатилась вместе с состоянием
+        self.assertEqual(Post.objects.count(), 2)
+        self.run_import(path, '--resume', '--batch-size', '2')
+        self.assertEqual(
+            sorted(Post.objects.values_list('text', flat=True)),
+            ['Пост 0', 'Пост 1', 'Пост 2', 'Пост 3']
+        )
+
+    def test_images_are_validated_and_stored(self):
+        Image.new('RGB', (10, 10), 'red').save(
+            os.path.join(self.directory, 'red.png')
+        )
+        self.write('fake.png', 'не картинка')
+        path = self.jsonl([
+            {'text': 'С картинкой', 'author': 'auth', 'image': 'red.png'},
+            {'text': 'С фальшивкой', 'author': 'auth', 'image': 'fake.png'},
+        ])
+        self.run_import(path, '--images', self.directory)
+        post = Post.objects.get()
+        self.assertEqual(post.text, 'С картинкой')
+        self.assertTrue(post.image.name.startswith('posts/'))
+        self.assertTrue(post.image.storage.exists(post.image.name))
@@ -1,7 +1,10 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-from ..models import Group, Post
+from ..models import AuthorStats, Comment, Follow, Group, Post
 
 User = get_user_model()
 
@@ -32,3 +35,61 @@ class PostModelTest(TestCase):
         post = PostModelTest.post
         expected_post_name = post.text[:15]
         self.assertEqual(expected_post_name, str(post))
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='slug',
+            description='Тестовое описание',
+        )
+        self.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other',
+            description='Тестовое описание',
+        )
+
+    def stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются вместе с постами, комментами и подписками."""
+        post = Post.objects.create(
+            author=self.author, text='Тестовый пост', group=self.group
+        )
+        Comment.objects.create(post=post, author=self.reader, text='Коммент')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.stats(self.author).post_count, 1)
+        self.assertEqual(self.stats(self.author).follower_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+        self.assertEqual(self.stats(self.reader).comment_count, 1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.post_count, 1)
+        # Пост переехал в другую группу
+        post.group = self.other_group
+        post.save()
+        self.group.refresh_from_db()
+        self.other_group.refresh_from_db()
+        self.assertEqual(self.group.post_count, 0)
+        self.assertEqual(self.other_group.post_count, 1)
+        # Удаление поста уносит и комментарий
+        Follow.objects.filter(user=self.reader).delete()
+        post.delete()
+        self.assertEqual(self.stats(self.author).post_count, 0)
+        self.assertEqual(self.stats(self.author).follower_count, 0)
+        self.assertEqual(self.stats(self.reader).comment_count, 0)
+
+    def test_recount_stats_repairs_drift(self):
+        """Команда recount_stats чинит разъехавшиеся счётчики."""
+        Post.objects.bulk_create([
+            Post(author=self.author, text='Тестовый пост', group=self.group)
+        ])
+        AuthorStats.objects.filter(user=self.reader).delete()
+        call_command('recount_stats', stdout=StringIO())
+        self.assertEqual(self.stats(self.author).post_count, 1)
+        self.assertEqual(self.stats(self.reader).post_count, 0)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.post_count, 1)
@@ -0,0 +1,139 @@
+import json
+import os
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import timeline, variants
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# Полный проход по таблице: SCAN без USING INDEX
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+(?!.*USING)')
+# Сортировка во временном B-дереве: индекс не отдаёт строки в нужном порядке
+TEMP_SORT = re.compile(r'USE TEMP B-TREE')
+# Путь к файлу, в который сохранить планы запросов, например для сравнения
+# между коммитами: QUERY_PLANS_OUTPUT=plans.json python manage.py test
+PLANS_OUTPUT = os.getenv('QUERY_PLANS_OUTPUT')
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+class FeedQueryPlansTest(TestCase):
+    """
+    Запросы лент идут по индексам: без полных проходов по таблицам
+    и без сортировки во временном B-дереве.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.follower = User.objects.create_user(username='follower')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user, text='Тестовый пост', group=cls.group
+        )
+        Comment.objects.create(
+            post=cls.post, author=cls.follower, text='Коммент'
+        )
+        Follow.objects.create(user=cls.follower, author=cls.user)
+        cls.plans = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if PLANS_OUTPUT:
+            with open(PLANS_OUTPUT, 'w', encoding='utf-8') as output:
+                json.dump(cls.plans, output, ensure_ascii=False, indent=2)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(FeedQueryPlansTest.follower)
+
+    def capture_plans(self, name, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        plans = [
+            {'sql': query['sql'], 'plan': explain(query['sql'])}
+            for query in queries
+            if query['sql'].startswith('SELECT')
+        ]
+        FeedQueryPlansTest.plans[name] = plans
+        return plans
+
+    def steps(self, plans, pattern):
+        return [
+            (step, plan['sql'])
+            for plan in plans for step in plan['plan']
+            if pattern.search(step)
+        ]
+
+    def assertIndexedFeed(self, name, url):
+        plans = self.capture_plans(name, url)
+        self.assertEqual(self.steps(plans, FULL_SCAN), [])
+        self.assertEqual(self.steps(plans, TEMP_SORT), [])
+
+    def test_feed_views_do_not_scan_tables(self):
+        urls = {
+            'index': reverse('posts:index'),
+            'group_posts': reverse('posts:group_posts', args=('slug',)),
+            'profile': reverse('posts:profile', args=('auth',)),
+            'post_detail': reverse(
+                'posts:post_detail', args=(self.post.pk,)
+            ),
+        }
+        for name, url in urls.items():
+            with self.subTest(view=name):
+                self.assertIndexedFeed(name, url)
+
+    def test_join_follow_feed_does_not_scan_tables(self):
+        # JOIN по подпискам сортирует посты всех авторов во временном
+        # B-дереве - ради этого и есть режимы fanout и hybrid
+        plans = self.capture_plans(
+            'follow_index', reverse('posts:follow_index')
+        )
+        self.assertEqual(self.steps(plans, FULL_SCAN), [])
+
+    @override_settings(FOLLOW_FEED_MODE='fanout')
+    def test_fanout_follow_feed_reads_timeline_index(self):
+        timeline.rebuild()
+        self.assertIndexedFeed(
+            'follow_index_fanout', reverse('posts:follow_index')
+        )
+
+    @override_settings(FOLLOW_FEED_MODE='hybrid', FOLLOW_FEED_FANOUT_LIMIT=1)
+    def test_hybrid_follow_feed_reads_indexes(self):
+        popular = User.objects.create_user(username='popular')
+        fan = User.objects.create_user(username='fan')
+        Follow.objects.create(user=FeedQueryPlansTest.follower, author=popular)
+        Follow.objects.create(user=fan, author=popular)
+        Post.objects.create(author=popular, text='Пост популярного автора')
+        timeline.rebuild()
+        self.assertIndexedFeed(
+            'follow_index_hybrid', reverse('posts:follow_index')
+        )
+
+    def test_variant_reuse_looks_up_image_by_index(self):
+        self.post.image = 'posts/0123abcd.jpg'
+        with CaptureQueriesContext(connection) as queries:
+            variants.reuse(self.post)
+        plan = explain(queries[0]['sql'])
+        scans = [step for step in plan if FULL_SCAN.match(step)]
+        self.assertEqual(scans, [])
+        self.assertTrue(any('post_image_idx' in step for step in plan))
@@ -0,0 +1,125 @@
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import search
+from ..models import Comment, Post
+from ..stemmer import stem
+
+User = get_user_model()
+
+
+class StemmerTest(TestCase):
+    def test_word_forms_share_stem(self):
+        for words in (
+            ('пост', 'посты', 'постами', 'постов'),
+            ('группа', 'группы', 'группой'),
+            ('ёлка', 'елки'),
+        ):
+            with self.subTest(words=words):
+                self.assertEqual(len({stem(word) for word in words}), 1)
+
+    def test_latin_words_are_kept(self):
+        self.assertEqual(stem('Django'), 'django')
+
+
+class SearchTestsMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.python = Post.objects.create(
+            author=cls.user, text='Пишем программы на Python вечерами'
+        )
+        cls.cats = Post.objects.create(
+            author=cls.user, text='Фотографии котов и кошек'
+        )
+        cls.commented = Post.objects.create(
+            author=cls.user, text='Просто пост'
+        )
+        Comment.objects.create(
+            post=cls.commented, author=cls.user, text='Люблю Python'
+        )
+
+    def setUp(self):
+        self.client = Client()
+
+    def found(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return [post.pk for post in response.context['page_obj']]
+
+    def test_stemming_and_prefix(self):
+        self.assertEqual(self.found('программой'), [self.python.pk])
+        self.assertEqual(self.found('прогр'), [self.python.pk])
+        self.assertEqual(self.found('кот'), [self.cats.pk])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.found('python вечер'), [self.python.pk])
+        self.assertEqual(self.found('python котов'), [])
+
+    def test_post_text_ranks_above_comment(self):
+        self.assertEqual(
+            self.found('python'), [self.python.pk, self.commented.pk]
+        )
+
+    def test_index_follows_writes(self):
+        # Копии из базы: объекты класса общие для всех тестов
+        cats = Post.objects.get(pk=self.cats.pk)
+        cats.text = 'Фотографии собак'
+        cats.save()
+        self.assertEqual(self.found('кошек'), [])
+        self.assertEqual(self.found('собака'), [cats.pk])
+        Post.objects.get(pk=self.python.pk).delete()
+        self.assertEqual(self.found('python'), [self.commented.pk])
+        Comment.objects.filter(post=self.commented).delete()
+        self.assertEqual(self.found('python'), [])
+
+    def test_keyset_pages_do_not_overlap(self):
+        for i in range(12):
+            Post.objects.create(author=self.user, text=f'Заметка номер {i}')
+        response = self.client.get(reverse('posts:search'), {'q': 'заметк'})
+        first = response.context['page_obj']
+        self.assertEqual(len(first), 10)
+        self.assertTrue(first.has_next())
+        response = self.client.get(reverse('posts:search'), {
+            'q': 'заметк', 'after': first.next_cursor
+        })
+        second = response.context['page_obj']
+        self.assertEqual(len(second), 2)
+        self.assertFalse(second.has_next())
+        self.assertEqual(
+            {post.pk for post in first} & {post.pk for post in second}, set()
+        )
+
+    def test_admin_search_uses_index(self):
+        post_admin = admin.site._registry[Post]
+        queryset, _ = post_admin.get_search_results(
+            None, Post.objects.all(), 'котами'
+        )
+        self.assertEqual(list(queryset), [self.cats])
+        comment_admin = admin.site._registry[Comment]
+        queryset, _ = comment_admin.get_search_results(
+            None, Comment.objects.all(), 'python'
+        )
+        self.assertEqual(
+            list(queryset), list(Comment.objects.filter(post=self.commented))
+        )
+
+    def test_rebuild(self):
+        search.get_backend().clear()
+        self.assertEqual(self.found('кот'), [])
+        self.assertEqual(search.rebuild(), 4)
+        self.assertEqual(self.found('кот'), [self.cats.pk])
+
+
+@override_settings(SEARCH_BACKEND='fts5')
+class FTS5SearchTest(SearchTestsMixin, TestCase):
+    pass
+
+
+@override_settings(SEARCH_BACKEND='inverted')
+class InvertedIndexSearchTest(SearchTestsMixin, TestCase):
+    def test_documents_counted_once_per_query(self):
+        # Два COUNT на весь запрос и по одному на каждое слово
+        with self.assertNumQueries(2 + 3):
+            search.get_backend().match(['кот', 'пес', 'python'])
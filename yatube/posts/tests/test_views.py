@@ -1,15 +1,28 @@
+import hashlib
+import io
 import shutil
 import tempfile
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.template import Context, Template
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image
 
+from core.storage import ContentAddressedStorage
+
+from .. import feed_cache, thumbnails, variants, views
 from ..forms import PostForm
-from ..models import Comment, Follow, Group, Post
+from ..models import (Comment, Follow, Group, ImageVariant, Post,
+                      TimelineEntry)
+from .utils import bump_feeds_immediately
 
 User = get_user_model()
 
@@ -22,6 +35,7 @@ TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 # Для сохранения media-файлов в тестах будет использоваться
 # временная папка TEMP_MEDIA_ROOT, а потом мы ее удалим
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@bump_feeds_immediately
 class PostTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -50,6 +64,10 @@ class PostTests(TestCase):
             content=small_gif,
             content_type='image/gif'
         )
+        # Хранилище называет файл по хешу содержимого
+        cls.image_name = ContentAddressedStorage.hashed_name(
+            'posts/small.gif', hashlib.sha256(small_gif).hexdigest()
+        )
         # Создаем Пост
         cls.post = Post.objects.create(
             author=PostTests.user,
@@ -150,24 +168,44 @@ class PostTests(TestCase):
             text='Проверка кэша',
         )
         # запрос к index
-        response = self.authorized_client.get(reverse('posts:index'))
+        response = self.guest_client.get(reverse('posts:index'))
         # проверка контекста
         first_object = response.context['page_obj'][0]
         task_text_1 = first_object.text
         task_author_1 = first_object.author.username
         self.assertEqual(task_text_1, 'Проверка кэша')
         self.assertEqual(task_author_1, 'auth')
+        # Повторный запрос целиком обслуживается из кеша
+        with self.assertNumQueries(0):
+            response_cached = self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(response.content, response_cached.content)
         # Удаляем последний созданный пост
         Post.objects.filter(pk=self.post_2.pk).delete()
-        # Новый запрос к index
-        response_new = self.authorized_client.get(reverse('posts:index'))
-        # Проверяем что контент не изменился
-        self.assertEqual(response.content, response_new.content)
-        # очищаем кеш
-        cache.clear()
-        # Новы запрос к index и сравниваем что контент не эквивалентен
-        response_clear = self.authorized_client.get(reverse('posts:index'))
-        self.assertNotEqual(response_clear.content, response_new.content)
+        # Удаление сменило поколение ленты: без очистки кеша
+        # новый запрос к index уже не содержит удалённый пост
+        response_new = self.guest_client.get(reverse('posts:index'))
+        self.assertNotEqual(response.content, response_new.content)
+        self.assertNotContains(response_new, 'Проверка кэша')
+
+    def test_cached_cards_follow_author_and_group_renames(self):
+        """Новое имя автора и адрес группы видны в карточках из кеша."""
+        url = reverse('posts:index')
+        self.guest_client.get(url)
+        before = feed_cache.generation(feed_cache.CARDS)
+        author = User.objects.get(pk=PostTests.user.pk)
+        # Вход обновляет только last_login, карточки остаются в кеше
+        author.save(update_fields=['last_login'])
+        self.assertEqual(feed_cache.generation(feed_cache.CARDS), before)
+        author.first_name, author.last_name = 'Новое', 'Имя'
+        author.save()
+        group = Group.objects.get(pk=PostTests.group.pk)
+        group.slug = 'renamed'
+        group.save()
+        response = self.guest_client.get(url)
+        self.assertContains(response, 'Новое Имя')
+        self.assertContains(
+            response, reverse('posts:group_posts', args=('renamed',))
+        )
 
     def test_group_posts_context_is_ok(self):
         """Шаблон group_posts сформирован с правильным контекстом."""
@@ -177,6 +215,76 @@ class PostTests(TestCase):
         group = response.context['group']
         self.assertEqual(group.title, PostTests.group.title)
 
+    def test_thumbnail_placeholder_until_generated(self):
+        """Пока варианты картинки не построены, вместо неё заглушка."""
+        url, _, args = PostTests.post_detail_url
+        response = self.guest_client.get(reverse(url, args=args))
+        self.assertContains(response, 'Картинка обрабатывается')
+        thumbnails.generate(PostTests.post.pk)
+        response = self.guest_client.get(reverse(url, args=args))
+        self.assertNotContains(response, 'Картинка обрабатывается')
+        self.assertContains(response, '<img class="card-img my-2"')
+        for variant in ImageVariant.objects.filter(
+            post=PostTests.post, format=ImageVariant.JPEG
+        ):
+            self.assertContains(
+                response, f'{variant.file.url} {variant.width}w'
+            )
+
+    def test_image_variants_metadata(self):
+        """Размеры, вес и хеш вариантов совпадают с файлами."""
+        thumbnails.generate(PostTests.post.pk)
+        stored = ImageVariant.objects.filter(post=PostTests.post)
+        expected = len(variants.WIDTHS) * len(variants.formats())
+        self.assertEqual(stored.count(), expected)
+        for variant in stored:
+            with self.subTest(variant=variant.file.name):
+                with variant.file.open('rb') as file:
+                    content = file.read()
+                self.assertEqual(variant.size, len(content))
+                self.assertEqual(
+                    variant.sha256, hashlib.sha256(content).hexdigest()
+                )
+                with Image.open(io.BytesIO(content)) as image:
+                    self.assertEqual(
+                        image.size, (variant.width, variant.height)
+                    )
+        # Повторная генерация заменяет варианты, а не добавляет новые
+        thumbnails.generate(PostTests.post.pk)
+        self.assertEqual(stored.count(), expected)
+
+    def test_variants_of_replaced_image_are_dropped(self):
+        """Варианты картинки, заменённой во время сборки, не сохраняются."""
+        def replace_image(post):
+            rendered = render_all(post)
+            Post.objects.filter(pk=post.pk).update(image='posts/new.gif')
+            return rendered
+
+        render_all = variants.render_all
+        with mock.patch.object(variants, 'render_all', replace_image):
+            self.assertEqual(variants.build(PostTests.post.pk), [])
+        self.assertFalse(
+            ImageVariant.objects.filter(post=PostTests.post).exists()
+        )
+
+    def test_group_posts_shows_only_group_posts(self):
+        """В ленту группы не попадают посты без группы и других групп."""
+        other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other',
+            description='Тестовое описание',
+        )
+        Post.objects.create(author=PostTests.user, text='Без группы')
+        Post.objects.create(
+            author=PostTests.user, text='Чужая группа', group=other_group
+        )
+        url, _, args = PostTests.group_url
+        response = self.guest_client.get(reverse(url, args=args))
+        self.assertEqual(
+            [post.text for post in response.context['page_obj']],
+            [PostTests.post.text]
+        )
+
     def test_post_create_and_edit_is_ok(self):
         urls = (
             PostTests.post_create_url,
@@ -235,7 +343,7 @@ class PostTests(TestCase):
         self.assertEqual(task_text_0, 'Тестовый пост')
         self.assertEqual(task_author_0, 'auth')
         self.assertEqual(task_group_0, 'Тестовая группа')
-        self.assertEqual(task_image_0, 'posts/small.gif')
+        self.assertEqual(task_image_0, PostTests.image_name)
 
     def test_post_detail_context_is_ok(self):
         """Шаблон post_detail сформирован с правильным контекстом."""
@@ -333,3 +441,374 @@ class PaginatorViewsTest(TestCase):
             'posts:profile',
             args=[PaginatorViewsTest.user.username]) + '?page=2')
         self.assertEqual(len(response.context['page_obj']), 3)
+
+    def test_keyset_pages_cover_all_records(self):
+        # Листаем ленту по курсору вперёд и назад
+        url = reverse('posts:index')
+        first_page = self.guest_client.get(url).context['page_obj']
+        self.assertEqual(len(first_page), 10)
+        self.assertFalse(first_page.has_previous())
+        second_page = self.guest_client.get(
+            url, {'after': first_page.next_cursor}
+        ).context['page_obj']
+        self.assertEqual(len(second_page), 3)
+        self.assertFalse(second_page.has_next())
+        seen = {post.pk for post in first_page} | {
+            post.pk for post in second_page
+        }
+        self.assertEqual(len(seen), 13)
+        back_page = self.guest_client.get(
+            url, {'before': second_page.previous_cursor}
+        ).context['page_obj']
+        self.assertEqual(
+            [post.pk for post in back_page],
+            [post.pk for post in first_page]
+        )
+
+    def test_out_of_range_cursor_shows_first_page(self):
+        url = reverse('posts:index')
+        cursors = ('99999999999999999999_1', '-99999999999999999_1',
+                   '1_99999999999999999999', '1_-5')
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                for param in ('after', 'before'):
+                    response = self.guest_client.get(url, {param: cursor})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(
+                        len(response.context['page_obj']), 10
+                    )
+                api = self.guest_client.get(reverse('posts:api_index'),
+                                            {'after': cursor})
+                self.assertEqual(api.status_code, 200)
+
+
+class FeedQueriesTest(TestCase):
+    # Количество запросов на страницу ленты не зависит от числа постов
+    MAX_QUERIES = 6
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.follower = User.objects.create_user(username='follower')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='slug',
+            description='Тестовое описание',
+        )
+        Post.objects.bulk_create([Post(
+            author=cls.user,
+            text=f'Тестовый пост # {i}',
+            group=cls.group
+        ) for i in range(15)])
+        Follow.objects.create(user=cls.follower, author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(FeedQueriesTest.follower)
+
+    def test_feed_pages_query_count_is_capped(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.user.username,)),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.authorized_client.get(url)
+                self.assertEqual(len(response.context['page_obj']), 10)
+                self.assertLessEqual(len(queries), self.MAX_QUERIES)
+
+
+class CommentThreadTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def add_comments(self, count, start=0):
+        users = User.objects.bulk_create(
+            User(username=f'reader{i}') for i in range(start, start + count)
+        )
+        users = User.objects.filter(
+            username__in=[user.username for user in users]
+        )
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=user, text=f'Коммент {user}')
+            for user in users
+        )
+
+    def test_post_detail_query_count_does_not_grow(self):
+        url = reverse('posts:post_detail', args=(self.post.pk,))
+        self.add_comments(3)
+        with CaptureQueriesContext(connection) as few:
+            self.guest_client.get(url)
+        cache.clear()
+        self.add_comments(60, start=3)
+        with CaptureQueriesContext(connection) as many:
+            response = self.guest_client.get(url)
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(
+            len(response.context['comments']), views.COUNT_COMMENTS
+        )
+
+    def test_comment_fragments_cover_all_comments(self):
+        self.add_comments(views.COUNT_COMMENTS + 5)
+        response = self.guest_client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        )
+        first_page = response.context['comments']
+        fragment_url = reverse('posts:comments', args=(self.post.pk,))
+        self.assertContains(
+            response, f'{fragment_url}?after={first_page.next_cursor}'
+        )
+        fragment = self.guest_client.get(
+            fragment_url, {'after': first_page.next_cursor}
+        )
+        self.assertTemplateUsed(fragment, 'posts/includes/comments.html')
+        self.assertTemplateNotUsed(fragment, 'base.html')
+        second_page = fragment.context['comments']
+        self.assertEqual(len(second_page), 5)
+        self.assertIsNone(second_page.next_cursor)
+        self.assertNotContains(fragment, 'Показать ещё комментарии')
+        seen = {c.pk for c in first_page} | {c.pk for c in second_page}
+        self.assertEqual(seen, set(
+            Comment.objects.values_list('pk', flat=True)
+        ))
+
+    def test_comment_fragment_of_missing_post(self):
+        response = self.guest_client.get(
+            reverse('posts:comments', args=(self.post.pk + 1,))
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@bump_feeds_immediately
+class PostDetailCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(PostDetailCacheTest.user)
+        self.url = reverse('posts:post_detail', args=(self.post.pk,))
+
+    def test_anonymous_view_is_served_from_cache(self):
+        self.guest_client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.guest_client.get(self.url)
+        self.assertContains(response, 'Тестовый пост')
+        self.assertFalse(response.context['form'].is_bound)
+
+    def test_comment_and_edit_invalidate_cache(self):
+        self.guest_client.get(self.url)
+        self.authorized_client.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            {'text': 'Свежий коммент'}
+        )
+        self.assertContains(self.guest_client.get(self.url), 'Свежий коммент')
+        self.authorized_client.post(
+            reverse('posts:post_edit', args=(self.post.pk,)),
+            {'text': 'Исправленный пост'}
+        )
+        response = self.guest_client.get(self.url)
+        self.assertContains(response, 'Исправленный пост')
+        self.assertNotContains(response, 'Тестовый пост')
+
+    def test_author_post_count_follows_new_posts(self):
+        response = self.guest_client.get(self.url)
+        self.assertEqual(response.context['author_posts'], 1)
+        Post.objects.create(author=self.user, text='Ещё пост')
+        response = self.guest_client.get(self.url)
+        self.assertEqual(response.context['author_posts'], 2)
+
+    def test_missing_post_is_not_found(self):
+        response = self.guest_client.get(
+            reverse('posts:post_detail', args=(self.post.pk + 1,))
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@bump_feeds_immediately
+class FollowStateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.other = User.objects.create_user(username='other')
+        cls.follower = User.objects.create_user(username='follower')
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(FollowStateTest.follower)
+        self.url = reverse('posts:profile', args=(self.author.username,))
+
+    def follow_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(url)
+        return response, [
+            query['sql'] for query in queries
+            if 'posts_follow' in query['sql']
+        ]
+
+    def test_profile_reads_follow_state_from_cache(self):
+        self.authorized_client.get(self.url)
+        response, queries = self.follow_queries(self.url)
+        self.assertFalse(response.context['following'])
+        self.assertEqual(queries, [])
+
+    def test_follow_and_unfollow_invalidate_state(self):
+        self.authorized_client.get(self.url)
+        self.authorized_client.get(
+            reverse('posts:profile_follow', args=(self.author.username,))
+        )
+        response = self.authorized_client.get(self.url)
+        self.assertTrue(response.context['following'])
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow', args=(self.author.username,))
+        )
+        response = self.authorized_client.get(self.url)
+        self.assertFalse(response.context['following'])
+
+    def test_template_filter(self):
+        Follow.objects.create(user=self.follower, author=self.author)
+        template = Template(
+            '{% load follows %}{{ user|follows:author }} '
+            '{{ user|follows:other.pk }} {{ guest|follows:author }}'
+        )
+        with self.assertNumQueries(1):
+            rendered = template.render(Context({
+                'user': self.follower, 'author': self.author,
+                'other': self.other, 'guest': AnonymousUser(),
+            }))
+        self.assertEqual(rendered, 'True False False')
+
+
+@bump_feeds_immediately
+class FollowFeedModesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.follower = User.objects.create_user(username='follower')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.follower)
+
+    def follow_feed_texts(self):
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        return [post.text for post in response.context['page_obj']]
+
+    def check_follow_feed(self):
+        Post.objects.create(author=self.author, text='До подписки')
+        self.authorized_client.get(
+            reverse('posts:profile_follow', args=(self.author.username,))
+        )
+        Post.objects.create(author=self.author, text='После подписки')
+        self.assertEqual(
+            self.follow_feed_texts(), ['После подписки', 'До подписки']
+        )
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow', args=(self.author.username,))
+        )
+        self.assertEqual(self.follow_feed_texts(), [])
+
+    def test_post_save_does_not_touch_follower_keys(self):
+        Follow.objects.create(user=self.follower, author=self.author)
+        with mock.patch.object(feed_cache, 'bump') as bump:
+            post = Post.objects.create(author=self.author, text='Пост')
+        bump.assert_called_once()
+        self.assertEqual(set(bump.call_args[0]), {
+            'index', f'profile:{self.author.pk}', f'post:{post.pk}'
+        })
+
+    def test_technical_save_keeps_feed_generations(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        before = feed_cache.generation('index')
+        post.save(update_fields=['updated'])
+        self.assertEqual(feed_cache.generation('index'), before)
+        post.save(update_fields=['text'])
+        self.assertNotEqual(feed_cache.generation('index'), before)
+
+    @override_settings(FOLLOW_FEED_MODE='fanout')
+    def test_fanout_feed_uses_timeline(self):
+        Post.objects.create(author=self.author, text='До подписки')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Post.objects.create(author=self.author, text='После подписки')
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.follower).count(), 2
+        )
+        Follow.objects.filter(user=self.follower).delete()
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(FOLLOW_FEED_MODE='fanout', FOLLOW_FEED_LENGTH=2)
+    def test_timeline_is_trimmed(self):
+        posts = [
+            Post.objects.create(author=self.author, text=f'Пост {i}')
+            for i in range(3)
+        ]
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.assertEqual(
+            set(TimelineEntry.objects.values_list('post', flat=True)),
+            {posts[1].pk, posts[2].pk}
+        )
+
+    @override_settings(FOLLOW_FEED_MODE='hybrid', FOLLOW_FEED_FANOUT_LIMIT=1)
+    def test_hybrid_feed_pages_by_cursor(self):
+        popular = User.objects.create_user(username='popular')
+        fan = User.objects.create_user(username='fan')
+        for user, author in ((self.follower, self.author),
+                             (self.follower, popular), (fan, popular)):
+            Follow.objects.create(user=user, author=author)
+        for i in range(views.COUNT_POST + 3):
+            author = popular if i % 2 else self.author
+            Post.objects.create(author=author, text=f'Пост {i}')
+        texts = []
+        url = reverse('posts:follow_index')
+        while url:
+            page = self.authorized_client.get(url).context['page_obj']
+            texts += [post.text for post in page]
+            url = page.next_cursor and (
+                f'{reverse("posts:follow_index")}?after={page.next_cursor}'
+            )
+        self.assertEqual(texts, list(Post.objects.order_by(
+            '-pub_date', '-pk'
+        ).values_list('text', flat=True)))
+
+    def test_follow_feed_modes(self):
+        modes = (
+            ('join', 10000),
+            ('fanout', 10000),
+            ('hybrid', 10000),
+            # Автор с одним подписчиком уже считается популярным
+            ('hybrid', 0),
+        )
+        for mode, limit in modes:
+            with self.subTest(mode=mode, limit=limit):
+                Post.objects.all().delete()
+                with self.settings(FOLLOW_FEED_MODE=mode,
+                                   FOLLOW_FEED_FANOUT_LIMIT=limit):
+                    self.check_follow_feed()
+
+
+class FeedGenerationCommitTest(TestCase):
+    def test_bump_waits_for_commit(self):
+        cache.clear()
+        before = feed_cache.generation('index')
+        author = User.objects.create_user(username='auth')
+        Post.objects.create(author=author, text='Новый пост')
+        # Транзакция теста не закоммичена: новое поколение раньше
+        # коммита дало бы читателю закешировать ленту без поста
+        self.assertEqual(feed_cache.generation('index'), before)
+        for _, callback in connection.run_on_commit:
+            callback()
+        self.assertGreater(feed_cache.generation('index'), before)
@@ -0,0 +1,13 @@
+from unittest import mock
+
+from .. import feed_cache
+
+
+def bump_feeds_immediately(test_class):
+    """
+    feed_cache.bump ждёт коммита, а транзакцию теста TestCase
+    не коммитит: в тестах кеша лент поколения меняются сразу.
+    """
+    return mock.patch.object(
+        feed_cache, 'on_commit', lambda func: func()
+    )(test_class)
@@ -0,0 +1,98 @@
+"""
+Фоновая генерация вариантов картинок постов (см. posts/variants.py).
+
+Варианты строятся не во время первого показа ленты, а сразу после
+сохранения поста: задача уходит в пул потоков (THUMBNAIL_WORKERS),
+а шаблоны до её готовности показывают заглушку.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import variants
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+# Поставлены в очередь и ещё не начаты: повторный запрос не нужен,
+# задача и так прочитает свежую картинку
+_pending = set()
+# Строятся сейчас; запрос во время сборки помечает пост в _dirty,
+# и после неё варианты строятся ещё раз
+_running = set()
+_dirty = set()
+_lock = threading.Lock()
+
+
+def generate(post_id):
+    """Строит варианты картинки поста post_id."""
+    variants.build(post_id)
+
+
+def _run(post_id):
+    with _lock:
+        _pending.discard(post_id)
+        _running.add(post_id)
+    try:
+        while True:
+            try:
+                generate(post_id)
+            except Exception:
+                logger.exception(
+                    'Не удалось построить варианты поста %s', post_id
+                )
+            with _lock:
+                if post_id not in _dirty:
+                    _running.discard(post_id)
+                    return
+                _dirty.discard(post_id)
+    finally:
+        # У каждого потока пула своё соединение с базой
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def _inline():
+    if not settings.THUMBNAIL_WORKERS:
+        return True
+    # Общую in-memory базу SQLite (так устроены тесты) запись из другого
+    # потока блокирует целиком, поэтому с ней варианты строятся сразу
+    is_in_memory_db = getattr(connection, 'is_in_memory_db', None)
+    return bool(is_in_memory_db and is_in_memory_db())
+
+
+def schedule(post_id):
+    """Ставит генерацию вариантов в очередь пула потоков."""
+    if _inline():
+        generate(post_id)
+        return
+    with _lock:
+        if post_id in _pending:
+            return
+        if post_id in _running:
+            _dirty.add(post_id)
+            return
+        _pending.add(post_id)
+    _get_executor().submit(_run, post_id)
+
+
+def schedule_on_commit(post):
+    """
+    Генерация начнётся, только когда пост и файл точно сохранены.
+    Для поста без картинки задача удалит прежние варианты.
+    """
+    post_id = post.pk
+    transaction.on_commit(lambda: schedule(post_id))
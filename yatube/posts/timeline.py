@@ -0,0 +1,164 @@
+"""
+Лента подписок.
+
+Режим задаётся настройкой FOLLOW_FEED_MODE:
+- 'join'   - лента собирается JOIN-ом по Follow при каждом чтении;
+- 'fanout' - при публикации id и дата поста раскладываются по лентам
+  подписчиков (TimelineEntry), чтение страницы - один поиск по индексу
+  (user, -pub_date, -post);
+- 'hybrid' - как 'fanout', но посты авторов, у которых подписчиков
+  больше FOLLOW_FEED_FANOUT_LIMIT, не раскладываются, а добавляются
+  в ленту при чтении: по запросу на автора, страницы сливаются
+  в памяти (MergedKeysetPaginator).
+
+В ленте хранятся последние FOLLOW_FEED_LENGTH постов, старые
+обрезаются (trim).
+"""
+from django.conf import settings
+from django.db.models import F, Q
+
+from .models import AuthorStats, Follow, Post, TimelineEntry
+from .paginators import (KeysetPaginator, MergedKeysetPaginator,
+                         TimelinePaginator)
+
+# Ленты подписчиков обрезает каждый TRIM_EVERY-й пост (по id), а не каждый:
+# лента в среднем выходит за FOLLOW_FEED_LENGTH на столько записей
+TRIM_EVERY = 100
+
+
+def fanout_enabled():
+    return settings.FOLLOW_FEED_MODE in ('fanout', 'hybrid')
+
+
+def is_popular(author_id):
+    """Автор, чьи посты в гибридном режиме читаются, а не раскладываются."""
+    if settings.FOLLOW_FEED_MODE != 'hybrid':
+        return False
+    return AuthorStats.objects.filter(
+        user_id=author_id,
+        follower_count__gt=settings.FOLLOW_FEED_FANOUT_LIMIT,
+    ).exists()
+
+
+def fan_out(post):
+    """Кладёт новый пост в ленты всех подписчиков автора."""
+    if not fanout_enabled() or is_popular(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post.pk,
+                       pub_date=post.pub_date)
+         for user_id in follower_ids.iterator()),
+        ignore_conflicts=True,
+    )
+    if post.pk % TRIM_EVERY == 0:
+        trim(list(follower_ids))
+
+
+def backfill(user_id, author_id):
+    """После подписки добавляет в ленту последние посты автора."""
+    if not fanout_enabled() or is_popular(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date'
+    ).values_list('pk', 'pub_date')[:settings.FOLLOW_FEED_BACKFILL]
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts),
+        ignore_conflicts=True,
+    )
+    trim([user_id])
+
+
+def trim(user_ids):
+    """Оставляет в лентах пользователей последние FOLLOW_FEED_LENGTH постов."""
+    length = settings.FOLLOW_FEED_LENGTH
+    for user_id in user_ids:
+        entries = TimelineEntry.objects.filter(user_id=user_id)
+        # Первая лишняя запись - по индексу ленты, без сортировки
+        extra = entries.order_by('-pub_date', '-post').values_list(
+            'pub_date', 'post'
+        )[length:length + 1]
+        for date, post_id in extra:
+            entries.filter(
+                Q(pub_date__lt=date) | Q(pub_date=date, post_id__lte=post_id)
+            ).delete()
+
+
+def prune(user_id, author_id):
+    """После отписки убирает посты автора из ленты."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def popular_ids(user):
+    """Авторы пользователя, чьи посты в гибридном режиме не раскладываются."""
+    return Follow.objects.filter(
+        user=user,
+        author__stats__follower_count__gt=settings.FOLLOW_FEED_FANOUT_LIMIT,
+    ).values_list('author', flat=True)
+
+
+def timeline_posts(user):
+    """Посты из TimelineEntry пользователя с ключом ленты для пагинации."""
+    return Post.objects.filter(timeline_entries__user=user).annotate(
+        timeline_date=F('timeline_entries__pub_date'),
+        timeline_post=F('timeline_entries__post'),
+    )
+
+
+def follow_paginator(user, per_page):
+    """Пагинатор ленты подписок по курсору для текущего режима."""
+    mode = settings.FOLLOW_FEED_MODE
+    if mode == 'join':
+        return KeysetPaginator(follow_feed(user).for_feed(), per_page)
+    timeline = TimelinePaginator(timeline_posts(user).for_feed(), per_page)
+    if mode == 'fanout':
+        return timeline
+
+    def parts():
+        # Каждый популярный автор - свой поиск по post_author_pub_date_idx
+        return [timeline] + [
+            KeysetPaginator(
+                Post.objects.filter(author_id=author_id).for_feed(), per_page
+            )
+            for author_id in popular_ids(user)
+        ]
+    return MergedKeysetPaginator(parts, per_page)
+
+
+def follow_feed(user):
+    """
+    Посты ленты подписок пользователя одним запросом - для постраничной
+    навигации по номеру; по курсору листает follow_paginator.
+    """
+    mode = settings.FOLLOW_FEED_MODE
+    if mode == 'join':
+        return Post.objects.filter(author__following__user=user)
+    timeline = Q(timeline_entries__user=user)
+    if mode == 'hybrid':
+        popular = popular_ids(user)
+        # Подзапросы вместо JOIN, чтобы посты не задвоились, если автор
+        # стал популярным, когда часть его постов уже разложена
+        timeline = Q(
+            pk__in=TimelineEntry.objects.filter(user=user).values('post')
+        ) | Q(author__in=popular)
+    return Post.objects.filter(timeline)
+
+
+def rebuild(user_ids=None):
+    """Пересобирает ленты заново, например после смены режима."""
+    follows = Follow.objects.all()
+    if user_ids is not None:
+        follows = follows.filter(user_id__in=user_ids)
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+    for user_id, author_id in follows.values_list(
+        'user_id', 'author_id'
+    ).iterator():
+        backfill(user_id, author_id)
@@ -0,0 +1,370 @@
+"""
+Потоковый приём картинок постов.
+
+Обработчик загрузки пишет картинку по кускам сразу в MEDIA_ROOT и по
+пути проверяет её: вес файла, формат и число пикселей по заголовку, без
+декодирования. Метаданные (EXIF, XMP, текстовые чанки PNG) вырезаются
+на лету, из EXIF остаётся только ориентация. У WebP размер RIFF
+в заголовке правится в уже записанном файле, когда известно, сколько
+вырезано. Готовый файл хранилище
+переносит на место переименованием, без повторного копирования,
+а хеш содержимого для core.storage считается тут же.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import warnings
+from abc import ABC, abstractmethod
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadedfile import (SimpleUploadedFile,
+                                            TemporaryUploadedFile,
+                                            UploadedFile)
+from django.core.files.uploadhandler import (FileUploadHandler,
+                                             StopFutureHandlers)
+from django.template.defaultfilters import filesizeformat
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import Image
+
+FIELD_NAME = 'image'
+# Каталог временных файлов загрузки внутри MEDIA_ROOT
+STAGING_DIR = 'uploads'
+FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+# Сколько байт начала файла можно держать в памяти ради заголовка
+HEADER_LIMIT = 512 * 1024
+ORIENTATION = 0x0112
+
+
+def staging_dir():
+    # Тот же диск, что и у MEDIA_ROOT: файл переносится переименованием
+    path = os.path.join(settings.MEDIA_ROOT, STAGING_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class StagedUploadedFile(TemporaryUploadedFile):
+    """Временный файл загрузки рядом с итоговым местом в MEDIA_ROOT."""
+
+    def __init__(self, name, content_type, charset, content_type_extra):
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(
+            suffix='.upload' + ext, dir=staging_dir()
+        )
+        UploadedFile.__init__(
+            self, file, name, content_type, 0, charset, content_type_extra
+        )
+
+
+class RejectedUpload(SimpleUploadedFile):
+    """Пустая загрузка с причиной отказа, её покажет PostForm."""
+
+    def __init__(self, name, upload_error):
+        super().__init__(name, b'')
+        self.upload_error = upload_error
+
+
+class MetadataFilter(ABC):
+    """Потоково вырезает из файла сегменты с метаданными."""
+
+    def __init__(self):
+        self.buffer = b''
+        self.started = False
+        self.keep = True
+        self.remaining = 0
+        self.passthrough = False
+        self.insert = b''
+
+    @abstractmethod
+    def next_segment(self, buffer):
+        """
+        Длина и судьба очередного сегмента: (length, keep).
+        None - мало данных; длина None - дальше метаданных не бывает.
+        """
+
+    def patch(self):
+        """Правка уже выданных байт после flush: (смещение, байты) или None."""
+        return None
+
+    def feed(self, data):
+        if self.passthrough:
+            return data
+        buffer = self.buffer + data
+        output = []
+        while buffer:
+            if self.remaining:
+                part = buffer[:self.remaining]
+                buffer = buffer[self.remaining:]
+                self.remaining -= len(part)
+                if self.keep:
+                    output.append(part)
+                continue
+            segment = self.next_segment(buffer)
+            if segment is None:
+                break
+            if self.insert:
+                output.append(self.insert)
+                self.insert = b''
+            length, keep = segment
+            if length is None:
+                self.passthrough = True
+                output.append(buffer)
+                buffer = b''
+                break
+            self.keep, self.remaining = keep, length
+        self.buffer = buffer
+        return b''.join(output)
+
+    def flush(self):
+        # Оборванный хвост пишем как есть, файл отвергнет валидация формы
+        rest, self.buffer = self.buffer, b''
+        return rest
+
+
+class JpegMetadataFilter(MetadataFilter):
+    # APP1 (EXIF, XMP), APP13 (IPTC) и комментарии
+    DROP = (0xE1, 0xED, 0xFE)
+
+    def __init__(self, orientation=None):
+        super().__init__()
+        self.orientation_segment = b''
+        if orientation and orientation != 1:
+            exif = Image.Exif()
+            exif[ORIENTATION] = orientation
+            payload = exif.tobytes()
+            self.orientation_segment = (
+                b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload
+            )
+
+    def next_segment(self, buffer):
+        if not self.started:
+            if len(buffer) < 2:
+                return None
+            self.started = True
+            return 2, True
+        if len(buffer) < 2:
+            return None
+        if buffer[0] != 0xFF:
+            return None, True
+        marker = buffer[1]
+        if marker == 0xFF:
+            # Байт-заполнитель перед маркером
+            return 1, True
+        if marker == 0xDA or 0xD0 <= marker <= 0xD9 or marker == 0x01:
+            # Начались сжатые данные
+            return None, True
+        if len(buffer) < 10:
+            return None
+        length = 2 + int.from_bytes(buffer[2:4], 'big')
+        if marker not in self.DROP:
+            return length, True
+        if buffer[4:10] == b'Exif\x00\x00':
+            self.insert = self.orientation_segment
+        return length, False
+
+
+class PngMetadataFilter(MetadataFilter):
+    DROP = (b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME')
+
+    def next_segment(self, buffer):
+        if not self.started:
+            if len(buffer) < 8:
+                return None
+            self.started = True
+            return 8, True
+        if len(buffer) < 8:
+            return None
+        # Длина данных, тип, данные и CRC
+        length = 12 + int.from_bytes(buffer[:4], 'big')
+        return length, buffer[4:8] not in self.DROP
+
+
+class WebpMetadataFilter(MetadataFilter):
+    """Чанки RIFF: EXIF и XMP вырезаются, их флаги в VP8X снимаются."""
+    DROP = (b'EXIF', b'XMP ')
+    # Флаги EXIF и XMP в первом байте данных VP8X
+    VP8X_METADATA = 0x08 | 0x04
+
+    def __init__(self):
+        super().__init__()
+        self.riff_size = 0
+        self.dropped = 0
+
+    def next_segment(self, buffer):
+        if not self.started:
+            if len(buffer) < 12:
+                return None
+            self.started = True
+            self.riff_size = int.from_bytes(buffer[4:8], 'little')
+            return 12, True
+        if len(buffer) < 8:
+            return None
+        fourcc = buffer[:4]
+        size = int.from_bytes(buffer[4:8], 'little')
+        # Тип, длина и данные, выровненные до чётной длины
+        length = 8 + size + size % 2
+        if fourcc in self.DROP:
+            self.dropped += length
+            return length, False
+        if fourcc == b'VP8X' and size == 10:
+            if len(buffer) < length:
+                return None
+            chunk = bytearray(buffer[:length])
+            chunk[8] &= ~self.VP8X_METADATA
+            self.insert = bytes(chunk)
+            return length, False
+        return length, True
+
+    def patch(self):
+        if not self.dropped:
+            return None
+        size = max(self.riff_size - self.dropped, 0)
+        return 4, size.to_bytes(4, 'little')
+
+
+class PassthroughFilter(MetadataFilter):
+    def next_segment(self, buffer):
+        return None, True
+
+
+def read_header(data):
+    """Формат, размеры и ориентация по началу файла или None."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(data)) as image:
+                orientation = None
+                if image.format == 'JPEG':
+                    orientation = image.getexif().get(ORIENTATION)
+                return image.format, image.size, orientation
+    except Image.DecompressionBombError:
+        # Размеры Pillow уже прочитал, но отказался открывать картинку
+        return None, (settings.IMAGE_UPLOAD_MAX_PIXELS + 1, 1), None
+    except Exception:
+        return None
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """Принимает поле image формы поста, остальные файлы пропускает."""
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name == FIELD_NAME
+        if not self.active:
+            return
+        self.received = 0
+        self.head = b''
+        self.filter = None
+        self.upload_error = None
+        self.digest = hashlib.sha256()
+        self.file = StagedUploadedFile(
+            self.file_name, self.content_type, self.charset,
+            self.content_type_extra
+        )
+        # Заявленной длине верить нельзя, но отказать по ней можно сразу
+        if (self.content_length or 0) > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.too_large()
+        raise StopFutureHandlers()
+
+    def too_large(self):
+        limit = filesizeformat(settings.IMAGE_UPLOAD_MAX_BYTES)
+        self.reject(f'Картинка больше {limit}')
+
+    def reject(self, message):
+        self.upload_error = message
+        self.head = None
+        self.file.close()
+
+    def check_header(self, final=False):
+        header = read_header(self.head)
+        if header is None:
+            if final or len(self.head) > HEADER_LIMIT:
+                self.reject('Загрузите картинку в формате JPEG, PNG, GIF '
+                            'или WebP')
+            return
+        image_format, (width, height), orientation = header
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            self.reject(
+                f'Картинка больше {settings.IMAGE_UPLOAD_MAX_PIXELS} пикселей'
+            )
+            return
+        if image_format not in FORMATS:
+            self.reject('Загрузите картинку в формате JPEG, PNG, GIF или WebP')
+            return
+        if image_format == 'JPEG':
+            self.filter = JpegMetadataFilter(orientation)
+        elif image_format == 'PNG':
+            self.filter = PngMetadataFilter()
+        elif image_format == 'WEBP':
+            self.filter = WebpMetadataFilter()
+        else:
+            self.filter = PassthroughFilter()
+        self.write(self.filter.feed(self.head))
+        self.head = None
+
+    def write(self, data):
+        self.digest.update(data)
+        self.file.write(data)
+
+    def rewrite(self, offset, data):
+        """Правит уже записанные байты и заново считает хеш файла."""
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.seek(0)
+        self.digest = hashlib.sha256()
+        for chunk in iter(lambda: self.file.read(self.chunk_size), b''):
+            self.digest.update(chunk)
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if self.upload_error:
+            return None
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self.too_large()
+        elif self.filter is None:
+            self.head += raw_data
+            self.check_header()
+        else:
+            self.write(self.filter.feed(raw_data))
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        if not self.upload_error and self.filter is None:
+            self.check_header(final=True)
+        if self.upload_error:
+            return RejectedUpload(self.file_name, self.upload_error)
+        self.write(self.filter.flush())
+        patch = self.filter.patch()
+        if patch:
+            self.rewrite(*patch)
+        # По хешу ContentAddressedStorage выберет имя, не перечитывая файл
+        self.file.sha256 = self.digest.hexdigest()
+        self.file.size = self.file.tell()
+        self.file.seek(0)
+        return self.file
+
+    def upload_interrupted(self):
+        if getattr(self, 'active', False):
+            self.file.close()
+
+
+def streaming_image_upload(view):
+    """
+    Включает ImageUploadHandler для view.
+
+    CsrfViewMiddleware разбирает тело запроса раньше вьюхи, поэтому
+    проверка CSRF переносится внутрь, после замены обработчиков.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, ImageUploadHandler(request))
+        return protected(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,117 @@
+"""
+Варианты картинки поста для srcset: несколько ширин в JPEG и WebP.
+
+Строятся фоновым воркером (posts/thumbnails.py). Размеры, вес и хеш
+каждого варианта лежат в ImageVariant, поэтому при показе ленты шаблону
+не нужны ни файловая система, ни Pillow.
+"""
+import hashlib
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, features
+
+from . import feed_cache
+from .models import ImageVariant, Post
+
+# Пропорции прежней миниатюры 960x339
+WIDTHS = (320, 640, 960)
+RATIO = 339 / 960
+QUALITY = {ImageVariant.JPEG: 85, ImageVariant.WEBP: 80}
+
+
+def formats():
+    """WebP, если Pillow собран с libwebp, и JPEG для всех браузеров."""
+    if features.check('webp'):
+        return (ImageVariant.WEBP, ImageVariant.JPEG)
+    return (ImageVariant.JPEG,)
+
+
+def render(source, width, image_format):
+    """Кадрирует картинку по центру до ширины width и кодирует её."""
+    image = ImageOps.fit(
+        source, (width, round(width * RATIO)), Image.LANCZOS
+    )
+    if image_format == ImageVariant.JPEG and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    buffer = io.BytesIO()
+    image.save(
+        buffer, image_format.upper(),
+        quality=QUALITY[image_format], optimize=True
+    )
+    return image.size, buffer.getvalue()
+
+
+def reuse(post):
+    """
+    Варианты той же картинки у другого поста. Имя картинки - хеш её
+    содержимого (core/storage.py), так что повторная загрузка бесплатна.
+    """
+    expected = {(f, w) for f in formats() for w in WIDTHS}
+    donor_ids = ImageVariant.objects.filter(
+        post__image=post.image.name
+    ).exclude(post=post).values_list('post_id', flat=True).distinct()
+    for donor_id in donor_ids[:5]:
+        donor = list(ImageVariant.objects.filter(post_id=donor_id))
+        if {(v.format, v.width) for v in donor} == expected:
+            for variant in donor:
+                variant.pk = None
+                variant.post = post
+            return donor
+    return None
+
+
+def render_all(post):
+    variants = []
+    with post.image.open('rb') as file, Image.open(file) as source:
+        source = ImageOps.exif_transpose(source)
+        for image_format in formats():
+            for width in WIDTHS:
+                (width, height), content = render(
+                    source, width, image_format
+                )
+                digest = hashlib.sha256(content).hexdigest()
+                variant_file = ContentFile(content)
+                variant_file.sha256 = digest
+                name = default_storage.save(
+                    f'posts/variants/{width}w.{image_format}', variant_file
+                )
+                variants.append(ImageVariant(
+                    post=post, file=name, format=image_format,
+                    width=width, height=height, size=len(content),
+                    sha256=digest,
+                ))
+    return variants
+
+
+def build(post_id):
+    """
+    Строит варианты картинки поста взамен прежних. Файлы прежних
+    вариантов могут быть общими с другими постами, их удаляет gc_media.
+    Если картинку заменили во время сборки, варианты не сохраняются.
+    """
+    post = Post.objects.get(pk=post_id)
+    variants = []
+    if post.image:
+        variants = reuse(post) or render_all(post)
+    with transaction.atomic():
+        # Пока шли рендеры, картинку могли заменить, и её варианты строит
+        # другой воркер: старые поверх новых не записываем. Файлы
+        # отброшенных вариантов удалит gc_media
+        current = Post.objects.select_for_update().filter(
+            pk=post_id
+        ).values_list('image', flat=True).first()
+        if current != post.image.name:
+            return []
+        post.image_variants.all().delete()
+        ImageVariant.objects.bulk_create(variants)
+        # Новая дата изменения сбрасывает закешированные карточки поста
+        post.save(update_fields=['updated'])
+    # Текст и группа не менялись, сигнал ленты не сбрасывает: новые
+    # варианты попадают только в ленты самого поста
+    feed_cache.bump(*feed_cache.post_feeds(post))
+    return variants
@@ -1,33 +1,68 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
 
+from core import replicas
+from core.db import write_queue
+from core.ratelimit import ratelimit
+
+from . import exporter, feed_cache, search, thumbnails
 from .forms import CommentForm, PostForm
 # Импортируем модель, чтобы обратиться к ней
-from .models import Comment, Follow, Group, Post, User
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .paginators import CommentPaginator, KeysetPaginator
+from .templatetags.follows import follows
+from .timeline import follow_feed, follow_paginator
+from .uploads import streaming_image_upload
 
 COUNT_POST = 10
+COUNT_COMMENTS = 20
 
 
-def my_paginator(request, post_list):
-    # Показывать по 10 записей на странице.
-    paginator = Paginator(post_list, COUNT_POST)
-    # Из URL извлекаем номер запрошенной страницы
-    # - это значение параметра page
-    page_number = request.GET.get('page')
-    # Получаем набор записей для страницы с запрошенным номером
-    return paginator.get_page(page_number)
+def my_paginator(request, post_list, feed=None, paginator=None):
+    # Старые ссылки вида ?page=N продолжают работать через Paginator
+    if 'page' in request.GET:
+        # Показывать по 10 записей на странице.
+        paginator = Paginator(post_list, COUNT_POST)
+        # Из URL извлекаем номер запрошенной страницы
+        # - это значение параметра page
+        page_number = request.GET.get('page')
+        # Получаем набор записей для страницы с запрошенным номером
+        return paginator.get_page(page_number)
+    # По умолчанию листаем по курсору: ?after=... старше, ?before=... новее
+    if paginator is None:
+        paginator = KeysetPaginator(post_list, COUNT_POST)
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if feed is None:
+        return paginator.get_cursor_page(after=after, before=before)
+    # Страницы именованных лент кешируются до следующей записи в ленту
+    return feed_cache.cached_page(feed, paginator, after, before)
 
 
-@cache_page(20, key_prefix='index_page')
 def index(request):
     template = 'posts/index.html'
     # Если порядок сортировки определен в классе Meta модели,
     # запрос будет выглядить так:
-    post_list = Post.objects.all()
-    page_obj = my_paginator(request, post_list)
+    post_list = Post.objects.for_feed()
+    page_obj = my_paginator(request, post_list, feed='index')
+    context = {
+        'page_obj': page_obj,
+    }
+    return render(request, template, context)
+
+
+def search_posts(request):
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        paginator = search.SearchPaginator(query, COUNT_POST)
+        page_obj = paginator.get_cursor_page(after=request.GET.get('after'))
     context = {
+        'query': query,
         'page_obj': page_obj,
     }
     return render(request, template, context)
@@ -36,8 +71,9 @@ def index(request):
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     template = 'posts/group_list.html'
-    post_list = Post.objects.all()
-    page_obj = my_paginator(request, post_list)
+    # Только посты группы: запрос идёт по индексу (group, pub_date)
+    post_list = group.posts.for_feed()
+    page_obj = my_paginator(request, post_list, feed=f'group:{group.pk}')
     context = {
         'page_obj': page_obj,
         'group': group,
@@ -47,41 +83,93 @@ def group_posts(request, slug):
 
 def profile(request, username):
     template = 'posts/profile.html'
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    # post_list = Post.objects.filter(author=author)
-    post_count = post_list.count()
-    page_obj = my_paginator(request, post_list)
-    if request.user.is_authenticated:
-        following = Follow.objects.filter(
-            user=request.user.id,
-            author=author.id
-        ).exists()
-    else:
-        following = False
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    post_list = author.posts.for_feed()
+    # Счётчики хранятся в AuthorStats, COUNT(*) на каждый показ не нужен
+    stats = AuthorStats.for_user(author)
+    page_obj = my_paginator(
+        request, post_list, feed=f'profile:{author.pk}'
+    )
+    # Подписки пользователя берутся из кеша, см. templatetags/follows.py
+    following = follows(request.user, author)
     context = {
         'author': author,
-        'post_count': post_count,
+        'post_count': stats.post_count,
+        'stats': stats,
         'page_obj': page_obj,
         'following': following,
     }
     return render(request, template, context)
 
 
+def post_detail_data(post_id):
+    """Часть страницы поста без пользователя, её кеширует feed_cache."""
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__stats'),
+        pk=post_id
+    )
+    comments = comment_paginator(post.pk).first_page()
+    return {
+        'post': post,
+        'author_posts': AuthorStats.for_user(post.author).post_count,
+        'comments': comments.object_list,
+        'more_comments': comments.has_next(),
+    }
+
+
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
-    form = CommentForm(request.POST)
-    comments = Comment.objects.filter(post=post)
+    # Анонимный просмотр обходится одним чтением кеша, без запросов к базе
+    data = feed_cache.cached_post(post_id, post_detail_data)
+    if request.GET.get('after'):
+        comments = comment_page(request, post_id)
+    else:
+        comments = comment_paginator(post_id).build_page(
+            data['comments'], has_older=data['more_comments'],
+            has_newer=False
+        )
+    context = {
+        'post': data['post'],
+        'author_posts': data['author_posts'],
+        # Форма своя у каждого пользователя и в кеш не попадает
+        'form': CommentForm(),
+        'comments': comments,
+    }
+    return render(request, template, context)
+
+
+def comment_paginator(post_id):
+    # Авторы подтягиваются тем же запросом, число запросов
+    # не зависит от числа комментариев
+    return CommentPaginator(
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        COUNT_COMMENTS
+    )
+
+
+def comment_page(request, post_id):
+    """Страница комментариев поста: первая или после курсора ?after=."""
+    return comment_paginator(post_id).get_cursor_page(
+        after=request.GET.get('after')
+    )
+
+
+def post_comments(request, post_id):
+    """Следующие комментарии поста HTML-фрагментом для подгрузки."""
+    template = 'posts/includes/comments.html'
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
     context = {
         'post': post,
-        'form': form,
-        'comments': comments
+        'comments': comment_page(request, post.pk),
     }
     return render(request, template, context)
 
 
+@ratelimit('post_create')
 @login_required
+@streaming_image_upload
 def post_create(request):
     template = 'posts/create_post.html'
     if request.method == 'POST':
@@ -90,6 +178,10 @@ def post_create(request):
             new_post = form.save(commit=False)
             new_post.author = request.user
             new_post.save()
+            if new_post.image:
+                thumbnails.schedule_on_commit(new_post)
+            # Свой пост автор увидит, даже если реплика ещё отстаёт
+            replicas.mark_write(request)
             return redirect('posts:profile', new_post.author)
         return render(request, template, {'form': form, 'is_edit': False})
     form = PostForm()
@@ -97,6 +189,7 @@ def post_create(request):
 
 
 @login_required
+@streaming_image_upload
 def post_edit(request, post_id):
     template = 'posts/create_post.html'
     post = get_object_or_404(Post, pk=post_id)
@@ -109,6 +202,9 @@ def post_edit(request, post_id):
         )
         if form.is_valid():
             post.save()
+            if 'image' in form.changed_data:
+                thumbnails.schedule_on_commit(post)
+            replicas.mark_write(request)
             return redirect('posts:post_detail', post_id)
         return render(request, template)
     else:
@@ -117,6 +213,7 @@ def post_edit(request, post_id):
     return render(request, template, context)
 
 
+@ratelimit('comment')
 @login_required
 def add_comment(request, post_id):
     # Получаем пост
@@ -126,7 +223,9 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        # Частая запись: через очередь писателя SQLite, см. core/db.py
+        write_queue.run(comment.save)
+        replicas.mark_write(request)
     return redirect('posts:post_detail', post_id=post_id)
 
 
@@ -134,32 +233,57 @@ def add_comment(request, post_id):
 def follow_index(request):
     # информация о текущем пользователе доступна в переменной request.user
     template = 'posts/follow.html'
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = my_paginator(request, post_list)
+    # Способ сборки ленты задаётся настройкой FOLLOW_FEED_MODE
+    post_list = follow_feed(request.user).for_feed()
+    page_obj = my_paginator(
+        request, post_list, feed=f'follow:{request.user.pk}',
+        paginator=follow_paginator(request.user, COUNT_POST)
+    )
     context = {
         'page_obj': page_obj,
     }
     return render(request, template, context)
 
 
+@ratelimit('follow', methods=('GET', 'POST'))
 @login_required
 def profile_follow(request, username):
     # Подписаться на автора
     author = get_object_or_404(User, username=username)
     user = request.user
     if author != user:
-        Follow.objects.get_or_create(
-            user=user, author=author
+        write_queue.run(
+            Follow.objects.get_or_create, user=user, author=author
         )
+        replicas.mark_write(request)
     return redirect('posts:profile', username=author.username)
 
 
+@ratelimit('follow', methods=('GET', 'POST'))
 @login_required
 def profile_unfollow(request, username):
     # Дизлайк, отписка
     author = get_object_or_404(User, username=username)
     user = request.user
-    Follow.objects.filter(
+    write_queue.run(Follow.objects.filter(
         user=user, author=author
-    ).delete()
+    ).delete)
+    replicas.mark_write(request)
     return redirect('posts:profile', username=author.username)
+
+
+@staff_member_required
+def export(request, dataset):
+    """Выгрузка данных потоком, память не зависит от числа строк."""
+    file_format = request.GET.get('format', 'jsonl')
+    if dataset not in exporter.DATASETS or file_format not in exporter.FORMATS:
+        raise Http404
+    extension = 'jsonl' if file_format == 'columns' else file_format
+    response = StreamingHttpResponse(
+        exporter.export(dataset, file_format),
+        content_type=exporter.FORMATS[file_format]
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{dataset}.{extension}"'
+    )
+    return response
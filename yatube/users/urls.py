@@ -1,6 +1,8 @@
 from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import path
 
+from core.ratelimit import ratelimit
+
 from . import views
 
 app_name = 'users'
@@ -13,12 +15,14 @@ urlpatterns = [
     ),
     path(
         'signup/',
-        views.SignUp.as_view(),
+        ratelimit('signup')(views.SignUp.as_view()),
         name='signup'
     ),
     path(
         'login/',
-        LoginView.as_view(template_name='users/login.html'),
+        ratelimit('login')(
+            LoginView.as_view(template_name='users/login.html')
+        ),
         name='login'
     ),
 ]
@@ -46,15 +46,17 @@ INSTALLED_APPS = [
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
     'about.apps.AboutConfig',
-    'sorl.thumbnail',
 ]
 
 MIDDLEWARE = [
+    # Первой, чтобы в замер попало время остальных middleware
+    'core.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,7 +65,8 @@ ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени рендера, см. core/metrics.py
+        'BACKEND': 'core.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -88,9 +91,60 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Соединение живёт между запросами, PRAGMA не выставляются заново
+        'CONN_MAX_AGE': 60,
     }
 }
 
+# YATUBE_REPLICAS=N добавляет N реплик для чтения лент - копий
+# db.sqlite3, которые обновляет manage.py sync_replicas, см. core/replicas.py
+DATABASE_REPLICAS = []
+for number in range(1, int(os.getenv('YATUBE_REPLICAS', 0)) + 1):
+    alias = f'replica-{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': os.path.join(BASE_DIR, f'db.{alias}.sqlite3'),
+        # В тестах реплика - та же тестовая база
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+# Вьюхи только для чтения, которые читают с реплик
+REPLICA_VIEWS = [
+    'posts:index',
+    'posts:group_posts',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+]
+# Модели этих приложений читаются с реплик; сессии и пользователи -
+# всегда с основной базы
+REPLICA_APPS = ['posts']
+# На сколько секунд реплика может отставать; столько же после записи
+# посетитель читает основную базу
+REPLICA_LAG = 10
+REPLICA_COOKIE = 'recent_write'
+
+# Выставляются на каждом соединении с SQLite, см. core/db.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    # Отрицательное значение - в килобайтах, здесь 64 МБ
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+# Частые записи идут через один поток-писатель, см. core.db.WriteQueue
+SQLITE_WRITE_QUEUE = True
+# Сколько накопившихся записей коммитить одной транзакцией
+SQLITE_WRITE_BATCH = 64
+
+
+# Сколько потоков выполняют вьюхи под ASGI, см. core/asgi.py
+ASGI_THREADS = 8
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -149,6 +203,86 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.locmem.LocMemCache',
     }
 }
+
+# YATUBE_CACHE=shared включает кеш, общий для всех воркеров:
+# L1 в памяти процесса + L2 в файле SQLite, см. core/cache/tiered.py
+if os.getenv('YATUBE_CACHE') == 'shared':
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache.tiered.TieredCache',
+            'OPTIONS': {
+                'SHARED': 'shared',
+                'MAX_ENTRIES': 1000,
+                'L1_TIMEOUT': 300,
+                'SYNC_INTERVAL': 1,
+            },
+        },
+        'shared': {
+            'BACKEND': 'core.cache.sqlite.SQLiteCache',
+            'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+            'OPTIONS': {
+                'MAX_ENTRIES': 100000,
+            },
+        },
+    }
+
+# Лимиты записи, см. core/ratelimit.py: имя -> {'user' или 'ip':
+# (сколько запросов, за сколько секунд)}
+RATELIMITS = {
+    'post_create': {'user': (10, 60), 'ip': (30, 60)},
+    'comment': {'user': (20, 60), 'ip': (60, 60)},
+    'follow': {'user': (30, 60), 'ip': (90, 60)},
+    'signup': {'ip': (5, 3600)},
+    'login': {'ip': (10, 60)},
+}
+# Корзины лимитов; с общим кешем - сразу в L2, общем для всех процессов
+RATELIMIT_CACHE = 'default'
+if os.getenv('YATUBE_CACHE') == 'shared':
+    RATELIMIT_CACHE = 'shared'
+
+# Сессии читаются из кеша, база - только при промахе: так отказ
+# по лимиту не делает запросов. С общим кешем - сразу в L2, чтобы
+# выход из аккаунта был виден всем процессам
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+if os.getenv('YATUBE_CACHE') == 'shared':
+    SESSION_CACHE_ALIAS = 'shared'
+
+# Лента подписок: 'join', 'fanout' или 'hybrid', см. posts/timeline.py
+FOLLOW_FEED_MODE = 'join'
+# В режиме 'hybrid' посты авторов с большим числом подписчиков
+# не раскладываются по лентам, а подмешиваются при чтении
+FOLLOW_FEED_FANOUT_LIMIT = 10000
+# Сколько последних постов автора добавить в ленту при подписке
+FOLLOW_FEED_BACKFILL = 1000
+# Сколько последних постов хранится в ленте подписок, см. timeline.trim
+FOLLOW_FEED_LENGTH = 1000
+
+# Сколько хранить страницы лент; устаревшими они становятся не по времени,
+# а при смене поколения ленты, см. posts/feed_cache.py
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Потоков для фоновой генерации миниатюр; 0 - строить сразу в запросе
+THUMBNAIL_WORKERS = 2
+
+# Лимиты картинки поста; проверяются при загрузке по заголовку файла,
+# без декодирования, см. posts/uploads.py
+IMAGE_UPLOAD_MAX_BYTES = 32 * 1024 * 1024
+IMAGE_UPLOAD_MAX_PIXELS = 50_000_000
+# Загрузки переносятся в MEDIA_ROOT из временного файла с правами 0600
+FILE_UPLOAD_PERMISSIONS = 0o644
+# Одинаковые файлы хранятся один раз, имя - хеш содержимого
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+
+# Доля запросов, которые core.metrics.RequestMetricsMiddleware добавляет
+# в гистограммы; YATUBE_METRICS_SAMPLE_RATE=1 - все
+METRICS_SAMPLE_RATE = float(os.getenv('YATUBE_METRICS_SAMPLE_RATE', 0.01))
+# Запросы дольше этого пишутся в лог вместе с долгими SQL, даже вне выборки
+METRICS_SLOW_REQUEST_MS = 500
+
+# Поиск: 'fts5', 'inverted' или 'auto' - FTS5, если SQLite её умеет,
+# см. posts/search.py
+SEARCH_BACKEND = 'auto'